@@ -0,0 +1,36 @@
+/*
+ * Fills the shared ingredient <datalist> from the catalog endpoint and keeps
+ * each part's hidden ingredient input in sync with its search box.
+ */
+(function ($) {
+    'use strict';
+
+    $(document).ready(function () {
+        var $catalog = $('#ingredient-catalog');
+        var idsByName = {};
+
+        if (!$catalog.length) {
+            return;
+        }
+
+        $.getJSON($catalog.data('url'), function (ingredients) {
+            var options = document.createDocumentFragment();
+
+            $.each(ingredients, function (i, ingredient) {
+                var option = document.createElement('option');
+                option.value = ingredient.name;
+                options.appendChild(option);
+                idsByName[ingredient.name] = ingredient.id;
+            });
+            $catalog.empty().append(options);
+        });
+
+        $(document).on('input change', '.ingredient-picker-search', function () {
+            var $search = $(this);
+            var id = idsByName[$search.val()];
+
+            $search.siblings('.ingredient-picker-value').val(
+                id === undefined ? '' : id);
+        });
+    });
+})(jQuery);
@@ -0,0 +1,5 @@
+"""Microbenchmarks of costing, cloning, forms and rendering.
+
+Run them with `manage.py benchmark`, save the results as a baseline, and
+compare later runs against it.
+"""
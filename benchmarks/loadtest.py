@@ -0,0 +1,288 @@
+"""HTTP load tests of the main recipe workflows.
+
+Virtual users log in, then go through recipes over and over: they list
+them, open one, save it unchanged with its parts formset, clone it, upload
+an image to the clone and delete it, so the library stays the same size.
+Requests are timed per URL name, and summed up in the format of
+`benchmarks.results`.
+"""
+import math
+import multiprocessing
+import random
+import re
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from socketserver import ThreadingMixIn
+from time import perf_counter
+from urllib.parse import urljoin
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import requests
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from django.db import connections
+from PIL import Image
+
+from benchmarks.suite import QUIET_LOGGERS, quiet
+from recipes.images import encode
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_DURATION = 30
+REQUEST_TIMEOUT = 30
+UPLOAD_SIZE = (1600, 1200)
+
+# Besides the timing lines, the login page logs the social apps that aren't
+# set up, on every render.
+SERVER_QUIET_LOGGERS = QUIET_LOGGERS + ['django.template']
+
+RECIPE_LINK = re.compile(r'href="[^"]*/recipes/recipes/(\d+)/"')
+
+
+def percentile(values, fraction):
+    """Returns the nearest-rank percentile of sorted `values`."""
+    # Rounded first, so that float errors don't skip to the next rank.
+    rank = math.ceil(round(fraction * len(values), 9))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+def upload_image():
+    noise = Image.effect_noise(UPLOAD_SIZE, 32).convert('RGB')
+    return encode(Image.blend(
+        Image.new('RGB', UPLOAD_SIZE, (180, 120, 60)), noise, 0.3), 'JPEG')
+
+
+class FormParser(HTMLParser):
+    """Collects the values every form of a page would submit."""
+    def __init__(self):
+        super().__init__()
+        self.forms = []
+        self._select = None
+        self._textarea = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'form':
+            self.forms.append({})
+        elif not self.forms:
+            return
+        elif tag == 'input' and attrs.get('name'):
+            input_type = attrs.get('type', 'text')
+            if input_type in ('file', 'submit', 'button', 'image'):
+                return
+            if input_type in ('checkbox', 'radio') and 'checked' not in attrs:
+                return
+            self.forms[-1][attrs['name']] = attrs.get('value', '')
+        elif tag == 'select' and attrs.get('name'):
+            self._select = attrs['name']
+            self.forms[-1].setdefault(self._select, '')
+        elif tag == 'option' and self._select and 'selected' in attrs:
+            self.forms[-1][self._select] = attrs.get('value', '')
+        elif tag == 'textarea' and attrs.get('name'):
+            self._textarea = attrs['name']
+            self.forms[-1][self._textarea] = ''
+
+    def handle_endtag(self, tag):
+        if tag == 'select':
+            self._select = None
+        elif tag == 'textarea':
+            self._textarea = None
+
+    def handle_data(self, data):
+        if self._textarea:
+            self.forms[-1][self._textarea] += data
+
+
+def form_data(html, field):
+    """Returns the data of the form of a page that has `field`."""
+    parser = FormParser()
+    parser.feed(html)
+    for form in parser.forms:
+        if field in form:
+            return form
+    raise ValueError('No form has a {} field'.format(field))
+
+
+class RequestFailed(Exception):
+    pass
+
+
+class VirtualUser:
+    """One logged in browser, going through the recipe workflows."""
+    def __init__(self, base_url, username, password, seed, image):
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        self.rng = random.Random(seed)
+        self.image = image
+        self.session = requests.Session()
+        self.latencies = {}
+        self.errors = {}
+
+    def request(self, name, method, url, **kwargs):
+        kwargs.setdefault('allow_redirects', False)
+        if method == 'post':
+            kwargs.setdefault('data', {})['csrfmiddlewaretoken'] = (
+                self.session.cookies.get('csrftoken', ''))
+            kwargs.setdefault('headers', {})['Referer'] = self.base_url
+        start = perf_counter()
+        try:
+            response = getattr(self.session, method)(
+                urljoin(self.base_url, url), timeout=REQUEST_TIMEOUT,
+                **kwargs)
+        except requests.RequestException as e:
+            self.fail(name)
+            raise RequestFailed(e)
+        self.latencies.setdefault(name, []).append(perf_counter() - start)
+        # Forms that are sent back with errors aren't saved.
+        if response.status_code >= 400 or (
+                method == 'post' and response.status_code == 200):
+            self.fail(name)
+            raise RequestFailed('{} {}: {}'.format(
+                method.upper(), url, response.status_code))
+        return response
+
+    def fail(self, name):
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+    def login(self):
+        url = reverse('account_login')
+        data = form_data(self.request('account_login', 'get', url).text,
+                         'login')
+        data.update(login=self.username, password=self.password)
+        self.request('account_login:post', 'post', url, data=data)
+
+    def browse(self):
+        """Goes through the workflows once.
+
+        Deleting the clone doesn't delete the image uploaded to it, so each
+        time leaves one image, and its variants, in the media storage.
+        """
+        recipes = RECIPE_LINK.findall(
+            self.request('recipes', 'get', reverse('recipes')).text)
+        if not recipes:
+            raise RequestFailed('{} has no recipes'.format(self.username))
+        pk = self.rng.choice(recipes)
+
+        self.request('recipe-detail', 'get', reverse(
+            'recipe-detail', kwargs={'pk': pk}))
+        self.save(pk, 'recipe-update:post')
+
+        clone = self.request(
+            'recipe-clone', 'get', reverse('recipe-clone', kwargs={'pk': pk}))
+        clone_pk = re.search(r'(\d+)/?$', clone.headers['Location']).group(1)
+        self.save(clone_pk, 'recipe-update:image', files={
+            'image': ('load.jpg', self.image, 'image/jpeg')})
+        self.request('recipe-delete:post', 'post', reverse(
+            'recipe-delete', kwargs={'pk': clone_pk}))
+
+    def save(self, pk, name, **kwargs):
+        url = reverse('recipe-update', kwargs={'pk': pk})
+        data = form_data(self.request('recipe-update', 'get', url).text,
+                         'name')
+        self.request(name, 'post', url, data=data, **kwargs)
+
+    def run(self, deadline=None, iterations=None):
+        try:
+            self.login()
+        except RequestFailed:
+            return self
+        done = 0
+        while (iterations is None or done < iterations) and (
+                deadline is None or perf_counter() < deadline):
+            try:
+                self.browse()
+            except RequestFailed:
+                pass
+            done += 1
+        return self
+
+
+def summarize(users, duration):
+    """Returns the results of each URL name, and of all the requests."""
+    latencies = {}
+    errors = {}
+    for user in users:
+        for name, values in user.latencies.items():
+            latencies.setdefault(name, []).extend(values)
+        for name, count in user.errors.items():
+            errors[name] = errors.get(name, 0) + count
+    latencies['total'] = [
+        value for values in latencies.values() for value in values]
+    errors['total'] = sum(errors.values())
+
+    results = {}
+    for name, values in sorted(latencies.items()):
+        values.sort()
+        results['loadtest/{}'.format(name)] = {
+            'requests': len(values),
+            'errors': errors.get(name, 0),
+            'throughput': len(values) / duration if duration else 0.0,
+            'median': percentile(values, 0.5) if values else 0.0,
+            'p95': percentile(values, 0.95) if values else 0.0,
+            'p99': percentile(values, 0.99) if values else 0.0,
+            'min': values[0] if values else 0.0,
+            'max': values[-1] if values else 0.0,
+        }
+    return results
+
+
+def run_load_test(base_url, usernames, password,
+                  concurrency=DEFAULT_CONCURRENCY, duration=DEFAULT_DURATION,
+                  iterations=None, seed=None):
+    """Runs `concurrency` virtual users for `duration` seconds, or for
+    `iterations` each, and returns their results.
+    """
+    image = upload_image()
+    users = [
+        VirtualUser(
+            base_url, usernames[index % len(usernames)], password,
+            None if seed is None else seed + index, image)
+        for index in range(concurrency)
+    ]
+    start = perf_counter()
+    deadline = None if iterations else start + duration
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(
+            lambda user: user.run(deadline, iterations), users))
+    return summarize(users, perf_counter() - start)
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, ready):
+    # Requests come from this host, with its address as the host name.
+    settings.ALLOWED_HOSTS = list(settings.ALLOWED_HOSTS) + ['127.0.0.1']
+    from glaze.wsgi import application
+    server = make_server(
+        '127.0.0.1', port, application, server_class=ThreadingWSGIServer,
+        handler_class=QuietHandler)
+    ready.put(server.server_port)
+    with quiet(SERVER_QUIET_LOGGERS):
+        server.serve_forever()
+
+
+class LocalServer:
+    """Serves `glaze.wsgi.application` from another process."""
+    def __init__(self, port=0):
+        self.port = port
+        self.process = None
+
+    def __enter__(self):
+        # The forked server must not share this process' connections.
+        connections.close_all()
+        ready = multiprocessing.Queue()
+        self.process = multiprocessing.Process(
+            target=serve, args=(self.port, ready), daemon=True)
+        self.process.start()
+        return 'http://127.0.0.1:{}'.format(ready.get(timeout=30))
+
+    def __exit__(self, type, value, traceback):
+        self.process.terminate()
+        self.process.join()
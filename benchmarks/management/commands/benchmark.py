@@ -0,0 +1,108 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from benchmarks import results as benchmark_results, suite
+
+
+def milliseconds(seconds):
+    return '{:.3f}ms'.format(seconds * 1000)
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs the benchmarks, or compares results against a baseline. '
+        'Benchmark data is written to the database and rolled back. Fails '
+        'when a benchmark takes longer than its time budget.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--only', action='append', choices=[
+                name for name, setup in suite.BENCHMARKS],
+            help='Only run this benchmark. Can be given more than once.')
+        parser.add_argument(
+            '--sizes',
+            help='Comma separated library sizes to run on, out of {}. All of '
+                 'them by default.'.format(', '.join(suite.SIZES)))
+        parser.add_argument(
+            '--repeat', type=int, default=suite.DEFAULT_REPEAT,
+            help='How many times to time each benchmark.')
+        parser.add_argument(
+            '--output',
+            help='Save the results to this JSON file.')
+        parser.add_argument(
+            '--baseline',
+            help='Compare the results against this JSON file.')
+        parser.add_argument(
+            '--results',
+            help='Compare this JSON file instead of running the benchmarks.')
+        parser.add_argument(
+            '--threshold', type=float,
+            default=benchmark_results.DEFAULT_THRESHOLD,
+            help='How much slower than the baseline is a regression, as a '
+                 'fraction.')
+        parser.add_argument(
+            '--metric', default='median',
+            choices=['median', 'min', 'p95', 'p99'],
+            help='Which timing to compare. The minimum is the least noisy, '
+                 'and load test results have percentiles.')
+
+    def handle(self, *args, **options):
+        if options['results']:
+            if not options['baseline']:
+                raise CommandError('--results needs a --baseline')
+            current = benchmark_results.load(options['results'])
+        else:
+            current = self.run(options)
+
+        if options['output']:
+            benchmark_results.save(options['output'], current)
+            self.stdout.write('Results saved to {}'.format(options['output']))
+        self.check_budgets(current)
+        if options['baseline']:
+            self.compare(
+                benchmark_results.load(options['baseline']), current,
+                options['threshold'], options['metric'])
+
+    def run(self, options):
+        sizes = [
+            size for size in (options['sizes'] or '').split(',') if size
+        ] or list(suite.SIZES)
+        unknown = set(sizes) - set(suite.SIZES)
+        if unknown:
+            raise CommandError('Unknown sizes: {}'.format(
+                ', '.join(sorted(unknown))))
+
+        def progress(name, timings):
+            self.stdout.write(
+                '{:<36} {:>12} (min {}, {} calls per run)'.format(
+                    name, milliseconds(timings['median']),
+                    milliseconds(timings['min']), timings['iterations']))
+
+        return suite.run_benchmarks(
+            sizes, options['only'], options['repeat'], progress)
+
+    def check_budgets(self, results):
+        over_budget = suite.over_budget(results)
+        if over_budget:
+            raise CommandError('Over their time budget: {}'.format(', '.join(
+                '{} ({} > {})'.format(
+                    name, milliseconds(results[name]['median']),
+                    milliseconds(suite.TIME_BUDGETS[name]))
+                for name in over_budget)))
+
+    def compare(self, baseline, current, threshold, metric):
+        comparisons = benchmark_results.compare(
+            baseline, current, threshold, metric)
+        for comparison in comparisons:
+            self.stdout.write('{:<36} {:>12} -> {:>12} {:+8.1%}{}'.format(
+                comparison.name, milliseconds(comparison.baseline),
+                milliseconds(comparison.current), comparison.change,
+                '  REGRESSED' if comparison.regressed else ''))
+
+        regressed = [
+            comparison for comparison in comparisons if comparison.regressed]
+        if regressed:
+            raise CommandError(
+                '{} of {} benchmarks regressed by more than {:.0%}'.format(
+                    len(regressed), len(comparisons), threshold))
+        self.stdout.write('{} benchmarks compared, none regressed'.format(
+            len(comparisons)))
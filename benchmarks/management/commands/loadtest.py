@@ -0,0 +1,110 @@
+from django.contrib.auth.models import User
+from django.core.management.base import CommandError
+
+from benchmarks import loadtest, results as benchmark_results
+from benchmarks.management.commands.benchmark import (
+    Command as BenchmarkCommand,
+    milliseconds,
+)
+
+
+class Command(BenchmarkCommand):
+    help = (
+        'Load tests the recipe workflows over HTTP, as users made by '
+        'generate_dataset. Recipes are cloned and deleted on the way, but '
+        'the image uploaded to each clone stays in the media storage, with '
+        'its variants and thumbnails: every iteration of every user adds '
+        'a few hundred KB.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            help='Load test the server at this URL, instead of serving '
+                 'glaze.wsgi.application from another process.')
+        parser.add_argument(
+            '--port', type=int, default=0,
+            help='Port of the local server. A free one by default.')
+        parser.add_argument(
+            '--concurrency', type=int, default=loadtest.DEFAULT_CONCURRENCY,
+            help='How many users browse at the same time.')
+        parser.add_argument(
+            '--duration', type=float, default=loadtest.DEFAULT_DURATION,
+            help='How many seconds to run for.')
+        parser.add_argument(
+            '--iterations', type=int,
+            help='Go through the workflows this many times per user, '
+                 'instead of for a duration.')
+        parser.add_argument(
+            '--users', type=int, default=10,
+            help='How many of the generated users to log in as.')
+        parser.add_argument(
+            '--username-prefix', default='user',
+            help='Prefix the generated users were named with.')
+        parser.add_argument(
+            '--password', default='glaze',
+            help='Password of the generated users.')
+        parser.add_argument(
+            '--seed', type=int,
+            help='Seed for the recipes users pick.')
+        parser.add_argument(
+            '--output',
+            help='Save the results to this JSON file.')
+        parser.add_argument(
+            '--baseline',
+            help='Compare the results against this JSON file.')
+        parser.add_argument(
+            '--threshold', type=float,
+            default=benchmark_results.DEFAULT_THRESHOLD,
+            help='How much slower than the baseline is a regression, as a '
+                 'fraction.')
+        parser.add_argument(
+            '--metric', default='p95', choices=['median', 'p95', 'p99'],
+            help='Which latency to compare.')
+
+    def handle(self, *args, **options):
+        usernames = [
+            '{}{}'.format(options['username_prefix'], index + 1)
+            for index in range(options['users'])
+        ]
+        if User.objects.filter(username__in=usernames).count() < len(
+                usernames):
+            raise CommandError(
+                'Users {} to {} are missing, generate them with '
+                'generate_dataset first'.format(usernames[0], usernames[-1]))
+
+        kwargs = {
+            'usernames': usernames,
+            'password': options['password'],
+            'concurrency': options['concurrency'],
+            'duration': options['duration'],
+            'iterations': options['iterations'],
+            'seed': options['seed'],
+        }
+        if options['url']:
+            results = loadtest.run_load_test(options['url'], **kwargs)
+        else:
+            with loadtest.LocalServer(options['port']) as url:
+                self.stdout.write('Serving on {}'.format(url))
+                results = loadtest.run_load_test(url, **kwargs)
+        self.report(results)
+
+        if options['output']:
+            benchmark_results.save(options['output'], results)
+            self.stdout.write('Results saved to {}'.format(options['output']))
+        if options['baseline']:
+            self.compare(
+                benchmark_results.load(options['baseline']), results,
+                options['threshold'], options['metric'])
+
+    def report(self, results):
+        self.stdout.write(
+            '{:<40} {:>8} {:>8} {:>10} {:>10} {:>10} {:>7}'.format(
+                'URL name', 'requests', 'req/s', 'p50', 'p95', 'p99',
+                'errors'))
+        for name, result in results.items():
+            self.stdout.write(
+                '{:<40} {:>8} {:>8.1f} {:>10} {:>10} {:>10} {:>7}'.format(
+                    name, result['requests'], result['throughput'],
+                    milliseconds(result['median']),
+                    milliseconds(result['p95']), milliseconds(result['p99']),
+                    result['errors']))
@@ -0,0 +1,57 @@
+"""Benchmark results, stored as JSON to compare runs with.
+
+Results map a benchmark name to its timings, in seconds, and have at least
+a `median`.
+"""
+import json
+import platform
+from collections import namedtuple
+from datetime import datetime
+
+import django
+from django.db import connection
+
+DEFAULT_THRESHOLD = 0.1
+
+Comparison = namedtuple(
+    'Comparison', ['name', 'baseline', 'current', 'change', 'regressed'])
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'machine': platform.machine(),
+        'node': platform.node(),
+    }
+
+
+def save(path, results):
+    with open(path, 'w') as f:
+        json.dump({
+            'created': datetime.utcnow().isoformat(),
+            'environment': environment(),
+            'results': results,
+        }, f, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD, metric='median'):
+    """Compares the benchmarks both results have.
+
+    A benchmark has regressed when it got slower by more than `threshold`,
+    as a fraction of its baseline.
+    """
+    comparisons = []
+    for name in sorted(set(baseline) & set(current)):
+        old = baseline[name][metric]
+        new = current[name][metric]
+        change = (new - old) / old if old else 0.0
+        comparisons.append(
+            Comparison(name, old, new, change, change > threshold))
+    return comparisons
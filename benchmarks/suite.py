@@ -0,0 +1,222 @@
+"""The benchmarks, and the libraries they run on."""
+import logging
+import statistics
+import timeit
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import transaction
+from django.test import Client, override_settings
+
+from recipes.costing import simulate_repricing
+from recipes.dataset import DatasetGenerator
+from recipes.forms import RecipePartFormset
+from recipes.models import Ingredient, Recipe
+
+# Libraries of one user each, by name.
+SIZES = OrderedDict([
+    ('small', {'recipes_per_user': 10, 'parts_per_recipe': 5}),
+    ('medium', {'recipes_per_user': 100, 'parts_per_recipe': 10}),
+    ('large', {'recipes_per_user': 1000, 'parts_per_recipe': 20}),
+    ('xlarge', {'recipes_per_user': 10000, 'parts_per_recipe': 20}),
+])
+INGREDIENTS_PER_USER = 50
+SEED = 1
+DEFAULT_REPEAT = 5
+# Most seconds the median of a benchmark may take, by result name.
+TIME_BUDGETS = {
+    'simulate-repricing/xlarge': 1.0,
+}
+# Ingredients whose price `simulate-repricing` doubles.
+REPRICED_INGREDIENTS = 5
+
+# Renders go through a private cache, so that clearing it before each one
+# leaves the real cache alone.
+BENCHMARK_SETTINGS = {
+    'CACHES': {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'benchmarks',
+        },
+    },
+    'ALLOWED_HOSTS': ['testserver'],
+    'DEBUG': False,
+}
+
+# Loggers that would write a line per rendered page.
+QUIET_LOGGERS = ['glaze.timing']
+
+BENCHMARKS = []
+
+
+def benchmark(name):
+    """Registers a benchmark.
+
+    It's a function that takes a `Library` and returns what to time.
+    """
+    def register(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return register
+
+
+class Library:
+    """A user with recipes, always the same ones for a size."""
+    def __init__(self, size, recipes_per_user, parts_per_recipe):
+        prefix = 'benchmark-{}-'.format(size)
+        generator = DatasetGenerator(
+            users=1, ingredients_per_user=INGREDIENTS_PER_USER,
+            recipes_per_user=recipes_per_user,
+            parts_per_recipe=parts_per_recipe, seed=SEED,
+            username_prefix=prefix)
+        for done in generator.generate():
+            pass
+        self.user = User.objects.get(username=prefix + '1')
+        self.recipe = Recipe.objects.for_user(self.user).earliest('pk')
+
+    def client(self):
+        client = Client()
+        client.force_login(self.user)
+        return client
+
+
+def render(client, url):
+    def run():
+        cache.clear()
+        response = client.get(url)
+        assert response.status_code == 200, response.status_code
+    return run
+
+
+def formset_data(recipe, user):
+    """Returns the POST data of an unchanged recipe part formset."""
+    formset = RecipePartFormset(instance=recipe, form_kwargs={'user': user})
+    data = {
+        formset.management_form.add_prefix(name): value
+        for name, value in formset.management_form.initial.items()
+    }
+    for form in formset.initial_forms:
+        for name in form.fields:
+            value = form[name].value()
+            data[form.add_prefix(name)] = '' if value is None else value
+    return data
+
+
+@benchmark('recipe-price')
+def recipe_price(library):
+    recipe = library.recipe
+    return lambda: recipe.price
+
+
+@benchmark('part-relative-price')
+def part_relative_price(library):
+    parts = list(library.recipe.parts.select_related('ingredient'))
+    return lambda: [part.relative_price for part in parts]
+
+
+@benchmark('recipe-clone')
+def recipe_clone(library):
+    def run():
+        with transaction.atomic():
+            Recipe.objects.get(pk=library.recipe.pk).clone()
+            transaction.set_rollback(True)
+    return run
+
+
+@benchmark('part-formset')
+def part_formset(library):
+    recipe = library.recipe
+    data = formset_data(recipe, library.user)
+
+    def run():
+        formset = RecipePartFormset(
+            data, instance=recipe, form_kwargs={'user': library.user})
+        assert formset.is_valid(), formset.errors
+    return run
+
+
+@benchmark('recipe-list-render')
+def recipe_list_render(library):
+    return render(library.client(), reverse('recipes'))
+
+
+@benchmark('recipe-detail-render')
+def recipe_detail_render(library):
+    return render(library.client(), library.recipe.get_absolute_url())
+
+
+@benchmark('simulate-repricing')
+def repricing(library):
+    recipes = Recipe.objects.for_user(library.user)
+    prices = {
+        pk: price * 2
+        for pk, price in Ingredient.objects.for_user(library.user).order_by(
+            'pk').values_list('pk', 'price')[:REPRICED_INGREDIENTS]
+    }
+    return lambda: simulate_repricing(recipes, prices)
+
+
+def over_budget(results):
+    """Returns the names of the results whose median is over their budget in
+    `TIME_BUDGETS`."""
+    return [
+        name for name, timings in results.items()
+        if name in TIME_BUDGETS and timings['median'] > TIME_BUDGETS[name]
+    ]
+
+
+@contextmanager
+def quiet(names):
+    loggers = [logging.getLogger(name) for name in names]
+    disabled = [logger.disabled for logger in loggers]
+    for logger in loggers:
+        logger.disabled = True
+    try:
+        yield
+    finally:
+        for logger, was_disabled in zip(loggers, disabled):
+            logger.disabled = was_disabled
+
+
+def measure(run, repeat=DEFAULT_REPEAT):
+    """Returns the timings of one call of `run`, in seconds.
+
+    Each of the `repeat` runs calls it as many times as it takes about 0.2
+    seconds.
+    """
+    timer = timeit.Timer(run)
+    number, _ = timer.autorange()
+    runs = [total / number for total in timer.repeat(repeat, number)]
+    return {
+        'median': statistics.median(runs),
+        'min': min(runs),
+        'max': max(runs),
+        'iterations': number,
+        'runs': runs,
+    }
+
+
+def run_benchmarks(sizes=None, names=None, repeat=DEFAULT_REPEAT,
+                   progress=None):
+    """Runs the benchmarks on the libraries of `sizes`, and rolls every
+    change back.
+
+    Results are keyed by `<benchmark>/<size>`.
+    """
+    results = OrderedDict()
+    with override_settings(**BENCHMARK_SETTINGS), quiet(QUIET_LOGGERS), \
+            transaction.atomic():
+        for size in sizes or SIZES:
+            library = Library(size, **SIZES[size])
+            for name, setup in BENCHMARKS:
+                if names and name not in names:
+                    continue
+                key = '{}/{}'.format(name, size)
+                results[key] = measure(setup(library), repeat)
+                if progress:
+                    progress(key, results[key])
+        transaction.set_rollback(True)
+    return results
@@ -0,0 +1,96 @@
+import json
+import os
+import tempfile
+from collections import OrderedDict
+from io import StringIO
+from shutil import rmtree
+from unittest.mock import patch
+
+from django.core.management import CommandError, call_command
+
+from benchmarks import results
+from benchmarks.suite import BENCHMARKS
+from recipes.models import Recipe
+from recipes.tests.base import RecipeTestCase
+
+
+@patch('benchmarks.suite.SIZES', OrderedDict([
+    ('tiny', {'recipes_per_user': 2, 'parts_per_recipe': 2}),
+]))
+class BenchmarkTest(RecipeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(rmtree, self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def save(self, name, medians):
+        results.save(self.path(name), {
+            key: {'median': median} for key, median in medians.items()})
+
+    def test_runs_every_benchmark(self):
+        out = StringIO()
+
+        call_command(
+            'benchmark', sizes='tiny', repeat=1, output=self.path('new.json'),
+            stdout=out)
+
+        with open(self.path('new.json')) as f:
+            saved = json.load(f)
+        self.assertEqual(
+            sorted(saved['results']),
+            sorted('{}/tiny'.format(name) for name, setup in BENCHMARKS))
+        self.assertEqual(saved['environment']['database'], 'sqlite')
+        self.assertIn('recipe-clone/tiny', out.getvalue())
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_runs_some_benchmarks(self):
+        call_command(
+            'benchmark', sizes='tiny', repeat=1, only=['recipe-price'],
+            output=self.path('new.json'), stdout=StringIO())
+
+        self.assertEqual(
+            list(results.load(self.path('new.json'))), ['recipe-price/tiny'])
+
+    def test_fails_over_time_budgets(self):
+        out = StringIO()
+
+        with patch.dict('benchmarks.suite.TIME_BUDGETS', {
+                'recipe-price/tiny': 0.0}), self.assertRaisesMessage(
+                    CommandError, 'Over their time budget: recipe-price/tiny'):
+            call_command(
+                'benchmark', sizes='tiny', repeat=1, only=['recipe-price'],
+                output=self.path('new.json'), stdout=out)
+
+        self.assertEqual(
+            list(results.load(self.path('new.json'))), ['recipe-price/tiny'])
+
+    def test_refuses_unknown_sizes(self):
+        with self.assertRaisesMessage(CommandError, 'Unknown sizes: huge'):
+            call_command('benchmark', sizes='huge', stdout=StringIO())
+
+    def test_compares_results_with_a_baseline(self):
+        self.save('old.json', {'a': 1.0, 'b': 1.0})
+        self.save('new.json', {'a': 1.05, 'b': 0.5})
+        out = StringIO()
+
+        call_command(
+            'benchmark', baseline=self.path('old.json'),
+            results=self.path('new.json'), stdout=out)
+
+        self.assertIn('2 benchmarks compared, none regressed', out.getvalue())
+
+    def test_fails_on_regressions(self):
+        self.save('old.json', {'a': 1.0, 'b': 1.0})
+        self.save('new.json', {'a': 1.5, 'b': 1.0})
+        out = StringIO()
+
+        with self.assertRaisesMessage(
+                CommandError, '1 of 2 benchmarks regressed by more than 20%'):
+            call_command(
+                'benchmark', baseline=self.path('old.json'),
+                results=self.path('new.json'), threshold=0.2, stdout=out)
+
+        self.assertIn('REGRESSED', out.getvalue())
@@ -0,0 +1,158 @@
+import os
+import tempfile
+from io import StringIO
+from shutil import rmtree
+from unittest.mock import patch
+
+from django.core.management import CommandError, call_command
+from django.test import LiveServerTestCase, SimpleTestCase, override_settings
+
+from benchmarks import results
+from benchmarks.loadtest import (
+    SERVER_QUIET_LOGGERS,
+    VirtualUser,
+    form_data,
+    percentile,
+    summarize,
+)
+from benchmarks.suite import quiet
+from recipes.dataset import DatasetGenerator
+from recipes.models import Recipe
+
+
+class PercentileTest(SimpleTestCase):
+    def test_gets_nearest_rank(self):
+        values = list(range(1, 101))
+
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.95), 95)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile(values, 1), 100)
+
+    def test_gets_only_value(self):
+        self.assertEqual(percentile([3], 0.99), 3)
+
+
+class FormDataTest(SimpleTestCase):
+    def test_gets_what_form_would_submit(self):
+        html = '''
+            <form><input name="language" value="en"></form>
+            <form method="post">
+                <input type="text" name="name" value="Tenmoku &amp; ash">
+                <input type="checkbox" name="DELETE">
+                <input type="checkbox" name="public" checked>
+                <input type="file" name="image">
+                <select name="unit">
+                    <option value="1">Kg</option>
+                    <option value="2" selected>lb</option>
+                </select>
+                <textarea name="description">Fire to &lt;cone 10</textarea>
+                <input type="submit" name="save" value="Save">
+            </form>
+        '''
+
+        self.assertEqual(form_data(html, 'name'), {
+            'name': 'Tenmoku & ash',
+            'public': '',
+            'unit': '2',
+            'description': 'Fire to <cone 10',
+        })
+
+    def test_refuses_page_without_field(self):
+        with self.assertRaises(ValueError):
+            form_data('<form><input name="login"></form>', 'name')
+
+
+class SummarizeTest(SimpleTestCase):
+    def user(self, latencies, errors):
+        user = VirtualUser('http://testserver', 'user1', 'glaze', 1, b'')
+        user.latencies = latencies
+        user.errors = errors
+        return user
+
+    def test_sums_up_every_url_name(self):
+        users = [
+            self.user({'recipes': [0.3, 0.1]}, {}),
+            self.user({'recipes': [0.2], 'recipe-detail': [0.4]},
+                      {'recipe-detail': 1}),
+        ]
+
+        summary = summarize(users, 2)
+
+        self.assertEqual(
+            list(summary),
+            ['loadtest/recipe-detail', 'loadtest/recipes', 'loadtest/total'])
+        self.assertEqual(summary['loadtest/recipes'], {
+            'requests': 3,
+            'errors': 0,
+            'throughput': 1.5,
+            'median': 0.2,
+            'p95': 0.3,
+            'p99': 0.3,
+            'min': 0.1,
+            'max': 0.3,
+        })
+        self.assertEqual(summary['loadtest/total']['requests'], 4)
+        self.assertEqual(summary['loadtest/total']['errors'], 1)
+        self.assertEqual(summary['loadtest/total']['max'], 0.4)
+
+
+# Background image work could outlive the temporary MEDIA_ROOT, and the test.
+@patch('recipes.models.queue_variant_deletion')
+@patch('recipes.models.queue_variants')
+@patch('recipes.models.queue_thumbnails')
+class LoadTestCommandTest(LiveServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(rmtree, self.directory)
+        settings = override_settings(MEDIA_ROOT=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def generate(self):
+        generator = DatasetGenerator(
+            users=1, ingredients_per_user=5, recipes_per_user=3,
+            parts_per_recipe=2, seed=1, username_prefix='load')
+        for done in generator.generate():
+            pass
+
+    def test_goes_through_workflows(self, queue, queue_variants,
+                                    queue_variant_deletion):
+        self.generate()
+        path = os.path.join(self.directory, 'loadtest.json')
+        out = StringIO()
+
+        with quiet(SERVER_QUIET_LOGGERS):
+            call_command(
+                'loadtest', url=self.live_server_url, users=1,
+                username_prefix='load', concurrency=1, iterations=2, seed=1,
+                output=path, stdout=out)
+
+        saved = results.load(path)
+        self.assertEqual(sorted(saved), [
+            'loadtest/account_login',
+            'loadtest/account_login:post',
+            'loadtest/recipe-clone',
+            'loadtest/recipe-delete:post',
+            'loadtest/recipe-detail',
+            'loadtest/recipe-update',
+            'loadtest/recipe-update:image',
+            'loadtest/recipe-update:post',
+            'loadtest/recipes',
+            'loadtest/total',
+        ])
+        self.assertEqual(saved['loadtest/total']['errors'], 0)
+        self.assertEqual(saved['loadtest/recipe-clone']['requests'], 2)
+        self.assertEqual(saved['loadtest/recipe-update']['requests'], 4)
+        self.assertIn('loadtest/recipe-update:image', out.getvalue())
+        self.assertEqual(Recipe.objects.count(), 3)
+        self.assertEqual(queue.call_count, 2)
+        self.assertEqual(queue_variants.call_count, 2)
+
+    def test_refuses_missing_users(self, queue, queue_variants,
+                                   queue_variant_deletion):
+        with self.assertRaisesMessage(CommandError, 'generate_dataset'):
+            call_command(
+                'loadtest', url=self.live_server_url, users=2,
+                username_prefix='load', stdout=StringIO())
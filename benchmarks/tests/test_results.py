@@ -0,0 +1,49 @@
+import os
+import tempfile
+from shutil import rmtree
+
+from django.test import SimpleTestCase
+
+from benchmarks import results
+
+
+class ResultsTest(SimpleTestCase):
+    def test_saves_and_loads_results(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(rmtree, directory)
+        path = os.path.join(directory, 'results.json')
+
+        results.save(path, {'a/small': {'median': 0.5}})
+
+        self.assertEqual(results.load(path), {'a/small': {'median': 0.5}})
+
+    def test_flags_regressions_past_the_threshold(self):
+        comparisons = results.compare(
+            {
+                'faster': {'median': 2.0},
+                'same': {'median': 1.0},
+                'slower': {'median': 1.0},
+                'removed': {'median': 1.0},
+            },
+            {
+                'faster': {'median': 1.0},
+                'same': {'median': 1.05},
+                'slower': {'median': 1.2},
+                'added': {'median': 1.0},
+            },
+            threshold=0.1,
+        )
+
+        self.assertEqual(
+            [(comparison.name, comparison.regressed)
+             for comparison in comparisons],
+            [('faster', False), ('same', False), ('slower', True)])
+        self.assertAlmostEqual(comparisons[0].change, -0.5)
+
+    def test_compares_other_metrics(self):
+        comparison, = results.compare(
+            {'a': {'median': 1.0, 'min': 1.0}},
+            {'a': {'median': 1.0, 'min': 2.0}},
+            metric='min')
+
+        self.assertTrue(comparison.regressed)
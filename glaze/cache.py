@@ -0,0 +1,45 @@
+import time
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils.translation import get_language
+
+USER_VERSION_KEY = 'glaze.user-version.{}'
+
+
+def _initial_version():
+    # Starting from the clock means that a version evicted from the cache
+    # comes back higher than before, instead of reusing stale fragments.
+    return int(time.time() * 1000)
+
+
+def user_cache_version(user_id):
+    key = USER_VERSION_KEY.format(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = _initial_version()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def _incr_user_cache_version(user_id):
+    key = USER_VERSION_KEY.format(user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, _initial_version(), None)
+
+
+def bump_user_cache_version(user_id):
+    """Invalidates every fragment cached for a user."""
+    _incr_user_cache_version(user_id)
+    if connection.in_atomic_block:
+        # Readers that ran before the commit may have cached the old data
+        # under the new version, so it's bumped again once it's visible.
+        transaction.on_commit(lambda: _incr_user_cache_version(user_id))
+
+
+def fragment_cache_namespace(user):
+    return '{}.{}.{}'.format(
+        user.pk, user_cache_version(user.pk), get_language())
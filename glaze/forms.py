@@ -1,4 +1,14 @@
-from django.forms import ModelForm
+from collections import OrderedDict
+
+from django.contrib.auth.models import User
+from django.forms import (
+    CharField,
+    Form,
+    ModelChoiceField,
+    ModelForm,
+    ValidationError,
+)
+from django.utils.functional import cached_property
 from django.utils.translation import ugettext as _
 
 from glaze.models import Profile
@@ -10,6 +20,54 @@ class LocalizeFieldsMixin:
             field.label = _(field.label)
 
 
+class PreloadedChoices:
+    """Evaluates a queryset once, so that many fields can share it."""
+
+    def __init__(self, queryset):
+        self.queryset = queryset
+        self._choices = None
+
+    @cached_property
+    def objects(self):
+        return OrderedDict((str(obj.pk), obj) for obj in self.queryset)
+
+    def choices(self, field):
+        if self._choices is None:
+            self._choices = [
+                (field.prepare_value(obj), field.label_from_instance(obj))
+                for obj in self.objects.values()
+            ]
+            if field.empty_label is not None:
+                self._choices.insert(0, ('', field.empty_label))
+        return self._choices
+
+
+class PreloadedModelChoiceField(ModelChoiceField):
+    preloaded = None
+
+    def preload(self, preloaded):
+        self.preloaded = preloaded
+        self.widget.choices = self.choices
+
+    def _get_choices(self):
+        if self.preloaded is None:
+            return super()._get_choices()
+        return self.preloaded.choices(self)
+
+    choices = property(_get_choices, ModelChoiceField._set_choices)
+
+    def to_python(self, value):
+        if self.preloaded is None:
+            return super().to_python(value)
+        if value in self.empty_values:
+            return None
+        try:
+            return self.preloaded.objects[str(value)]
+        except KeyError:
+            raise ValidationError(
+                self.error_messages['invalid_choice'], code='invalid_choice')
+
+
 class ProfileForm(ModelForm, LocalizeFieldsMixin):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -19,3 +77,26 @@ class ProfileForm(ModelForm, LocalizeFieldsMixin):
         model = Profile
         fields = ['currency']
         localized_fields = '__all__'
+
+
+class ProfilingTokenForm(Form, LocalizeFieldsMixin):
+    """Chooses whose request a profiling token is for, and to what path."""
+    username = CharField(label='User')
+    path = CharField(label='Path', required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.localize_fields()
+
+    def clean_username(self):
+        try:
+            return User.objects.get(
+                username=self.cleaned_data['username'], is_active=True)
+        except User.DoesNotExist:
+            raise ValidationError(_('There is no such user.'))
+
+    def clean_path(self):
+        path = self.cleaned_data['path']
+        if path and not path.startswith('/'):
+            raise ValidationError(_('Paths start with a slash.'))
+        return path or None
@@ -0,0 +1,328 @@
+"""Request and thumbnail metrics, in the Prometheus text format.
+
+Every process adds its samples up in a memory-mapped file of its own, under
+`METRICS_DIR`, so that writing one is lock-free between processes and
+survives the process. Scraping any process reads and sums all the files,
+which reports the whole host, including workers that have since restarted.
+The files of processes that are gone are added to `metrics-archive.db` and
+deleted, so they don't pile up and the counters never go down.
+"""
+import fcntl
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+from bisect import bisect_left
+from glob import glob
+from time import perf_counter
+
+from django.conf import settings
+
+# A file starts with how many of its bytes are used, followed by entries of
+# a key length, the key, padding up to 8 bytes and a double.
+HEADER = struct.Struct('i')
+DOUBLE = struct.Struct('d')
+HEADER_SIZE = 8
+INITIAL_SIZE = 64 * 1024
+
+INF = float('inf')
+
+PROCESS_FILE = re.compile(r'^metrics-(\d+)\.db$')
+ARCHIVE_FILE = 'metrics-archive.db'
+LOCK_FILE = 'metrics.lock'
+
+DURATION_BUCKETS = [
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, INF]
+QUERY_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500, INF]
+
+
+def key_padding(length):
+    return -(HEADER.size + length) % 8
+
+
+def read_entries(data, used):
+    """Yields the `(key, value, value position)` of each entry."""
+    position = HEADER_SIZE
+    while position < used:
+        length, = HEADER.unpack_from(data, position)
+        position += HEADER.size
+        key = bytes(data[position:position + length]).decode()
+        position += length + key_padding(length)
+        value, = DOUBLE.unpack_from(data, position)
+        yield key, value, position
+        position += DOUBLE.size
+
+
+class MmapStore:
+    """Running totals of one process, kept in a file only it writes to."""
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a+b')
+        capacity = os.fstat(self._file.fileno()).st_size
+        if not capacity:
+            capacity = INITIAL_SIZE
+            self._file.truncate(capacity)
+        self._map = mmap.mmap(self._file.fileno(), capacity)
+        self._used = HEADER.unpack_from(self._map, 0)[0] or HEADER_SIZE
+        self._positions = {
+            key: position
+            for key, value, position in read_entries(self._map, self._used)
+        }
+
+    def add(self, key, amount):
+        with self._lock:
+            position = self._positions.get(key)
+            if position is None:
+                position = self._append(key)
+            value, = DOUBLE.unpack_from(self._map, position)
+            DOUBLE.pack_into(self._map, position, value + amount)
+
+    def _append(self, key):
+        encoded = key.encode()
+        padded = len(encoded) + key_padding(len(encoded))
+        size = HEADER.size + padded + DOUBLE.size
+        while self._used + size > len(self._map):
+            self._grow()
+        struct.pack_into(
+            'i{}s'.format(padded), self._map, self._used,
+            len(encoded), encoded)
+        position = self._used + HEADER.size + padded
+        DOUBLE.pack_into(self._map, position, 0.0)
+        # Readers only look up to the used size, so the entry is complete by
+        # the time they see it.
+        self._used += size
+        HEADER.pack_into(self._map, 0, self._used)
+        self._positions[key] = position
+        return position
+
+    def _grow(self):
+        capacity = len(self._map) * 2
+        self._map.close()
+        self._file.truncate(capacity)
+        self._map = mmap.mmap(self._file.fileno(), capacity)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Returns the store of this process, opening it after forks."""
+    global _store
+    path = os.path.join(
+        settings.METRICS_DIR, 'metrics-{}.db'.format(os.getpid()))
+    store = _store
+    if store is None or store.path != path:
+        with _store_lock:
+            if _store is None or _store.path != path:
+                os.makedirs(settings.METRICS_DIR, exist_ok=True)
+                _store = MmapStore(path)
+            store = _store
+    return store
+
+
+def read_samples(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < HEADER_SIZE:
+        return []
+    used, = HEADER.unpack_from(data, 0)
+    return [(key, value) for key, value, position in read_entries(data, used)]
+
+
+def process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def archive_dead_processes(directory):
+    """Moves the samples of processes that are gone to the archive file.
+
+    The caller holds the lock of the directory, so that no other process
+    archives the same files or reads them half archived.
+    """
+    archive = None
+    for filename in os.listdir(directory):
+        match = PROCESS_FILE.match(filename)
+        if not match or process_exists(int(match.group(1))):
+            continue
+        path = os.path.join(directory, filename)
+        if archive is None:
+            archive = MmapStore(os.path.join(directory, ARCHIVE_FILE))
+        for key, value in read_samples(path):
+            archive.add(key, value)
+        os.remove(path)
+    if archive is not None:
+        archive.close()
+
+
+def collect(directory):
+    """Returns the samples of every process, summed up by key."""
+    samples = {}
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_FILE), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        archive_dead_processes(directory)
+        for path in glob(os.path.join(directory, 'metrics-*.db')):
+            for key, value in read_samples(path):
+                samples[key] = samples.get(key, 0.0) + value
+    return samples
+
+
+def sample_key(name, labels):
+    return json.dumps([name, sorted(
+        (label, str(value)) for label, value in labels.items())])
+
+
+def format_value(value):
+    if value == INF:
+        return '+Inf'
+    return repr(float(value))
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\').replace(
+            '\n', r'\n').replace('"', r'\"'))
+        for name, value in labels
+    ))
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        REGISTRY.append(self)
+
+    def render(self, samples):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.documentation),
+            '# TYPE {} {}'.format(self.name, self.type),
+        ]
+        for name, labels, value in self.samples(samples):
+            lines.append('{}{} {}'.format(
+                name, format_labels(labels), format_value(value)))
+        return lines
+
+    def labelsets(self, samples, name):
+        """Returns every set of labels stored for the sample `name`."""
+        labelsets = []
+        for key in samples:
+            sample_name, labels = json.loads(key)
+            if sample_name == name:
+                labelsets.append([tuple(label) for label in labels])
+        return sorted(labelsets)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        get_store().add(sample_key(self.name, labels), amount)
+
+    def samples(self, samples):
+        for labels in self.labelsets(samples, self.name):
+            yield self.name, labels, samples[sample_key(
+                self.name, dict(labels))]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, buckets):
+        super().__init__(name, documentation)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        store = get_store()
+        bound = self.buckets[bisect_left(self.buckets, value)]
+        store.add(sample_key(
+            self.name + '_bucket', dict(labels, le=format_value(bound))), 1)
+        store.add(sample_key(self.name + '_sum', labels), value)
+        store.add(sample_key(self.name + '_count', labels), 1)
+
+    def samples(self, samples):
+        # Buckets are stored on their own, and only add up when rendered.
+        for labels in self.labelsets(samples, self.name + '_count'):
+            labels = dict(labels)
+            cumulative = 0.0
+            for bound in self.buckets:
+                bucket_labels = dict(labels, le=format_value(bound))
+                cumulative += samples.get(
+                    sample_key(self.name + '_bucket', bucket_labels), 0.0)
+                yield (
+                    self.name + '_bucket', sorted(bucket_labels.items()),
+                    cumulative)
+            for suffix in ['_sum', '_count']:
+                yield (
+                    self.name + suffix, sorted(labels.items()),
+                    samples[sample_key(self.name + suffix, labels)])
+
+
+REGISTRY = []
+
+REQUESTS = Counter(
+    'glaze_http_requests_total',
+    'Requests served, by URL name, method and status.')
+REQUEST_DURATION = Histogram(
+    'glaze_http_request_duration_seconds',
+    'Time taken to serve requests, by URL name.',
+    DURATION_BUCKETS)
+REQUEST_QUERIES = Histogram(
+    'glaze_http_request_queries',
+    'SQL queries run by requests, by URL name.',
+    QUERY_BUCKETS)
+THUMBNAIL_DURATION = Histogram(
+    'glaze_thumbnail_generation_seconds',
+    'Time taken to generate thumbnails, by geometry.',
+    DURATION_BUCKETS)
+
+
+def render_metrics(directory):
+    samples = collect(directory)
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render(samples))
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware:
+    """Records the requests to every URL name.
+
+    It goes before `glaze.timing.ServerTimingMiddleware`, whose counts it
+    uses.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = perf_counter()
+        response = self.get_response(request)
+        duration = perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        url_name = (match.url_name if match else None) or ''
+        REQUESTS.inc(
+            url_name=url_name, method=request.method,
+            status=response.status_code)
+        REQUEST_DURATION.observe(duration, url_name=url_name)
+        timings = getattr(request, 'timings', None)
+        if timings is not None:
+            REQUEST_QUERIES.observe(timings.queries, url_name=url_name)
+        return response
@@ -5,6 +5,8 @@ from django.dispatch import receiver
 from django.urls import reverse
 from django.utils.translation import ugettext as _
 
+from glaze.cache import bump_user_cache_version
+
 
 class Profile(models.Model):
     user = models.OneToOneField(
@@ -28,3 +30,8 @@ def create_user_profile(sender, instance, created, **kwargs):
 @receiver(post_save, sender=User)
 def save_user_profile(sender, instance, **kwargs):
     instance.profile.save()
+
+
+@receiver(post_save, sender=Profile)
+def invalidate_profile_fragments(sender, instance, **kwargs):
+    bump_user_cache_version(instance.user_id)
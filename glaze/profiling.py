@@ -0,0 +1,196 @@
+"""Requests profiled on demand, with the SQL they ran.
+
+Staff issue a token for the requests of one user, possibly to one path, and
+the request carrying it as the `profile` query parameter or the `X-Profile`
+header is profiled. That lets staff profile a page as it is for the user
+who reported it, by sending them the token. A token is used up by the
+request it profiles, and expires after `PROFILING_TOKEN_MAX_AGE` seconds
+if it isn't used, so a leaked one is of little use. Other requests only
+pay for the lookup of the parameter and header.
+"""
+import cProfile
+import json
+import os
+import re
+import uuid
+from contextlib import ExitStack
+from datetime import datetime
+from time import perf_counter
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.cache import cache
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+QUERY_PARAMETER = 'profile'
+HEADER = 'HTTP_X_PROFILE'
+SALT = 'glaze.profiling'
+# Cache key marking a token as used, by its nonce.
+USED_TOKEN_KEY = 'profiling-token-used:{}'
+
+# Profile files are named `<name>.<extension>`, with names made here only.
+# Names start with their time, so they sort from oldest to newest.
+NAME = re.compile(r'^\d{8}T\d{6}-[0-9a-f]{32}$')
+EXTENSIONS = {
+    'prof': 'application/octet-stream',
+    'json': 'application/json',
+}
+# What the list of profiles shows, kept apart from the bulky queries.
+METADATA_EXTENSION = 'meta.json'
+
+
+def make_token(issuer, user, path=None):
+    """Returns a token to profile one request of `user`, to `path` if it's
+    given."""
+    return signing.dumps({
+        'issuer': issuer.pk,
+        'user': user.pk,
+        'path': path,
+        'nonce': uuid.uuid4().hex,
+    }, salt=SALT)
+
+
+def redeem_token(token, request):
+    """Returns the staff user who issued `token` for `request`, and uses the
+    token up.
+
+    Returns `None` if the token is invalid, expired, already used, meant for
+    another user or path, or if its issuer isn't staff anymore.
+    """
+    try:
+        data = signing.loads(
+            token, salt=SALT, max_age=settings.PROFILING_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return None
+    if data['user'] != request.user.pk:
+        return None
+    if data['path'] is not None and data['path'] != request.path:
+        return None
+    issuer = User.objects.filter(
+        pk=data['issuer'], is_staff=True, is_active=True).first()
+    if issuer is None:
+        return None
+    # Only the first request to add the key gets to use the token. It can't
+    # be used once expired, so the key doesn't need to outlive it.
+    if not cache.add(
+            USED_TOKEN_KEY.format(data['nonce']), True,
+            settings.PROFILING_TOKEN_MAX_AGE):
+        return None
+    return issuer
+
+
+def path(name, extension):
+    return os.path.join(settings.PROFILING_DIR, '{}.{}'.format(
+        name, extension))
+
+
+def profile_names():
+    """Returns the names of the stored profiles, oldest first."""
+    try:
+        filenames = os.listdir(settings.PROFILING_DIR)
+    except FileNotFoundError:
+        return []
+    suffix = '.' + METADATA_EXTENSION
+    return sorted(
+        filename[:-len(suffix)] for filename in filenames
+        if filename.endswith(suffix) and NAME.match(filename[:-len(suffix)])
+    )
+
+
+def list_profiles():
+    """Returns the metadata of each profiled request, newest first."""
+    profiles = []
+    for name in reversed(profile_names()):
+        try:
+            with open(path(name, METADATA_EXTENSION)) as f:
+                profiles.append(json.load(f))
+        except FileNotFoundError:
+            # Pruned by another process meanwhile.
+            continue
+    return profiles
+
+
+def prune_profiles():
+    """Deletes the oldest profiles past `PROFILING_MAX_PROFILES`."""
+    names = profile_names()
+    excess = len(names) - settings.PROFILING_MAX_PROFILES
+    for name in names[:max(excess, 0)]:
+        for extension in [METADATA_EXTENSION] + list(EXTENSIONS):
+            try:
+                os.remove(path(name, extension))
+            except FileNotFoundError:
+                pass
+
+
+class ProfilingMiddleware:
+    """Profiles the requests that ask for it with a valid token.
+
+    The stats go to `<name>.prof`, to be read with `pstats` or a viewer like
+    snakeviz, and the request and its SQL go to `<name>.json`, with a copy
+    of the request alone in `<name>.meta.json` for the list of profiles. The
+    name is sent back in the `X-Profile-Id` header.
+
+    It goes after `AuthenticationMiddleware`, as the token must have been
+    issued for the request's user.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = request.GET.get(QUERY_PARAMETER) or request.META.get(HEADER)
+        issuer = token and redeem_token(token, request)
+        if not issuer:
+            return self.get_response(request)
+        return self.profile(request, issuer)
+
+    def profile(self, request, issuer):
+        name = '{:%Y%m%dT%H%M%S}-{}'.format(datetime.now(), uuid.uuid4().hex)
+        profiler = cProfile.Profile()
+        with ExitStack() as stack:
+            captures = {
+                alias: stack.enter_context(
+                    CaptureQueriesContext(connections[alias]))
+                for alias in connections
+            }
+            start = perf_counter()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+                total_time = perf_counter() - start
+
+        os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+        profiler.dump_stats(path(name, 'prof'))
+        # The token is left out of the recorded query.
+        parameters = request.GET.copy()
+        parameters.pop(QUERY_PARAMETER, None)
+        queries = [
+            {'alias': alias, 'sql': query['sql'],
+             'time_ms': float(query['time']) * 1000}
+            for alias, capture in sorted(captures.items())
+            for query in capture.captured_queries
+        ]
+        metadata = {
+            'name': name,
+            'created': datetime.now().isoformat(),
+            'method': request.method,
+            'path': request.path,
+            'query': parameters.urlencode(),
+            'status': response.status_code,
+            'user': request.user.get_username(),
+            'requested_by': issuer.get_username(),
+            'total_ms': total_time * 1000,
+            'query_count': len(queries),
+            'query_ms': sum(query['time_ms'] for query in queries),
+        }
+        with open(path(name, 'json'), 'w') as f:
+            json.dump(dict(metadata, queries=queries), f, indent=2)
+        # Written last, as it's what makes the profile show up in the list.
+        with open(path(name, METADATA_EXTENSION), 'w') as f:
+            json.dump(metadata, f)
+        prune_profiles()
+        response['X-Profile-Id'] = name
+        return response
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/1.10/ref/settings/
 """
 
 import os
+import tempfile
 
 from django.utils.translation import ugettext_lazy as _
 
@@ -76,10 +77,13 @@ INSTALLED_APPS = [
 
     'glaze',
     'recipes',
+    'benchmarks',
 ]
 
 MIDDLEWARE = [
     'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'glaze.metrics.MetricsMiddleware',
+    'glaze.timing.ServerTimingMiddleware',
 
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -87,6 +91,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'glaze.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -132,9 +137,18 @@ LOGGING = {
             'handlers': ['console'],
             'level': os.getenv('DJANGO_LOG_LEVEL', 'INFO'),
         },
+        # One line per request, with where its time went.
+        'glaze.timing': {
+            'handlers': ['console'],
+            'level': os.getenv('TIMING_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
     },
 }
 
+if TESTING:
+    LOGGING['loggers']['glaze.timing']['level'] = 'WARNING'
+
 WSGI_APPLICATION = 'glaze.wsgi.application'
 
 
@@ -231,6 +245,52 @@ CACHES = {
     }
 }
 
+if TESTING:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# How long rendered fragments are kept, in seconds. They're invalidated by
+# bumping the owner's cache version, so this only bounds the memory used.
+FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Background threads that pre-generate the thumbnails of uploaded images.
+THUMBNAIL_WORKERS = 2
+# Records how long thumbnails take to generate.
+THUMBNAIL_BACKEND = 'recipes.thumbnails.TimedThumbnailBackend'
+
+# Uploaded recipe images are stored as JPEGs no larger than this, in pixels,
+# with resized copies at each of the widths below.
+RECIPE_IMAGE_MAX_SIZE = 2048
+RECIPE_IMAGE_QUALITY = 85
+RECIPE_IMAGE_WIDTHS = [320, 640, 1280]
+
+# Whether every user gets the Server-Timing header, instead of only staff.
+SERVER_TIMING_PUBLIC = False
+
+# Where every worker process keeps its metrics, which are summed up by
+# `/metrics`. It should be on a RAM-backed disk, shared by the workers of one
+# host.
+METRICS_DIR = os.getenv(
+    'METRICS_DIR', os.path.join(tempfile.gettempdir(), 'glaze-metrics'))
+# The bearer token scrapers send to read `/metrics` without being logged in
+# as staff. Requests all come through the proxy, so their address can't be
+# trusted instead. Without a token, only staff can read the metrics.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Where requests profiled with a staff token are saved, how many of them are
+# kept, and for how many seconds an unused token is valid.
+PROFILING_DIR = os.getenv(
+    'PROFILING_DIR', os.path.join(tempfile.gettempdir(), 'glaze-profiles'))
+PROFILING_MAX_PROFILES = 100
+PROFILING_TOKEN_MAX_AGE = 15 * 60
+
+if TESTING:
+    METRICS_DIR = os.path.join(tempfile.gettempdir(), 'glaze-metrics-test')
+    PROFILING_DIR = os.path.join(tempfile.gettempdir(), 'glaze-profiles-test')
+
 BOOTSTRAP3 = {
 
     # The URL to the jQuery JavaScript file
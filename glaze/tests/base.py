@@ -1,3 +1,4 @@
+import tempfile
 from contextlib import contextmanager
 from os import makedirs
 from os.path import abspath, exists, join
@@ -5,7 +6,8 @@ from shutil import copyfile, rmtree
 
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 
 
 class GlazeTestCase(TestCase):
@@ -13,6 +15,13 @@ class GlazeTestCase(TestCase):
 
     def setUp(self):
         super().setUp()
+        cache.clear()
+        # Uploads, variants and thumbnails go to a directory of their own.
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
         self.user = User.objects.create_superuser(
             'john', 'john.doe@example.com', 'test123!')
         self.another_user = User.objects.create_user(
@@ -0,0 +1,55 @@
+from django.core.cache import cache
+from django.utils import translation
+
+from glaze.cache import (
+    USER_VERSION_KEY,
+    bump_user_cache_version,
+    fragment_cache_namespace,
+    user_cache_version,
+)
+from glaze.tests.base import GlazeTestCase
+
+
+class UserCacheVersionTest(GlazeTestCase):
+    def test_keeps_version_until_bumped(self):
+        version = user_cache_version(self.user.pk)
+
+        self.assertEqual(user_cache_version(self.user.pk), version)
+
+        bump_user_cache_version(self.user.pk)
+
+        self.assertGreater(user_cache_version(self.user.pk), version)
+
+    def test_bumps_only_for_the_owner(self):
+        version = user_cache_version(self.another_user.pk)
+
+        bump_user_cache_version(self.user.pk)
+
+        self.assertEqual(user_cache_version(self.another_user.pk), version)
+
+    def test_doesnt_reuse_evicted_versions(self):
+        version = user_cache_version(self.user.pk)
+        for i in range(3):
+            bump_user_cache_version(self.user.pk)
+        bumped = user_cache_version(self.user.pk)
+
+        cache.delete(USER_VERSION_KEY.format(self.user.pk))
+
+        self.assertNotIn(
+            user_cache_version(self.user.pk), range(version, bumped + 1))
+
+    def test_bumps_when_profile_changes(self):
+        version = user_cache_version(self.user.pk)
+
+        self.user.profile.currency = 'BRL'
+        self.user.profile.save()
+
+        self.assertGreater(user_cache_version(self.user.pk), version)
+
+    def test_varies_namespace_by_language(self):
+        with translation.override('en'):
+            english = fragment_cache_namespace(self.user)
+        with translation.override('pt-br'):
+            portuguese = fragment_cache_namespace(self.user)
+
+        self.assertNotEqual(english, portuguese)
@@ -0,0 +1,163 @@
+import os
+import tempfile
+from shutil import rmtree
+
+from django.test import override_settings
+
+from glaze.metrics import (
+    ARCHIVE_FILE,
+    MmapStore,
+    REQUEST_QUERIES,
+    collect,
+    get_store,
+    render_metrics,
+)
+from glaze.tests.base import GlazeTestCase
+
+
+class MetricsTestCase(GlazeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(rmtree, self.directory)
+        settings = override_settings(METRICS_DIR=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+
+class MmapStoreTest(MetricsTestCase):
+    def test_adds_up_values(self):
+        store = MmapStore(os.path.join(self.directory, 'metrics-1.db'))
+
+        store.add('a', 1)
+        store.add('b', 2.5)
+        store.add('a', 1)
+
+        self.assertEqual(collect(self.directory), {'a': 2.0, 'b': 2.5})
+
+    def test_grows_past_its_initial_size(self):
+        store = MmapStore(os.path.join(self.directory, 'metrics-1.db'))
+
+        for index in range(5000):
+            store.add('key-{}'.format(index), index)
+
+        samples = collect(self.directory)
+        self.assertEqual(len(samples), 5000)
+        self.assertEqual(samples['key-4999'], 4999.0)
+
+    def test_keeps_values_when_reopened(self):
+        path = os.path.join(self.directory, 'metrics-1.db')
+        store = MmapStore(path)
+        store.add('a', 1)
+        store.close()
+
+        MmapStore(path).add('a', 1)
+
+        self.assertEqual(collect(self.directory), {'a': 2.0})
+
+    def test_sums_up_every_process(self):
+        for pid in [1, 2]:
+            MmapStore(os.path.join(
+                self.directory, 'metrics-{}.db'.format(pid))).add('a', pid)
+
+        self.assertEqual(collect(self.directory), {'a': 3.0})
+
+    def test_archives_processes_that_are_gone(self):
+        MmapStore(os.path.join(self.directory, 'metrics-999999999.db')).add(
+            'a', 2)
+        store = get_store()
+        store.add('a', 1)
+
+        self.assertEqual(collect(self.directory), {'a': 3.0})
+        self.assertEqual(sorted(os.listdir(self.directory)), sorted([
+            ARCHIVE_FILE, os.path.basename(store.path), 'metrics.lock']))
+
+        MmapStore(os.path.join(self.directory, 'metrics-999999999.db')).add(
+            'a', 4)
+
+        self.assertEqual(collect(self.directory), {'a': 7.0})
+
+
+@override_settings(METRICS_TOKEN='secret')
+class MetricsViewTest(MetricsTestCase):
+    def scrape(self, token='secret'):
+        return self.client.get(
+            '/metrics', HTTP_AUTHORIZATION='Bearer {}'.format(token))
+
+    def test_counts_requests_per_url_name(self):
+        self.client.force_login(self.another_user)
+        self.client.get('/recipes/recipes/')
+        self.client.get('/recipes/recipes/')
+
+        response = self.scrape()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertContains(
+            response, 'glaze_http_requests_total{method="GET",status="200",'
+                      'url_name="recipes"} 2.0\n')
+
+    def test_renders_histograms(self):
+        self.client.get('/recipes/ingredients.json')
+
+        content = render_metrics(self.directory)
+
+        self.assertIn(
+            '# TYPE glaze_http_request_duration_seconds histogram\n', content)
+        self.assertIn(
+            'glaze_http_request_duration_seconds_bucket{le="+Inf",'
+            'url_name="ingredients-json"} 1.0\n', content)
+        self.assertIn(
+            'glaze_http_request_duration_seconds_count{'
+            'url_name="ingredients-json"} 1.0\n', content)
+        self.assertIn('glaze_http_request_queries_sum{', content)
+
+    def test_accumulates_query_buckets(self):
+        for queries in [0, 3, 3, 1000]:
+            REQUEST_QUERIES.observe(queries, url_name='recipes')
+
+        content = render_metrics(self.directory)
+
+        for le, count in [('0.0', 1), ('2.0', 1), ('5.0', 3), ('500.0', 3),
+                          ('+Inf', 4)]:
+            self.assertIn(
+                'glaze_http_request_queries_bucket{{le="{}",'
+                'url_name="recipes"}} {}.0\n'.format(le, count), content)
+        self.assertIn(
+            'glaze_http_request_queries_sum{url_name="recipes"} 1006.0\n',
+            content)
+
+    def test_includes_other_processes(self):
+        get_store()
+        MmapStore(os.path.join(self.directory, 'metrics-0.db')).add(
+            '["glaze_http_requests_total", [["method", "GET"], '
+            '["status", "200"], ["url_name", "recipes"]]]', 5)
+        self.client.force_login(self.another_user)
+        self.client.get('/recipes/recipes/')
+
+        response = self.scrape()
+
+        self.assertContains(
+            response, 'glaze_http_requests_total{method="GET",status="200",'
+                      'url_name="recipes"} 6.0\n')
+
+    def test_hides_metrics_without_token(self):
+        self.client.force_login(self.another_user)
+
+        for response in [self.client.get('/metrics'), self.scrape('wrong')]:
+            with self.subTest(response=response):
+                self.assertEqual(response.status_code, 404)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_hides_metrics_without_configured_token(self):
+        response = self.scrape('')
+
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_shows_metrics_to_staff(self):
+        self.client.force_login(self.user)
+
+        response = self.client.get('/metrics')
+
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,264 @@
+import json
+import os
+import pstats
+import tempfile
+from shutil import rmtree
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core import signing
+from django.test import RequestFactory, override_settings
+
+from glaze.profiling import (
+    METADATA_EXTENSION,
+    QUERY_PARAMETER,
+    SALT,
+    list_profiles,
+    make_token,
+    redeem_token,
+)
+from glaze.tests.base import GlazeTestCase
+
+
+class ProfilingTestCase(GlazeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(rmtree, self.directory)
+        settings = override_settings(PROFILING_DIR=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def profiled(self, name, extension):
+        return os.path.join(self.directory, '{}.{}'.format(name, extension))
+
+
+class TokenTest(ProfilingTestCase):
+    def request(self, user, path='/'):
+        request = RequestFactory().get(path)
+        request.user = user
+        return request
+
+    def test_is_redeemed_by_request_of_its_user(self):
+        token = make_token(self.user, self.another_user)
+
+        self.assertEqual(
+            redeem_token(token, self.request(self.another_user)), self.user)
+
+    def test_refuses_token_of_another_user(self):
+        token = make_token(self.user, self.another_user)
+
+        self.assertIsNone(redeem_token(token, self.request(self.user)))
+
+    def test_refuses_anonymous_requests(self):
+        token = make_token(self.user, self.another_user)
+
+        self.assertIsNone(redeem_token(token, self.request(AnonymousUser())))
+
+    def test_is_only_redeemed_once(self):
+        token = make_token(self.user, self.another_user)
+        redeem_token(token, self.request(self.another_user))
+
+        self.assertIsNone(redeem_token(token, self.request(self.another_user)))
+
+    def test_isnt_used_up_by_refused_requests(self):
+        token = make_token(self.user, self.another_user, '/recipes/')
+        redeem_token(token, self.request(self.user, '/recipes/'))
+        redeem_token(token, self.request(self.another_user))
+
+        self.assertEqual(redeem_token(
+            token, self.request(self.another_user, '/recipes/')), self.user)
+
+    def test_refuses_token_for_another_path(self):
+        token = make_token(self.user, self.another_user, '/recipes/')
+
+        self.assertIsNone(redeem_token(
+            token, self.request(self.another_user, '/ingredients/')))
+
+    def test_refuses_token_of_issuer_who_isnt_staff_anymore(self):
+        token = make_token(self.user, self.another_user)
+        User.objects.filter(pk=self.user.pk).update(is_staff=False)
+
+        self.assertIsNone(redeem_token(token, self.request(self.another_user)))
+
+    def test_refuses_forged_token(self):
+        token = make_token(self.user, self.another_user)
+        payload = token.rsplit(':', 1)[0]
+
+        self.assertIsNone(redeem_token(
+            '{}:forged'.format(payload), self.request(self.another_user)))
+
+    @override_settings(PROFILING_TOKEN_MAX_AGE=-1)
+    def test_refuses_expired_token(self):
+        token = make_token(self.user, self.another_user)
+
+        self.assertIsNone(redeem_token(token, self.request(self.another_user)))
+
+    def test_refuses_token_signed_for_something_else(self):
+        token = signing.dumps({
+            'issuer': self.user.pk, 'user': self.another_user.pk,
+            'path': None, 'nonce': 'other',
+        }, salt=SALT + '.other')
+
+        self.assertIsNone(redeem_token(token, self.request(self.another_user)))
+
+
+class ProfilingMiddlewareTest(ProfilingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.another_user)
+
+    def token(self):
+        return make_token(self.user, self.another_user)
+
+    def test_profiles_request_with_token_parameter(self):
+        response = self.client.get('/accounts/profile/', {
+            QUERY_PARAMETER: self.token(),
+            'page': '2',
+        })
+
+        name = response['X-Profile-Id']
+        stats = pstats.Stats(self.profiled(name, 'prof'))
+        self.assertTrue(stats.total_calls)
+        with open(self.profiled(name, 'json')) as f:
+            profile = json.load(f)
+        self.assertEqual(profile['path'], '/accounts/profile/')
+        self.assertEqual(profile['query'], 'page=2')
+        self.assertEqual(profile['status'], 200)
+        self.assertEqual(profile['user'], 'alice')
+        self.assertEqual(profile['requested_by'], 'john')
+        self.assertEqual(profile['query_count'], len(profile['queries']))
+        self.assertTrue(any(
+            'glaze_profile' in query['sql'] for query in profile['queries']))
+        with open(self.profiled(name, METADATA_EXTENSION)) as f:
+            metadata = json.load(f)
+        del profile['queries']
+        self.assertEqual(metadata, profile)
+
+    def test_profiles_request_with_token_header(self):
+        response = self.client.get(
+            '/', HTTP_X_PROFILE=self.token())
+
+        self.assertTrue(os.path.exists(
+            self.profiled(response['X-Profile-Id'], 'json')))
+
+    def test_doesnt_profile_request_without_token(self):
+        response = self.client.get('/')
+
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_doesnt_profile_request_with_invalid_token(self):
+        response = self.client.get('/', {QUERY_PARAMETER: 'invalid'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_doesnt_profile_requests_of_other_users(self):
+        token = self.token()
+        self.client.force_login(self.user)
+
+        response = self.client.get('/', {QUERY_PARAMETER: token})
+
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_profiles_a_single_request_per_token(self):
+        token = self.token()
+        self.client.get('/', {QUERY_PARAMETER: token})
+
+        response = self.client.get('/', {QUERY_PARAMETER: token})
+
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(len(list_profiles()), 1)
+
+    @override_settings(PROFILING_MAX_PROFILES=2)
+    def test_keeps_only_newest_profiles(self):
+        names = [
+            self.client.get('/', {
+                QUERY_PARAMETER: self.token()})['X-Profile-Id']
+            for i in range(3)
+        ]
+
+        kept = sorted(names)[1:]
+        self.assertEqual(sorted(os.listdir(self.directory)), sorted(
+            '{}.{}'.format(name, extension)
+            for name in kept
+            for extension in ['prof', 'json', METADATA_EXTENSION]
+        ))
+
+
+class RequestProfilesViewTest(ProfilingTestCase):
+    def profile(self, path):
+        return self.client.get(path, {
+            QUERY_PARAMETER: make_token(self.user, self.user)})['X-Profile-Id']
+
+    def test_lists_profiles_newest_first(self):
+        self.client.force_login(self.user)
+        first = self.profile('/')
+        second = self.profile('/accounts/profile/')
+
+        response = self.client.get('/request-profiles/')
+
+        self.assertEqual(
+            [profile['name'] for profile in response.context['profiles']],
+            sorted([first, second], reverse=True))
+        self.assertContains(response, '/request-profiles/{}.prof'.format(
+            first))
+        self.assertIsNone(response.context['token'])
+
+    def test_issues_token_for_a_user(self):
+        self.client.force_login(self.user)
+
+        response = self.client.post('/request-profiles/', {
+            'username': 'alice', 'path': '/recipes/'})
+
+        token = response.context['token']
+        self.assertContains(response, token)
+        request = RequestFactory().get('/recipes/')
+        request.user = self.another_user
+        self.assertEqual(redeem_token(token, request), self.user)
+
+    def test_doesnt_issue_token_for_unknown_user(self):
+        self.client.force_login(self.user)
+
+        response = self.client.post('/request-profiles/', {
+            'username': 'nobody'})
+
+        self.assertIsNone(response.context['token'])
+        self.assertFormError(
+            response, 'form', 'username', 'There is no such user.')
+
+    def test_lists_nothing_without_directory(self):
+        with override_settings(
+                PROFILING_DIR=os.path.join(self.directory, 'missing')):
+            self.assertEqual(list_profiles(), [])
+
+    def test_downloads_profile_files(self):
+        self.client.force_login(self.user)
+        name = self.profile('/')
+
+        response = self.client.get('/request-profiles/{}.json'.format(name))
+
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('attachment', response['Content-Disposition'])
+        profile = json.loads(b''.join(response.streaming_content).decode())
+        self.assertEqual(profile['name'], name)
+
+    def test_doesnt_download_other_files(self):
+        self.client.force_login(self.user)
+        name = self.profile('/')
+
+        for path in ['/request-profiles/{}.py'.format(name),
+                     '/request-profiles/20170101T000000-missing.prof',
+                     '/request-profiles/{}0.prof'.format(name)]:
+            with self.subTest(path=path):
+                response = self.client.get(path)
+                self.assertEqual(response.status_code, 404)
+
+    def test_is_only_for_staff(self):
+        self.client.force_login(self.another_user)
+
+        response = self.client.get('/request-profiles/')
+
+        self.assertEqual(response.status_code, 302)
@@ -0,0 +1,82 @@
+import re
+
+from django.core.cache import caches
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
+from glaze.tests.base import GlazeTestCase
+
+
+class ServerTimingTest(GlazeTestCase):
+    LOGIN = True
+    URL = '/recipes/recipes/'
+
+    def logged_timings(self, url=URL):
+        with self.assertLogs('glaze.timing', 'INFO') as logs:
+            response = self.client.get(url)
+        record, = logs.records
+        return response, record
+
+    def test_sends_timings_to_staff(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.URL)
+
+        header = response['Server-Timing']
+        self.assertIn('db;dur=', header)
+        self.assertIn('desc="{} queries"'.format(len(queries)), header)
+        for name in ['cache', 'template', 'view', 'total']:
+            self.assertRegex(header, r'\b{};dur=\d+\.\d'.format(name))
+
+    def test_doesnt_send_timings_to_other_users(self):
+        self.client.force_login(self.another_user)
+
+        response = self.client.get(self.URL)
+
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(SERVER_TIMING_PUBLIC=True)
+    def test_sends_timings_to_everyone_if_public(self):
+        self.client.force_login(self.another_user)
+
+        response = self.client.get(self.URL)
+
+        self.assertIn('Server-Timing', response)
+
+    def test_logs_request_timings(self):
+        response, record = self.logged_timings()
+
+        message = record.getMessage()
+        self.assertIn('method=GET path=/recipes/recipes/', message)
+        self.assertIn('url_name=recipes status=200', message)
+        self.assertRegex(message, r'db_queries=\d+ db_ms=')
+        self.assertEqual(record.timings['status'], 200)
+
+    def test_counts_cache_hits_and_misses(self):
+        response, cold = self.logged_timings()
+        response, warm = self.logged_timings()
+
+        self.assertGreater(cold.timings['cache_misses'], 0)
+        self.assertGreater(
+            warm.timings['cache_hits'], cold.timings['cache_hits'])
+        self.assertLess(
+            warm.timings['db_queries'], cold.timings['db_queries'])
+
+    def test_times_unrendered_views_without_template(self):
+        response, record = self.logged_timings('/recipes/ingredients.json')
+
+        self.assertNotIn('template_ms', record.timings)
+        self.assertIn('view_ms', record.timings)
+
+    def test_unwraps_connections_and_caches_after_the_request(self):
+        self.client.get(self.URL)
+
+        self.assertNotIn('make_cursor', vars(connection))
+        self.assertNotIn('get', vars(caches['default']))
+
+    def test_formats_header_entries(self):
+        response = self.client.get(self.URL)
+
+        for entry in response['Server-Timing'].split(', '):
+            self.assertRegex(
+                entry, re.compile(r'^\w+;dur=\d+\.\d(;desc="[^"]*")?$'))
@@ -0,0 +1,279 @@
+"""Per-request timings, sent as a `Server-Timing` header and logged.
+
+SQL and cache calls are timed by wrapping the current thread's database
+connections and cache backends for the length of the request only, so the
+rest of the process runs unwrapped.
+"""
+import logging
+from contextlib import contextmanager
+from time import perf_counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+CACHE_METHODS = [
+    'add', 'set', 'set_many', 'delete', 'delete_many', 'incr', 'decr',
+    'has_key', 'clear',
+]
+
+
+class RequestTimings:
+    """What a request spent its time on, in seconds."""
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.cache_calls = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_time = 0.0
+        self.template_time = None
+        self.view_time = None
+        self.total_time = None
+        self._cache_depth = 0
+
+    @contextmanager
+    def timing_query(self, count=True):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.query_time += perf_counter() - start
+            if count:
+                self.queries += 1
+
+    @contextmanager
+    def timing_cache(self):
+        # Backends may implement a call with other calls, like `get_many`
+        # with `get`, which must not be counted twice.
+        self._cache_depth += 1
+        start = perf_counter()
+        try:
+            yield self._cache_depth == 1
+        finally:
+            self._cache_depth -= 1
+            if not self._cache_depth:
+                self.cache_time += perf_counter() - start
+                self.cache_calls += 1
+
+    def count_cache_lookups(self, outermost, hits, misses):
+        if outermost:
+            self.cache_hits += hits
+            self.cache_misses += misses
+
+    def metrics(self):
+        """Returns `(name, duration in ms, description)` for the header."""
+        metrics = [
+            ('db', self.query_time, '{} queries'.format(self.queries)),
+            ('cache', self.cache_time, '{} hits / {} misses'.format(
+                self.cache_hits, self.cache_misses)),
+        ]
+        if self.template_time is not None:
+            metrics.append(('template', self.template_time, None))
+        if self.view_time is not None:
+            metrics.append(('view', self.view_time, None))
+        metrics.append(('total', self.total_time, None))
+        return [
+            (name, duration * 1000, description)
+            for name, duration, description in metrics
+        ]
+
+    def fields(self):
+        """Returns the timings as `(key, value)` pairs for the log line."""
+        fields = [
+            ('total_ms', self.total_time),
+            ('view_ms', self.view_time),
+            ('template_ms', self.template_time),
+            ('db_queries', self.queries),
+            ('db_ms', self.query_time),
+            ('cache_calls', self.cache_calls),
+            ('cache_hits', self.cache_hits),
+            ('cache_misses', self.cache_misses),
+            ('cache_ms', self.cache_time),
+        ]
+        return [
+            (key, round(value * 1000, 3) if key.endswith('_ms') else value)
+            for key, value in fields
+            if value is not None
+        ]
+
+
+class TimedCursor:
+    def __init__(self, cursor, timings):
+        self.cursor = cursor
+        self.timings = timings
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return self.cursor.__exit__(type, value, traceback)
+
+    def callproc(self, *args, **kwargs):
+        with self.timings.timing_query():
+            return self.cursor.callproc(*args, **kwargs)
+
+    def execute(self, *args, **kwargs):
+        with self.timings.timing_query():
+            return self.cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        with self.timings.timing_query():
+            return self.cursor.executemany(*args, **kwargs)
+
+    # Some databases only do the work of a query as its rows are fetched.
+
+    def fetchone(self):
+        with self.timings.timing_query(count=False):
+            return self.cursor.fetchone()
+
+    def fetchmany(self, *args, **kwargs):
+        with self.timings.timing_query(count=False):
+            return self.cursor.fetchmany(*args, **kwargs)
+
+    def fetchall(self):
+        with self.timings.timing_query(count=False):
+            return self.cursor.fetchall()
+
+
+def instrument_connection(connection, timings):
+    make_cursor = connection.make_cursor
+    make_debug_cursor = connection.make_debug_cursor
+    connection.make_cursor = lambda cursor: TimedCursor(
+        make_cursor(cursor), timings)
+    connection.make_debug_cursor = lambda cursor: TimedCursor(
+        make_debug_cursor(cursor), timings)
+
+
+def uninstrument_connection(connection):
+    del connection.make_cursor
+    del connection.make_debug_cursor
+
+
+def instrument_cache(cache, timings):
+    def timed(method):
+        def call(*args, **kwargs):
+            with timings.timing_cache():
+                return method(*args, **kwargs)
+        return call
+
+    get = cache.get
+    get_many = cache.get_many
+
+    # Backends take extra arguments of their own, like locmem's
+    # `acquire_lock`, which are passed through.
+    def timed_get(key, default=None, *args, **kwargs):
+        with timings.timing_cache() as outermost:
+            value = get(key, _MISSING, *args, **kwargs)
+        hit = value is not _MISSING
+        timings.count_cache_lookups(outermost, int(hit), int(not hit))
+        return value if hit else default
+
+    def timed_get_many(keys, *args, **kwargs):
+        keys = list(keys)
+        with timings.timing_cache() as outermost:
+            values = get_many(keys, *args, **kwargs)
+        timings.count_cache_lookups(
+            outermost, len(values), len(keys) - len(values))
+        return values
+
+    cache.get = timed_get
+    cache.get_many = timed_get_many
+    for name in CACHE_METHODS:
+        setattr(cache, name, timed(getattr(cache, name)))
+
+
+def uninstrument_cache(cache):
+    for name in ['get', 'get_many'] + CACHE_METHODS:
+        delattr(cache, name)
+
+
+class ServerTimingMiddleware:
+    """Times each request, and reports it in a header and a log line.
+
+    The header is only sent to staff users, unless `SERVER_TIMING_PUBLIC` is
+    set, as it tells how the site is built.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = request.timings = RequestTimings()
+        databases = [connections[alias] for alias in connections]
+        backends = [caches[alias] for alias in settings.CACHES]
+        for connection in databases:
+            instrument_connection(connection, timings)
+        for cache in backends:
+            instrument_cache(cache, timings)
+
+        start = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            timings.total_time = perf_counter() - start
+            if getattr(request, '_view_start', None) is not None:
+                timings.view_time = perf_counter() - request._view_start
+            for connection in databases:
+                uninstrument_connection(connection)
+            for cache in backends:
+                uninstrument_cache(cache)
+
+        if self.shows_header(request):
+            response['Server-Timing'] = server_timing_header(timings)
+        log_timings(request, response, timings)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._view_start = perf_counter()
+
+    def process_template_response(self, request, response):
+        render = response.render
+
+        def timed_render():
+            start = perf_counter()
+            try:
+                return render()
+            finally:
+                request.timings.template_time = perf_counter() - start
+
+        response.render = timed_render
+        return response
+
+    def shows_header(self, request):
+        if settings.SERVER_TIMING_PUBLIC:
+            return True
+        user = getattr(request, 'user', None)
+        return user is not None and user.is_staff
+
+
+def server_timing_header(timings):
+    entries = []
+    for name, duration, description in timings.metrics():
+        entry = '{};dur={:.1f}'.format(name, duration)
+        if description:
+            entry += ';desc="{}"'.format(description)
+        entries.append(entry)
+    return ', '.join(entries)
+
+
+def log_timings(request, response, timings):
+    match = getattr(request, 'resolver_match', None)
+    fields = [
+        ('method', request.method),
+        ('path', request.path),
+        ('url_name', match.url_name if match else None),
+        ('status', response.status_code),
+    ] + timings.fields()
+    logger.info(
+        ' '.join('{}={}'.format(key, value) for key, value in fields),
+        extra={'timings': dict(fields)})
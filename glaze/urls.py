@@ -19,7 +19,6 @@ import debug_toolbar
 from django.conf import settings
 from django.conf.urls import url, include
 from django.contrib import admin
-from django.views.static import serve
 
 from . import views
 
@@ -32,13 +31,16 @@ urlpatterns = [
     url(r'^accounts/profile/update/$',
         views.ProfileUpdateView.as_view(), name='profile-update'),
     url(r'^i18n/', include('django.conf.urls.i18n')),
+    url(r'^metrics$', views.metrics, name='metrics'),
+    url(r'^request-profiles/$', views.request_profiles,
+        name='request-profiles'),
+    url(r'^request-profiles/(?P<name>[\w-]+)\.(?P<extension>\w+)$',
+        views.request_profile_download, name='request-profile-download'),
     url(r'^$', views.home),
 ]
 if settings.DEBUG or settings.TESTING:
     urlpatterns += [
         url(r'^__debug__/', include(debug_toolbar.urls)),
         url(r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')),
-            serve, kwargs={
-                'document_root': settings.MEDIA_ROOT,
-            })
+            views.serve_media)
     ]
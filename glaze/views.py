@@ -1,16 +1,76 @@
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
+from django.http import FileResponse, Http404, HttpResponse
 from django.shortcuts import render
+from django.utils.crypto import constant_time_compare
 from django.utils.decorators import method_decorator
 from django.views.generic.base import TemplateView
+from django.views.static import serve
 from django.views.generic.edit import UpdateView
 
-from glaze.forms import ProfileForm
+from glaze.forms import ProfileForm, ProfilingTokenForm
+from glaze import profiling
+from glaze.metrics import render_metrics
 
 
 def home(request):
     return render(request, 'home.html')
 
 
+def serve_media(request, path):
+    """Serves uploads in development, from wherever `MEDIA_ROOT` is now."""
+    return serve(request, path, document_root=settings.MEDIA_ROOT)
+
+
+def has_metrics_token(request):
+    token = settings.METRICS_TOKEN
+    return bool(token) and constant_time_compare(
+        request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer ' + token)
+
+
+def metrics(request):
+    """Serves the metrics of the whole host, to scrapers and staff only."""
+    if not (has_metrics_token(request) or request.user.is_staff):
+        raise Http404
+    return HttpResponse(
+        render_metrics(settings.METRICS_DIR),
+        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@staff_member_required
+def request_profiles(request):
+    """Lists the profiled requests, and issues tokens to profile more."""
+    form = ProfilingTokenForm(request.POST or None)
+    token = None
+    if form.is_valid():
+        token = profiling.make_token(
+            request.user, form.cleaned_data['username'],
+            form.cleaned_data['path'])
+    return render(request, 'glaze/request_profiles.html', {
+        'profiles': profiling.list_profiles(),
+        'form': form,
+        'token': token,
+        'token_max_age': settings.PROFILING_TOKEN_MAX_AGE // 60,
+        'query_parameter': profiling.QUERY_PARAMETER,
+    })
+
+
+@staff_member_required
+def request_profile_download(request, name, extension):
+    if not profiling.NAME.match(name) or extension not in profiling.EXTENSIONS:
+        raise Http404
+    try:
+        f = open(profiling.path(name, extension), 'rb')
+    except FileNotFoundError:
+        raise Http404
+    response = FileResponse(
+        f, content_type=profiling.EXTENSIONS[extension])
+    response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(
+        name, extension)
+    return response
+
+
 @method_decorator(login_required, name='dispatch')
 class ProfileView(TemplateView):
     template_name = 'glaze/profile.html'
@@ -0,0 +1,221 @@
+"""Vectorized costing, for whole recipe libraries at once.
+
+Prices, percentages and weight unit factors are all exact decimals, so they
+are scaled to integers with `recipes.fixedpoint` and multiplied without any
+rounding. Only the final division is done with `Decimal`, in the same way as
+`Recipe.price`, which makes the results identical to it.
+
+Prices and percentages are scaled by their fields' own decimal places
+rather than by the fixed-point core's, and part costs are added up per
+weight unit before being converted, which keeps most libraries within int64
+whatever the conversion factors are.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from recipes import fixedpoint
+from recipes.models import (
+    REFERENCE_FACTOR_PLACES,
+    REFERENCE_FACTORS,
+    Ingredient,
+    RecipePart,
+    WeightUnit,
+    percentage_total_annotation,
+    quantize_cost,
+    scaled_integer,
+    scaled_sum,
+    summed_integer,
+)
+
+PRICE_PLACES = Ingredient._meta.get_field('price').decimal_places
+PERCENTAGE_PLACES = RecipePart._meta.get_field('percentage').decimal_places
+FACTOR_PLACES = REFERENCE_FACTOR_PLACES
+# Integer factor of each weight unit, indexed by its value.
+UNIT_FACTORS = np.zeros(max(WeightUnit) + 1, dtype=object)
+for unit, factor in REFERENCE_FACTORS.items():
+    UNIT_FACTORS[unit] = factor
+
+INT64_MAX = np.iinfo(np.int64).max
+
+
+def scaled(values, places):
+    return [fixedpoint.to_fixed(value, places) for value in values]
+
+
+class CostMatrix:
+    """Sparse recipe x ingredient matrix of part percentages.
+
+    The matrix is kept in coordinate form: `rows` and `columns` index
+    `recipe_ids` and `ingredient_ids`, and `percentages` holds the value of
+    each part. `ingredient_prices` holds the price of each ingredient in its
+    own weight unit, and `ingredient_units` that weight unit.
+    """
+    def __init__(self, recipe_ids, ingredient_ids, rows, columns, percentages,
+                 ingredient_prices, ingredient_units):
+        self.recipe_ids = recipe_ids
+        self.ingredient_ids = ingredient_ids
+        self.rows = rows
+        self.columns = columns
+        self.percentages = percentages
+        self.ingredient_prices = ingredient_prices
+        self.ingredient_units = ingredient_units
+
+    @classmethod
+    def for_recipes(cls, recipes):
+        """Loads every recipe and part with one query."""
+        rows = recipes.order_by().values_list(
+            'pk', 'recipepart__ingredient', 'recipepart__percentage',
+            'recipepart__ingredient__price',
+            'recipepart__ingredient__weight_unit',
+        )
+        recipe_ids = list(dict.fromkeys(row[0] for row in rows))
+        # Recipes without parts come back once, with no ingredient.
+        parts = [row for row in rows if row[1] is not None]
+        return cls.from_parts(recipe_ids, parts)
+
+    @classmethod
+    def from_parts(cls, recipe_ids, parts):
+        """Builds the matrix from (recipe, ingredient, percentage, price,
+        weight unit) rows.
+        """
+        recipe_index = {pk: index for index, pk in enumerate(recipe_ids)}
+        ingredient_index = {}
+        prices = []
+        units = []
+        rows = []
+        columns = []
+        percentages = []
+
+        for recipe_id, ingredient_id, percentage, price, unit in parts:
+            if ingredient_id not in ingredient_index:
+                ingredient_index[ingredient_id] = len(prices)
+                prices.append(price)
+                units.append(unit)
+            rows.append(recipe_index[recipe_id])
+            columns.append(ingredient_index[ingredient_id])
+            percentages.append(percentage)
+
+        return cls(
+            recipe_ids=recipe_ids,
+            ingredient_ids=list(ingredient_index),
+            rows=np.array(rows, dtype=np.int64),
+            columns=np.array(columns, dtype=np.int64),
+            percentages=np.array(
+                scaled(percentages, PERCENTAGE_PLACES), dtype=object),
+            ingredient_prices=np.array(
+                scaled(prices, PRICE_PLACES), dtype=object),
+            ingredient_units=np.array(units, dtype=np.int64),
+        )
+
+    def _dtype(self, ingredient_prices):
+        # Integer sums stay exact in int64 unless a recipe could overflow it,
+        # in which case arbitrary precision Python integers are used.
+        if not len(self.rows):
+            return np.int64
+        largest_part = (
+            max(abs(value) for value in self.percentages) *
+            max(abs(value) for value in ingredient_prices)
+        )
+        most_parts = np.bincount(self.rows).max()
+        if largest_part * int(most_parts) > INT64_MAX:
+            return object
+        return np.int64
+
+    def totals(self, ingredient_prices=None):
+        """Sums the scaled part costs and percentages of every recipe.
+
+        Part costs are added up per weight unit, and only those sums are
+        converted to the reference unit, with one lookup per unit.
+        """
+        if ingredient_prices is None:
+            ingredient_prices = self.ingredient_prices
+        dtype = self._dtype(ingredient_prices)
+        percentages = self.percentages.astype(dtype)
+        unit_totals = np.zeros(
+            (len(self.recipe_ids), len(UNIT_FACTORS)), dtype=dtype)
+        percentage_totals = np.zeros(len(self.recipe_ids), dtype=dtype)
+        np.add.at(
+            unit_totals, (self.rows, self.ingredient_units[self.columns]),
+            percentages * ingredient_prices.astype(dtype)[self.columns])
+        np.add.at(percentage_totals, self.rows, percentages)
+        price_totals = unit_totals.astype(object).dot(UNIT_FACTORS)
+        return price_totals, percentage_totals
+
+    def prices(self, ingredient_prices=None):
+        """Returns the price of every recipe, keyed by pk."""
+        price_totals, percentage_totals = self.totals(ingredient_prices)
+        price_places = PRICE_PLACES + PERCENTAGE_PLACES + FACTOR_PLACES
+        return {
+            pk: fixedpoint.weighted_price(
+                int(price_total), int(percentage_total), price_places,
+                PERCENTAGE_PLACES,
+            )
+            for pk, price_total, percentage_total in zip(
+                self.recipe_ids, price_totals, percentage_totals)
+        }
+
+
+def recipe_prices(recipes):
+    """Returns the price of every recipe in a queryset, as `Recipe.price`."""
+    return CostMatrix.for_recipes(recipes).prices()
+
+
+Repricing = namedtuple(
+    'Repricing', ['recipe_id', 'name', 'old_cost', 'new_cost', 'delta'])
+
+
+def simulate_repricing(recipes, prices):
+    """Returns how the cost of each recipe would move with new prices.
+
+    Old costs are the stored `Recipe.cost_per_kg`, and only the parts of the
+    repriced ingredients are loaded: each of them moves its recipe's price
+    total by its percentage times the change of price, and the moves are
+    divided by the recipe's percentage total, which the database sums up.
+    The work grows with the number of repriced parts instead of with the
+    size of the affected recipes. The biggest moves come first.
+
+    As the stored costs are rounded, a new cost may differ from the one
+    computed from scratch by a unit of `COST_QUANTUM`.
+    """
+    affected = recipes.filter(pk__in=RecipePart.objects.filter(
+        ingredient__in=list(prices)).values('recipe'))
+    recipe_rows = affected.order_by().annotate(
+        percentage_total=percentage_total_annotation('recipepart'),
+    ).values_list('pk', 'name', 'cost_per_kg', 'percentage_total')
+    # Percentages are summed per recipe and ingredient by the database, as
+    # scaled integers, which spares converting a decimal per part.
+    parts = RecipePart.objects.filter(
+        ingredient__in=list(prices),
+        recipe__in=affected.order_by().values('pk'),
+    ).order_by().values_list('recipe_id', 'ingredient_id').annotate(
+        percentage=scaled_sum(scaled_integer('percentage', PERCENTAGE_PLACES)))
+
+    # The change of each part cost per scaled percentage.
+    price_changes = {
+        pk: (
+            fixedpoint.to_fixed(prices[pk], PRICE_PLACES) -
+            fixedpoint.to_fixed(price, PRICE_PLACES)
+        ) * UNIT_FACTORS[unit]
+        for pk, price, unit in Ingredient.objects.filter(
+            pk__in=list(prices),
+        ).order_by().values_list('pk', 'price', 'weight_unit')
+    }
+    total_changes = {}
+    for recipe_id, ingredient_id, percentage in parts:
+        total_changes[recipe_id] = (
+            total_changes.get(recipe_id, 0) +
+            summed_integer(percentage) * price_changes[ingredient_id])
+
+    price_places = PRICE_PLACES + PERCENTAGE_PLACES + FACTOR_PLACES
+    repricings = []
+    for pk, name, old_cost, percentage_total in recipe_rows:
+        old_cost = quantize_cost(old_cost)
+        new_cost = quantize_cost(old_cost + fixedpoint.weighted_price(
+            total_changes.get(pk, 0), summed_integer(percentage_total),
+            price_places, PERCENTAGE_PLACES))
+        repricings.append(Repricing(
+            pk, name, old_cost, new_cost, new_cost - old_cost))
+    repricings.sort(key=lambda repricing: (
+        -abs(repricing.delta), repricing.name, repricing.recipe_id))
+    return repricings
@@ -0,0 +1,295 @@
+"""Synthetic recipe libraries, to reproduce production scale locally."""
+import colorsys
+import random
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image
+
+from glaze.models import Profile
+from recipes.costing import CostMatrix
+from recipes.images import create_variants, encode
+from recipes.models import (
+    MAX_QUERY_PARAMS,
+    Ingredient,
+    Kind,
+    Recipe,
+    RecipePart,
+    WeightUnit,
+    quantize_cost,
+)
+
+MATERIALS = [
+    ('Silica', Kind.Base),
+    ('EPK Kaolin', Kind.Base),
+    ('Custer Feldspar', Kind.Base),
+    ('Nepheline Syenite', Kind.Base),
+    ('Whiting', Kind.Base),
+    ('Wollastonite', Kind.Base),
+    ('Dolomite', Kind.Base),
+    ('Talc', Kind.Base),
+    ('Frit 3134', Kind.Base),
+    ('Frit 3124', Kind.Base),
+    ('Ball Clay', Kind.Base),
+    ('Gerstley Borate', Kind.Base),
+    ('Spodumene', Kind.Base),
+    ('Cornwall Stone', Kind.Base),
+    ('Bone Ash', Kind.Base),
+    ('Zinc Oxide', Kind.Base),
+    ('Strontium Carbonate', Kind.Base),
+    ('Lithium Carbonate', Kind.Base),
+    ('Magnesium Carbonate', Kind.Base),
+    ('Bentonite', Kind.Addition),
+    ('Zircopax', Kind.Addition),
+    ('Tin Oxide', Kind.Addition),
+    ('Red Iron Oxide', Kind.Addition),
+    ('Cobalt Carbonate', Kind.Addition),
+    ('Copper Carbonate', Kind.Addition),
+    ('Rutile', Kind.Addition),
+    ('Titanium Dioxide', Kind.Addition),
+    ('Manganese Dioxide', Kind.Addition),
+    ('Chrome Oxide', Kind.Addition),
+    ('Nickel Oxide', Kind.Addition),
+]
+FINISHES = [
+    'Glossy', 'Satin', 'Matte', 'Crackle', 'Float', 'Shino', 'Ash', 'Crystal',
+]
+COLORS = [
+    'Celadon', 'Blue', 'White', 'Amber', 'Rust', 'Green', 'Black', 'Honey',
+    'Teal', 'Oatmeal', 'Plum', 'Turquoise',
+]
+# Units ingredients are priced by, with how often each one shows up.
+WEIGHT_UNITS = [WeightUnit.Kg, WeightUnit.lb, WeightUnit.g, WeightUnit.bag]
+WEIGHT_UNIT_WEIGHTS = [6, 2, 1, 1]
+# Prices, in cents.
+MIN_PRICE = 50
+MAX_PRICE = 8000
+# Percentage added by each addition, in hundredths of a percent.
+MIN_ADDITION = 50
+MAX_ADDITION = 800
+
+# Recipes share a few images, so that `--images` costs the same at any size.
+SWATCH_COUNT = 8
+SWATCH_SIZE = (640, 480)
+SWATCH_DIR = 'dataset'
+
+# Bulk inserts that filter by user stay under SQLite's parameter limit.
+MAX_USERS_PER_CHUNK = 500
+
+
+def split_percentages(rng, count, total=10000):
+    """Returns `count` random hundredths of a percent that add up to
+    `total`.
+    """
+    cuts = sorted(rng.randint(0, total) for _ in range(count - 1))
+    return [
+        end - start for start, end in zip([0] + cuts, cuts + [total])
+    ]
+
+
+def cents(value):
+    return Decimal(value).scaleb(-2)
+
+
+def ingredient_name(index):
+    name, kind = MATERIALS[index % len(MATERIALS)]
+    batch = index // len(MATERIALS)
+    return '{} {}'.format(name, batch + 1) if batch else name
+
+
+def swatch(index):
+    hue = index / SWATCH_COUNT
+    red, green, blue = colorsys.hsv_to_rgb(hue, 0.45, 0.8)
+    return Image.new('RGB', SWATCH_SIZE, (
+        int(red * 255), int(green * 255), int(blue * 255)))
+
+
+def store_swatches(storage=default_storage):
+    """Stores the recipe images, and their variants, if they aren't yet."""
+    names = []
+    for index in range(SWATCH_COUNT):
+        name = '{}/swatch-{}.jpg'.format(SWATCH_DIR, index)
+        if not storage.exists(name):
+            storage.save(name, ContentFile(encode(swatch(index), 'JPEG')))
+            create_variants(name, storage)
+        names.append(name)
+    return names
+
+
+class DatasetGenerator:
+    """Writes users with ingredients, recipes and parts, in chunks.
+
+    Every random choice comes from one generator, so a seed always writes
+    the same dataset. Rows are written with `bulk_create`, which skips the
+    model signals, so profiles are written here, and recipe costs are
+    computed before the recipes are written.
+    """
+    def __init__(self, users, ingredients_per_user, recipes_per_user,
+                 parts_per_recipe, seed=None, images=False,
+                 username_prefix='user', password='glaze',
+                 chunk_size=10000):
+        if parts_per_recipe > ingredients_per_user:
+            raise ValueError(
+                'Recipes can only have as many parts as there are '
+                'ingredients')
+        self.users = users
+        self.ingredients_per_user = ingredients_per_user
+        self.recipes_per_user = recipes_per_user
+        self.parts_per_recipe = parts_per_recipe
+        self.rng = random.Random(seed)
+        self.images = images
+        self.username_prefix = username_prefix
+        self.password = password
+        self.chunk_size = chunk_size
+
+    def usernames(self):
+        return [
+            '{}{}'.format(self.username_prefix, index + 1)
+            for index in range(self.users)
+        ]
+
+    def users_per_chunk(self):
+        rows = max(self.recipes_per_user * self.parts_per_recipe, 1)
+        return max(1, min(self.chunk_size // rows, MAX_USERS_PER_CHUNK))
+
+    def generate(self):
+        """Writes the whole dataset, yielding how many users are done after
+        each chunk.
+        """
+        usernames = self.usernames()
+        # Chunks are committed one by one, so every user is checked before
+        # the first one is written.
+        for start in range(0, len(usernames), MAX_QUERY_PARAMS):
+            existing = User.objects.filter(
+                username__in=usernames[start:start + MAX_QUERY_PARAMS]
+            ).order_by('pk').values_list('username', flat=True).first()
+            if existing is not None:
+                raise ValueError('User {} already exists'.format(existing))
+        # Hashing is slow on purpose, so every user shares one hash.
+        password = make_password(self.password)
+        swatches = store_swatches() if self.images else []
+
+        step = self.users_per_chunk()
+        for start in range(0, len(usernames), step):
+            with transaction.atomic():
+                self.generate_chunk(
+                    usernames[start:start + step], password, swatches)
+            yield min(start + step, len(usernames))
+
+    def generate_chunk(self, usernames, password, swatches):
+        User.objects.bulk_create(
+            User(username=username, password=password)
+            for username in usernames
+        )
+        user_ids = list(User.objects.filter(
+            username__in=usernames).order_by('pk').values_list(
+                'pk', flat=True))
+        Profile.objects.bulk_create(
+            Profile(user_id=user_id) for user_id in user_ids)
+
+        ingredients = [
+            ingredient for user_id in user_ids
+            for ingredient in self.ingredients(user_id)
+        ]
+        Ingredient.objects.bulk_create(ingredients)
+        ingredient_ids = self.pks_by_user(Ingredient, user_ids)
+
+        recipes = []
+        recipe_parts = []
+        rows = []
+        offsets = range(0, len(ingredients), self.ingredients_per_user)
+        for offset, user_id in zip(offsets, user_ids):
+            for recipe in self.recipes(user_id, swatches):
+                parts = self.parts()
+                for position, percentage in parts:
+                    ingredient = ingredients[offset + position]
+                    rows.append((
+                        len(recipes), offset + position, percentage,
+                        ingredient.price, ingredient.weight_unit))
+                recipes.append(recipe)
+                recipe_parts.append(parts)
+        # Every price and percentage is known by now, so the costs are
+        # stored with the recipes instead of being updated afterwards.
+        prices = CostMatrix.from_parts(
+            list(range(len(recipes))), rows).prices()
+        for index, recipe in enumerate(recipes):
+            recipe.cost_per_kg = quantize_cost(prices[index])
+        Recipe.objects.bulk_create(recipes)
+        recipe_ids = self.pks_by_user(Recipe, user_ids)
+
+        parts = []
+        for recipe_id, user_id, chosen in zip(
+                (pk for user_id in user_ids for pk in recipe_ids[user_id]),
+                (recipe.user_id for recipe in recipes),
+                recipe_parts):
+            parts.extend(
+                RecipePart(
+                    recipe_id=recipe_id,
+                    ingredient_id=ingredient_ids[user_id][position],
+                    percentage=percentage,
+                )
+                for position, percentage in chosen
+            )
+            if len(parts) >= self.chunk_size:
+                RecipePart.objects.bulk_create(parts)
+                parts = []
+        RecipePart.objects.bulk_create(parts)
+
+    def pks_by_user(self, model, user_ids):
+        pks = {user_id: [] for user_id in user_ids}
+        for user_id, pk in model.objects.filter(
+                user__in=user_ids).order_by('pk').values_list('user', 'pk'):
+            pks[user_id].append(pk)
+        return pks
+
+    def ingredients(self, user_id):
+        rng = self.rng
+        for index in range(self.ingredients_per_user):
+            yield Ingredient(
+                user_id=user_id,
+                name=ingredient_name(index),
+                kind=MATERIALS[index % len(MATERIALS)][1],
+                price=cents(rng.randint(MIN_PRICE, MAX_PRICE)),
+                weight_unit=rng.choices(
+                    WEIGHT_UNITS, WEIGHT_UNIT_WEIGHTS)[0],
+            )
+
+    def recipes(self, user_id, swatches):
+        rng = self.rng
+        for index in range(self.recipes_per_user):
+            recipe = Recipe(
+                user_id=user_id,
+                name='{} {} {}'.format(
+                    rng.choice(FINISHES), rng.choice(COLORS), index + 1),
+            )
+            if swatches:
+                recipe.image = rng.choice(swatches)
+                recipe.image_width, recipe.image_height = SWATCH_SIZE
+            yield recipe
+
+    def parts(self):
+        """Returns the `(ingredient position, percentage)` of each part of a
+        recipe.
+
+        Base ingredients add up to 100%, like in a real glaze, and each
+        addition goes on top of that.
+        """
+        rng = self.rng
+        chosen = rng.sample(
+            range(self.ingredients_per_user), self.parts_per_recipe)
+        bases = [
+            position for position in chosen
+            if MATERIALS[position % len(MATERIALS)][1] == Kind.Base
+        ]
+        percentages = dict(zip(bases, split_percentages(rng, len(bases))))
+        for position in chosen:
+            if position not in percentages:
+                percentages[position] = rng.randint(
+                    MIN_ADDITION, MAX_ADDITION)
+        return [
+            (position, cents(percentages[position])) for position in chosen
+        ]
@@ -0,0 +1,100 @@
+"""Fixed-point cost arithmetic.
+
+Prices are held as integer micro-units, and percentages as integer basis
+points of basis points, so that weighting and adding up part costs is plain
+integer arithmetic. Only the final divisions are done with `Decimal`, which
+rounds them to the same value as the `Decimal` arithmetic on the original
+numbers, since the quotients are the same.
+"""
+from decimal import Decimal
+from functools import lru_cache
+
+ZERO = Decimal('0')
+
+# A micro-unit is a millionth of the currency.
+PRICE_PLACES = 6
+# A basis point of a basis point is a hundred-millionth of the whole, or a
+# millionth of a percent.
+PERCENTAGE_PLACES = 6
+PERCENT_PLACES = 2
+
+# Libraries reuse a small set of prices and percentages over and over, so
+# their conversions are memoized. Converting a `Decimal` costs more than
+# the arithmetic it saves.
+CONVERSION_CACHE_SIZE = 4096
+
+
+def to_fixed(value, places):
+    """Returns `value` as an integer count of `10 ** -places` units."""
+    scaled = value.scaleb(places)
+    integral = int(scaled)
+    if integral != scaled:
+        raise ValueError('{} has more than {} decimal places'.format(
+            value, places))
+    return integral
+
+
+def from_fixed(value, places):
+    # Unlike `scaleb`, rebuilding the number never rounds it to the context
+    # precision.
+    sign, digits, exponent = Decimal(value).as_tuple()
+    return Decimal((sign, digits, exponent - places))
+
+
+@lru_cache(maxsize=CONVERSION_CACHE_SIZE, typed=True)
+def to_micros(price):
+    return to_fixed(price, PRICE_PLACES)
+
+
+@lru_cache(maxsize=CONVERSION_CACHE_SIZE, typed=True)
+def to_percentage_units(percentage):
+    return to_fixed(percentage, PERCENTAGE_PLACES)
+
+
+def factor_places(factors):
+    """Returns how many decimal places are needed to hold all `factors`."""
+    return max(
+        max(-factor.normalize().as_tuple().exponent, 0)
+        for factor in factors
+    )
+
+
+def factor_table(factors):
+    """Returns `factors` as integers, and the decimal places they're scaled
+    by.
+    """
+    places = factor_places(factors.values())
+    return {
+        key: to_fixed(factor, places) for key, factor in factors.items()
+    }, places
+
+
+def divide(numerator, denominator, places):
+    """Returns `numerator / denominator` shifted by `places` decimal places.
+
+    The quotient is rounded before the shift, which only moves the exponent,
+    so it's rounded exactly like a division of the original numbers.
+    """
+    return (Decimal(numerator) / Decimal(denominator)).scaleb(places)
+
+
+def weighted_price(price_total, percentage_total, price_total_places,
+                   percentage_places=PERCENTAGE_PLACES):
+    """Returns the price per unit weight of the totals of a recipe's parts.
+    """
+    if not percentage_total:
+        return ZERO
+
+    return divide(
+        price_total, percentage_total, percentage_places - price_total_places)
+
+
+def cost_share(weighted_cost, cost_total):
+    """Returns the percentage `weighted_cost` makes up of `cost_total`.
+
+    Both costs must have the same scale.
+    """
+    if not cost_total:
+        return ZERO
+
+    return divide(weighted_cost, cost_total, PERCENT_PLACES)
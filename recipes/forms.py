@@ -1,12 +1,28 @@
 from django.core.exceptions import ObjectDoesNotExist
 from django.forms import (
+    BaseFormSet,
+    BaseInlineFormSet,
+    ChoiceField,
+    DecimalField,
+    Form,
     ModelForm,
+    TextInput,
+    TypedChoiceField,
     ValidationError,
+    formset_factory,
     inlineformset_factory,
 )
+from django.forms.utils import flatatt
+from django.utils.functional import cached_property, lazy
+from django.utils.html import format_html
+from django.utils.translation import ugettext_lazy as _
 
-from glaze.forms import LocalizeFieldsMixin
-from recipes.models import Ingredient, Recipe, RecipePart
+from glaze.forms import (
+    LocalizeFieldsMixin,
+    PreloadedChoices,
+    PreloadedModelChoiceField,
+)
+from recipes.models import Ingredient, Kind, Recipe, RecipePart, WeightUnit
 
 
 class UserBoundForm(ModelForm, LocalizeFieldsMixin):
@@ -41,18 +57,230 @@ class RecipeForm(UserBoundForm):
         localized_fields = '__all__'
 
 
+class IngredientPicker(TextInput):
+    """Search box for the ingredient catalog that is sent once per page.
+
+    Only the name of the selected ingredient is rendered, and the pk goes
+    in a hidden input, so the rows don't carry the whole list of options.
+    """
+    catalog_id = 'ingredient-catalog'
+
+    def __init__(self, attrs=None):
+        super().__init__(attrs)
+        self.choices = ()
+
+    def get_label(self, value):
+        if value in (None, ''):
+            return ''
+        for choice_value, choice_label in self.choices:
+            if str(choice_value) == str(value):
+                return choice_label
+        return ''
+
+    def render(self, name, value, attrs=None):
+        search_attrs = self.build_attrs(
+            attrs, type='search', list=self.catalog_id, autocomplete='off')
+        search_attrs['class'] = ' '.join(filter(None, [
+            search_attrs.get('class'), 'ingredient-picker-search']))
+        label = self.get_label(value)
+        if label:
+            search_attrs['value'] = label
+        return format_html(
+            '<input{} /><input{} />',
+            flatatt(search_attrs),
+            flatatt({
+                'type': 'hidden',
+                'class': 'ingredient-picker-value',
+                'name': name,
+                'value': '' if value is None else value,
+            }),
+        )
+
+
 class RecipePartForm(ModelForm, LocalizeFieldsMixin):
     def __init__(self, *args, **kwargs):
         user = kwargs.pop('user')
+        ingredients = kwargs.pop('ingredients', None)
         super().__init__(*args, **kwargs)
         self.fields['ingredient'].queryset = Ingredient.objects.for_user(user)
+        if ingredients is not None:
+            self.fields['ingredient'].preload(ingredients)
         self.localize_fields()
 
+    def _get_validation_exclusions(self):
+        exclude = super()._get_validation_exclusions()
+        if self.fields['ingredient'].preloaded is not None:
+            # Already checked against the user's ingredients, no need to
+            # query for it again.
+            exclude.append('ingredient')
+        return exclude
+
     class Meta:
         model = RecipePart
         fields = ['ingredient', 'percentage']
+        field_classes = {
+            'ingredient': PreloadedModelChoiceField,
+        }
+        widgets = {
+            'ingredient': IngredientPicker,
+        }
         localized_fields = '__all__'
 
 
+class BaseRecipePartFormset(BaseInlineFormSet):
+    @cached_property
+    def ingredients(self):
+        return PreloadedChoices(
+            Ingredient.objects.for_user(self.form_kwargs['user']))
+
+    @cached_property
+    def parts(self):
+        return PreloadedChoices(self.get_queryset())
+
+    def get_form_kwargs(self, index):
+        kwargs = super().get_form_kwargs(index)
+        kwargs['ingredients'] = self.ingredients
+        return kwargs
+
+    def add_fields(self, form, index):
+        super().add_fields(form, index)
+        pk_name = self._pk_field.name
+        pk_field = form.fields[pk_name]
+        form.fields[pk_name] = PreloadedModelChoiceField(
+            pk_field.queryset, initial=pk_field.initial, required=False,
+            widget=pk_field.widget)
+        form.fields[pk_name].preload(self.parts)
+
+    def save(self, commit=True):
+        instances = super().save(commit=False)
+        if commit:
+            self.instance.save_parts(
+                new=self.new_objects,
+                changed=[obj for obj, changed_data in self.changed_objects],
+                deleted=self.deleted_objects,
+            )
+        return instances
+
+
 RecipePartFormset = inlineformset_factory(
-    Recipe, RecipePart, RecipePartForm, extra=5, localized_fields='__all__')
+    Recipe, RecipePart, RecipePartForm, formset=BaseRecipePartFormset,
+    extra=5, localized_fields='__all__')
+
+
+descending_label = lazy(lambda label: _('%s (descending)') % label, str)
+
+
+def enum_choices(enum):
+    def choices():
+        return [('', _('All'))] + [
+            (str(item.value), str(item)) for item in enum]
+    return choices
+
+
+def enum_field(enum, label):
+    return TypedChoiceField(
+        label=label, choices=enum_choices(enum),
+        coerce=lambda value: enum(int(value)), required=False)
+
+
+class ListOptionsForm(Form):
+    """Sorting and filtering options for the list views.
+
+    `sort_fields` holds `(option, model field, label)` triples, the first
+    one being the default sort.
+    """
+    sort_fields = ()
+    filter_fields = ()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        choices = []
+        for option, field_name, label in self.sort_fields:
+            choices.append((option, label))
+            choices.append(('-' + option, descending_label(label)))
+        self.fields['sort'] = ChoiceField(
+            label=_('Sort by'), choices=choices, required=False)
+        self.order_fields(['sort'])
+
+    @property
+    def sort(self):
+        """Returns the model field to sort by and if it's descending."""
+        option = self.is_valid() and self.cleaned_data.get('sort')
+        if not option:
+            option = self.sort_fields[0][0]
+        fields = {option: field for option, field, label in self.sort_fields}
+        return fields[option.lstrip('-')], option.startswith('-')
+
+    @property
+    def filters(self):
+        self.is_valid()
+        return {
+            name: self.cleaned_data[name]
+            for name in self.filter_fields
+            if self.cleaned_data.get(name) not in (None, '')
+        }
+
+
+class IngredientListOptionsForm(ListOptionsForm):
+    kind = enum_field(Kind, _('Kind'))
+    weight_unit = enum_field(WeightUnit, _('Weight unit'))
+
+    sort_fields = (
+        ('name', 'name', _('Name')),
+        ('price', 'price', _('Price')),
+        ('kind', 'kind', _('Kind')),
+        ('created', 'created', _('Created at')),
+        ('updated', 'updated', _('Updated at')),
+    )
+    filter_fields = ('kind', 'weight_unit')
+
+
+class RecipeListOptionsForm(ListOptionsForm):
+    sort_fields = (
+        ('name', 'name', _('Name')),
+        ('price', 'cost_per_kg', _('Price')),
+        ('created', 'created', _('Created at')),
+        ('updated', 'updated', _('Updated at')),
+    )
+
+
+class RepricingForm(Form, LocalizeFieldsMixin):
+    ingredient = PreloadedModelChoiceField(
+        Ingredient.objects.none(), label=_('Ingredient'),
+        widget=IngredientPicker)
+    price = DecimalField(
+        label=_('New price'), max_digits=10, decimal_places=2, min_value=0)
+
+    def __init__(self, *args, **kwargs):
+        user = kwargs.pop('user')
+        ingredients = kwargs.pop('ingredients', None)
+        super().__init__(*args, **kwargs)
+        self.fields['ingredient'].queryset = Ingredient.objects.for_user(user)
+        if ingredients is not None:
+            self.fields['ingredient'].preload(ingredients)
+        self.localize_fields()
+
+
+class BaseRepricingFormset(BaseFormSet):
+    @cached_property
+    def ingredients(self):
+        return PreloadedChoices(
+            Ingredient.objects.for_user(self.form_kwargs['user']))
+
+    def get_form_kwargs(self, index):
+        kwargs = super().get_form_kwargs(index)
+        kwargs['ingredients'] = self.ingredients
+        return kwargs
+
+    @property
+    def prices(self):
+        """New prices by ingredient pk, from the filled forms."""
+        return {
+            form.cleaned_data['ingredient'].pk: form.cleaned_data['price']
+            for form in self.forms
+            if form.cleaned_data
+        }
+
+
+RepricingFormset = formset_factory(
+    RepricingForm, formset=BaseRepricingFormset, extra=5)
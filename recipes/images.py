@@ -0,0 +1,157 @@
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image
+
+EXIF_ORIENTATION = 274
+
+# Transpositions that undo each EXIF orientation, using only the operations
+# that every Pillow release has.
+ORIENTATION_TRANSPOSES = {
+    2: [Image.FLIP_LEFT_RIGHT],
+    3: [Image.ROTATE_180],
+    4: [Image.FLIP_TOP_BOTTOM],
+    5: [Image.ROTATE_90, Image.FLIP_TOP_BOTTOM],
+    6: [Image.ROTATE_270],
+    7: [Image.ROTATE_90, Image.FLIP_LEFT_RIGHT],
+    8: [Image.ROTATE_90],
+}
+
+# (extension, Pillow format, MIME type), in order of preference.
+VARIANT_FORMATS = [
+    ('webp', 'WEBP', 'image/webp'),
+    ('jpg', 'JPEG', 'image/jpeg'),
+]
+
+
+def supported_variant_formats():
+    Image.init()
+    return [
+        variant_format for variant_format in VARIANT_FORMATS
+        if variant_format[1] in Image.SAVE
+    ]
+
+
+def fix_orientation(image):
+    try:
+        exif = image._getexif() or {}
+    except (AttributeError, IndexError, KeyError, OSError):
+        exif = {}
+    for method in ORIENTATION_TRANSPOSES.get(exif.get(EXIF_ORIENTATION), []):
+        image = image.transpose(method)
+    return image
+
+
+def flatten(image):
+    if image.mode in ('RGBA', 'LA') or (
+            image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        return background
+    return image.convert('RGB')
+
+
+def encode(image, image_format):
+    output = BytesIO()
+    if image_format == 'JPEG':
+        image.save(
+            output, image_format, quality=settings.RECIPE_IMAGE_QUALITY,
+            optimize=True, progressive=True)
+    else:
+        image.save(
+            output, image_format, quality=settings.RECIPE_IMAGE_QUALITY)
+    return output.getvalue()
+
+
+def normalize_image(file_):
+    """Returns an upright, size-limited JPEG copy of an image, and its size.
+
+    The metadata isn't copied, so neither the orientation flag nor things
+    like GPS positions survive the upload.
+    """
+    file_.seek(0)
+    image = Image.open(file_)
+    image = flatten(fix_orientation(image))
+    max_size = settings.RECIPE_IMAGE_MAX_SIZE
+    image.thumbnail((max_size, max_size), Image.LANCZOS)
+
+    stem = os.path.splitext(os.path.basename(file_.name))[0]
+    content = ContentFile(encode(image, 'JPEG'), name='{}.jpg'.format(stem))
+    return content, image.size
+
+
+def variant_widths(width):
+    return [
+        variant_width for variant_width in settings.RECIPE_IMAGE_WIDTHS
+        if variant_width < width
+    ] + [width]
+
+
+def variant_name(name, width, extension):
+    stem = os.path.splitext(name)[0]
+    return os.path.join(
+        'variants', '{}-{}w.{}'.format(stem, width, extension))
+
+
+def create_variants(name, storage=default_storage):
+    """Stores every width and format of an image that `ImageVariants` uses."""
+    with storage.open(name) as f:
+        image = flatten(Image.open(f))
+    original_width, original_height = image.size
+    names = []
+    for width in variant_widths(original_width):
+        height = round(original_height * width / original_width)
+        resized = image.resize((width, height), Image.LANCZOS)
+        for extension, image_format, mime_type in (
+                supported_variant_formats()):
+            path = variant_name(name, width, extension)
+            if storage.exists(path):
+                storage.delete(path)
+            names.append(storage.save(
+                path, ContentFile(encode(resized, image_format))))
+    return names
+
+
+def delete_variants(name, width, storage=default_storage):
+    """Deletes what `create_variants` stored for an image of `width`."""
+    for variant_width in variant_widths(width):
+        for extension, image_format, mime_type in VARIANT_FORMATS:
+            storage.delete(variant_name(name, variant_width, extension))
+
+
+class ImageVariants:
+    """The `srcset` of each variant format of a normalized image."""
+    def __init__(self, name, width, storage=default_storage):
+        self.name = name
+        self.width = width
+        self.storage = storage
+
+    def srcset(self, extension):
+        return ', '.join(
+            '{} {}w'.format(
+                self.storage.url(variant_name(self.name, width, extension)),
+                width)
+            for width in variant_widths(self.width)
+        )
+
+    @property
+    def sources(self):
+        return [
+            {'type': mime_type, 'srcset': self.srcset(extension)}
+            for extension, image_format, mime_type in (
+                supported_variant_formats())
+            if image_format != 'JPEG'
+        ]
+
+    @property
+    def fallback_srcset(self):
+        return self.srcset('jpg')
+
+    @property
+    def fallback_url(self):
+        return self.storage.url(
+            variant_name(self.name, variant_widths(self.width)[0], 'jpg'))
@@ -0,0 +1,69 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.dataset import DatasetGenerator
+
+
+class Command(BaseCommand):
+    help = 'Generates users with synthetic ingredients and recipes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=10,
+            help='How many users to generate.')
+        parser.add_argument(
+            '--ingredients-per-user', type=int, default=50,
+            help='How many ingredients each user gets.')
+        parser.add_argument(
+            '--recipes-per-user', type=int, default=100,
+            help='How many recipes each user gets.')
+        parser.add_argument(
+            '--parts-per-recipe', type=int, default=6,
+            help='How many ingredients each recipe uses.')
+        parser.add_argument(
+            '--seed', type=int,
+            help='Seed for the random choices, to repeat a dataset.')
+        parser.add_argument(
+            '--images', action='store_true',
+            help='Give every recipe one of a few generated images.')
+        parser.add_argument(
+            '--username-prefix', default='user',
+            help='Users are named with this prefix and a number.')
+        parser.add_argument(
+            '--password', default='glaze',
+            help='Password of every generated user.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=10000,
+            help='How many parts to write per transaction.')
+
+    def handle(self, *args, **options):
+        try:
+            generator = DatasetGenerator(
+                users=options['users'],
+                ingredients_per_user=options['ingredients_per_user'],
+                recipes_per_user=options['recipes_per_user'],
+                parts_per_recipe=options['parts_per_recipe'],
+                seed=options['seed'],
+                images=options['images'],
+                username_prefix=options['username_prefix'],
+                password=options['password'],
+                chunk_size=options['chunk_size'],
+            )
+            start = perf_counter()
+            for done in generator.generate():
+                self.stdout.write('{} of {} users generated'.format(
+                    done, options['users']))
+        except ValueError as e:
+            raise CommandError(e)
+
+        self.stdout.write(
+            '{} users, {} ingredients, {} recipes and {} parts generated '
+            'in {:.1f}s'.format(
+                options['users'],
+                options['users'] * options['ingredients_per_user'],
+                options['users'] * options['recipes_per_user'],
+                options['users'] * options['recipes_per_user'] *
+                options['parts_per_recipe'],
+                perf_counter() - start,
+            ))
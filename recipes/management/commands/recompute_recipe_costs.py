@@ -0,0 +1,85 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from glaze.cache import bump_user_cache_version
+from recipes.models import Recipe, RecipePart, fixed_price, quantize_cost
+
+
+def expected_costs(pks):
+    """Returns the cost of each recipe in `pks` as it should be stored.
+
+    The costs are summed part by part in Python, independently of the SQL
+    that `Recipe.objects.update_costs` stores them with.
+    """
+    parts = defaultdict(list)
+    for part in RecipePart.objects.filter(
+            recipe__in=pks).select_related('ingredient'):
+        parts[part.recipe_id].append(part)
+    return {pk: quantize_cost(fixed_price(parts[pk])) for pk in pks}
+
+
+def as_stored(cost, using):
+    """Returns `cost` the way the database gives it back once stored.
+
+    SQLite stores decimals as doubles, and reads them back with 15
+    significant digits, so larger costs can't be kept exactly there.
+    """
+    if connections[using].vendor != 'sqlite':
+        return cost
+    return quantize_cost(Decimal('{:.15g}'.format(float(cost))))
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the stored cost of every recipe.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Only report the recipes whose stored cost has drifted.')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='How many recipes to recompute per query.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        checked = 0
+        drifted = {}
+        owners = set()
+        last_pk = 0
+
+        while True:
+            batch = Recipe.objects.filter(pk__gt=last_pk).order_by('pk')
+            stored = {
+                pk: (user_id, cost) for pk, user_id, cost in batch.values_list(
+                    'pk', 'user', 'cost_per_kg')[:batch_size]
+            }
+            if not stored:
+                break
+            last_pk = max(stored)
+            checked += len(stored)
+
+            costs = expected_costs(list(stored))
+            for pk, cost in costs.items():
+                user_id, stored_cost = stored[pk]
+                if as_stored(cost, batch.db) != stored_cost:
+                    drifted[pk] = cost
+                    owners.add(user_id)
+                    self.stdout.write('Recipe {}: {} -> {}'.format(
+                        pk, stored_cost, cost))
+
+        if options['check']:
+            if drifted:
+                raise CommandError('{} of {} recipe costs have drifted'.format(
+                    len(drifted), checked))
+            self.stdout.write('{} recipe costs checked, none drifted'.format(
+                checked))
+            return
+
+        Recipe.objects.set_costs(drifted)
+        for user_id in owners:
+            bump_user_cache_version(user_id)
+        self.stdout.write('{} of {} recipe costs updated'.format(
+            len(drifted), checked))
@@ -0,0 +1,64 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from recipes.models import Recipe
+from recipes.thumbnails import generate_thumbnails
+
+
+def warm(name):
+    generate_thumbnails(name)
+    return name
+
+
+class Command(BaseCommand):
+    help = 'Generates the thumbnails of every recipe image.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='How many processes to generate thumbnails with. '
+                 'With 0, they are generated in this process.')
+        parser.add_argument(
+            '--progress-every', type=int, default=100,
+            help='How many images to process between progress reports.')
+
+    def handle(self, *args, **options):
+        names = sorted(set(
+            Recipe.objects.exclude(image='').exclude(
+                image__isnull=True).values_list('image', flat=True)))
+        total = len(names)
+        failed = 0
+
+        for done, (name, error) in enumerate(
+                self.warm_all(names, options['workers']), 1):
+            if error is not None:
+                failed += 1
+                self.stderr.write('Failed {}: {}'.format(name, error))
+            elif options['verbosity'] > 1:
+                self.stdout.write('Warmed {}'.format(name))
+            if done % options['progress_every'] == 0 or done == total:
+                self.stdout.write('{} of {} images processed'.format(
+                    done, total))
+
+        if failed:
+            raise CommandError('{} of {} images failed'.format(failed, total))
+        self.stdout.write('{} images warmed'.format(total))
+
+    def warm_all(self, names, workers):
+        if not workers:
+            for name in names:
+                try:
+                    yield warm(name), None
+                except Exception as e:
+                    yield name, e
+            return
+
+        # Forked workers must not share the parent's database connections.
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(warm, name): name for name in names}
+            for future in as_completed(futures):
+                yield futures[future], future.exception()
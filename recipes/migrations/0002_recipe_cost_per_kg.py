@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from collections import defaultdict
+from decimal import Decimal, localcontext
+
+from django.db import migrations, models
+
+# The cost arithmetic as it was when this migration was written, so that
+# later changes to the models don't change what it does.
+ZERO = Decimal('0')
+COST_QUANTUM = Decimal('0.000001')
+# How many of each weight unit, by stored value, weigh a Kg.
+UNITS_PER_KG = {
+    0: Decimal('1000'),
+    1: Decimal('1'),
+    2: Decimal('2.204622622'),
+    3: Decimal('35.273961950'),
+    4: Decimal('0.001'),
+    5: Decimal('0.04'),
+}
+# Each recipe takes two parameters, which keeps batches under SQLite's limit
+# of 999.
+BATCH_SIZE = 400
+
+
+def compute_costs(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipePart = apps.get_model('recipes', 'RecipePart')
+    totals = defaultdict(lambda: [ZERO, ZERO])
+
+    parts = RecipePart.objects.values_list(
+        'recipe_id', 'percentage', 'ingredient__price',
+        'ingredient__weight_unit')
+    # Sums are kept exact, and only the final division is rounded.
+    with localcontext() as context:
+        context.prec = 80
+        for recipe_id, percentage, price, weight_unit in parts.iterator():
+            total = totals[recipe_id]
+            total[0] += price * percentage * UNITS_PER_KG[weight_unit]
+            total[1] += percentage
+
+    costs = [
+        (pk, (price / percentage if percentage else ZERO).quantize(
+            COST_QUANTUM))
+        for pk, (price, percentage) in sorted(totals.items())
+    ]
+    field = models.DecimalField(max_digits=20, decimal_places=6)
+    for start in range(0, len(costs), BATCH_SIZE):
+        batch = costs[start:start + BATCH_SIZE]
+        Recipe.objects.filter(pk__in=[pk for pk, cost in batch]).update(
+            cost_per_kg=models.Case(
+                *[
+                    models.When(pk=pk, then=models.Value(
+                        cost, output_field=field))
+                    for pk, cost in batch
+                ],
+                output_field=field
+            ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='cost_per_kg',
+            field=models.DecimalField(decimal_places=6, default=Decimal('0'), editable=False, max_digits=20, verbose_name='Cost per Kg'),
+        ),
+        migrations.RunPython(compute_costs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0002_recipe_cost_per_kg'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='ingredient',
+            index_together=set([('user', 'updated', 'id'), ('user', 'kind', 'id'), ('user', 'created', 'id'), ('user', 'name', 'id'), ('user', 'price', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='recipe',
+            index_together=set([('user', 'updated', 'id'), ('user', 'name', 'id'), ('user', 'created', 'id'), ('user', 'cost_per_kg', 'id')]),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_recipe_image_size'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='recipepart',
+            index_together=set([('ingredient', 'recipe')]),
+        ),
+    ]
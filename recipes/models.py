@@ -1,22 +1,50 @@
+import logging
+import threading
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
 from decimal import Decimal
 from enum import IntEnum
 
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models.functions import Cast
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.translation import ugettext as _
 from enumfields import EnumIntegerField
 from sorl.thumbnail import ImageField
 
+from glaze.cache import bump_user_cache_version
+from recipes import fixedpoint
+from recipes.images import ImageVariants, normalize_image
+from recipes.thumbnails import (
+    queue_thumbnails,
+    queue_variant_deletion,
+    queue_variants,
+    thumbnails_generated,
+)
+
+
+logger = logging.getLogger(__name__)
 
 ZERO = Decimal('0')
-PERCENT = Decimal('100')
+COST_QUANTUM = Decimal('0.000001')
+# SQLite can't bind more than 999 parameters in a single statement.
+MAX_QUERY_PARAMS = 999
 
 
 class PrettyIntEnum(IntEnum):
     def __str__(self):
         return _(self.name)
 
+    @property
+    def label(self):
+        # Used by enumfields for the form choices.
+        return str(self)
+
 
 class Kind(PrettyIntEnum):
     Base = 0
@@ -28,24 +56,335 @@ _('Addition')
 
 
 class WeightUnit(PrettyIntEnum):
+    """Units ingredients are priced by.
+
+    Values are stored in `Ingredient.weight_unit`, so a new unit takes the
+    next free value, and existing values never change. Every unit needs its
+    weight in `GRAMS`.
+    """
     g = 0
     Kg = 1
+    lb = 2
+    oz = 3
+    t = 4
+    bag = 5
+
+    def __str__(self):
+        return _(WEIGHT_UNIT_LABELS.get(self, self.name))
 
     def weighted_in(self, weight_unit):
-        if self is self.Kg and weight_unit is self.g:
-            return Decimal('1000')
-        if self is self.g and weight_unit is self.Kg:
-            return Decimal('0.001')
-        return Decimal('1')
+        return WEIGHT_FACTORS[self][weight_unit]
+
 
+WEIGHT_UNIT_LABELS = {
+    WeightUnit.bag: '25 Kg bag',
+}
+
+_('25 Kg bag')
+
+GRAMS = {
+    WeightUnit.g: Decimal('1'),
+    WeightUnit.Kg: Decimal('1000'),
+    WeightUnit.lb: Decimal('453.59237'),
+    WeightUnit.oz: Decimal('28.349523125'),
+    WeightUnit.t: Decimal('1000000'),
+    WeightUnit.bag: Decimal('25000'),
+}
+# Conversions that don't end, like Kg to lb, are rounded to this.
+WEIGHT_FACTOR_QUANTUM = Decimal('0.000000001')
+
+
+def weight_factor(unit, other):
+    factor = GRAMS[unit] / GRAMS[other]
+    rounded = factor.quantize(WEIGHT_FACTOR_QUANTUM)
+    return factor if rounded == factor else rounded
+
+
+assert sorted(WeightUnit) == list(range(len(WeightUnit))), (
+    'Weight unit values must be contiguous, to index WEIGHT_FACTORS')
+# Conversion matrix, indexed by unit values: one of the first unit weighs
+# as much as WEIGHT_FACTORS[unit][other] of the second.
+WEIGHT_FACTORS = tuple(
+    tuple(weight_factor(unit, other) for other in WeightUnit)
+    for unit in WeightUnit
+)
 
 REFERENCE_WEIGHT_UNIT = WeightUnit.Kg
 
+# Integer factor of each weight unit to the reference one, with
+# REFERENCE_FACTOR_PLACES decimal places.
+REFERENCE_FACTORS, REFERENCE_FACTOR_PLACES = fixedpoint.factor_table({
+    unit: REFERENCE_WEIGHT_UNIT.weighted_in(unit) for unit in WeightUnit
+})
+# Decimal places of `RecipePart.fixed_weighted_cost`.
+WEIGHTED_COST_PLACES = (
+    fixedpoint.PRICE_PLACES + fixedpoint.PERCENTAGE_PLACES +
+    REFERENCE_FACTOR_PLACES
+)
+
+
+# Decimal places of `Ingredient.price` and `RecipePart.percentage`, which SQL
+# scales its sums by.
+PRICE_FIELD_PLACES = 2
+PERCENTAGE_FIELD_PLACES = 4
+# Decimal places of the price totals summed by SQL, once converted to the
+# reference unit.
+SQL_PRICE_TOTAL_PLACES = (
+    PRICE_FIELD_PLACES + PERCENTAGE_FIELD_PLACES + REFERENCE_FACTOR_PLACES)
+
+SCALED_FIELD = models.DecimalField(max_digits=38, decimal_places=0)
+
+
+def scaled_integer(lookup, places):
+    """SQL counterpart of `fixedpoint.to_fixed`.
+
+    SQLite keeps decimals as floats, so the scaled value is rounded back to
+    the integer it stands for.
+    """
+    return Cast(
+        models.Func(
+            models.ExpressionWrapper(
+                models.F(lookup) * models.Value(10 ** places),
+                output_field=models.DecimalField()),
+            function='ROUND', output_field=models.DecimalField()),
+        SCALED_FIELD)
+
+
+def scaled_sum(expression, **conditions):
+    if conditions:
+        expression = models.Case(
+            models.When(then=expression, **conditions),
+            default=models.Value(0),
+            output_field=SCALED_FIELD,
+        )
+    return models.Sum(expression, output_field=models.BigIntegerField())
+
+
+def scaled_cost(parts_lookup):
+    """The price times the percentage of each part, as an integer."""
+    return (
+        scaled_integer(
+            '{}__ingredient__price'.format(parts_lookup), PRICE_FIELD_PLACES) *
+        scaled_integer(
+            '{}__percentage'.format(parts_lookup), PERCENTAGE_FIELD_PLACES)
+    )
+
 
-class UserBoundManager(models.Manager):
+def price_total_annotations(prefix, parts_lookup, **conditions):
+    """Sums the part costs of each weight unit, as integers.
+
+    Part costs are only converted to the reference unit in Python, with
+    `fixed_price_total`, as the products with the conversion factors could
+    go past 64 bits. Summing integers keeps the totals exact, where SQL
+    would sum decimals as floats.
+    """
+    unit_lookup = '{}__ingredient__weight_unit'.format(parts_lookup)
+    return {
+        '{}{}'.format(prefix, unit.value): scaled_sum(
+            scaled_cost(parts_lookup),
+            **dict(conditions, **{unit_lookup: unit}))
+        for unit in WeightUnit
+    }
+
+
+def percentage_total_annotation(parts_lookup, **conditions):
+    return scaled_sum(
+        scaled_integer(
+            '{}__percentage'.format(parts_lookup), PERCENTAGE_FIELD_PLACES),
+        **conditions)
+
+
+def summed_integer(value):
+    if value is None:
+        return 0
+    # SQLite turns integers that overflow into floats, which aren't exact.
+    if isinstance(value, float):
+        raise OverflowError('Recipe costs are too large to be summed exactly')
+    return int(value)
+
+
+def fixed_price_total(values, prefix):
+    """Returns the price total summed with `price_total_annotations`, in the
+    reference unit, with SQL_PRICE_TOTAL_PLACES decimal places.
+    """
+    return sum(
+        summed_integer(values['{}{}'.format(prefix, unit.value)]) *
+        REFERENCE_FACTORS[unit]
+        for unit in WeightUnit
+    )
+
+
+def sql_weighted_price(price_total, percentage_total):
+    """Returns the price of totals summed by `RecipeQuerySet.with_price`."""
+    return fixedpoint.weighted_price(
+        price_total, summed_integer(percentage_total),
+        SQL_PRICE_TOTAL_PLACES, PERCENTAGE_FIELD_PLACES)
+
+
+def fixed_price(parts):
+    """Returns the price of a recipe with `parts`, from the parts' own
+    fixed point costs. Their ingredients should be selected along."""
+    price = 0
+    final_percentage = 0
+
+    for part in parts:
+        price += part.fixed_weighted_cost
+        final_percentage += fixedpoint.to_percentage_units(part.percentage)
+
+    return fixedpoint.weighted_price(
+        price, final_percentage, WEIGHTED_COST_PLACES)
+
+
+def quantize_cost(cost):
+    return cost.quantize(COST_QUANTUM)
+
+
+def bulk_update(queryset, objs, fields):
+    """Saves `fields` of every object in `objs` with one UPDATE per batch."""
+    objs = list(objs)
+    fields = [queryset.model._meta.get_field(name) for name in fields]
+    batch_size = MAX_QUERY_PARAMS // (2 * len(fields) + 1)
+
+    with transaction.atomic(using=queryset.db):
+        for start in range(0, len(objs), batch_size):
+            batch = objs[start:start + batch_size]
+            queryset.filter(pk__in=[obj.pk for obj in batch]).update(**{
+                field.name: models.Case(
+                    *[
+                        models.When(pk=obj.pk, then=models.Value(
+                            getattr(obj, field.attname), output_field=field))
+                        for obj in batch
+                    ],
+                    output_field=field
+                )
+                for field in fields
+            })
+
+
+_recipe_updates = threading.local()
+
+
+def recipe_update_batch():
+    """Returns the recipe ids of the active `batched_recipe_updates`."""
+    return getattr(_recipe_updates, 'batch', None)
+
+
+@contextmanager
+def batched_recipe_updates(using=None):
+    """Updates the cost and cached fragments of the recipes whose parts
+    change in the block once, at its end, instead of once per part.
+
+    Nested blocks join the outermost one. Recipes deleted in the block are
+    left out.
+    """
+    if recipe_update_batch() is not None:
+        yield recipe_update_batch()
+        return
+
+    batch = _recipe_updates.batch = set()
+    try:
+        with transaction.atomic(using=using):
+            yield batch
+            _recipe_updates.batch = None
+            pks = sorted(batch)
+            for start in range(0, len(pks), MAX_QUERY_PARAMS):
+                recipes = Recipe.objects.using(using).filter(
+                    pk__in=pks[start:start + MAX_QUERY_PARAMS])
+                recipes.update_costs()
+                for user_id in set(recipes.values_list('user', flat=True)):
+                    bump_user_cache_version(user_id)
+    finally:
+        _recipe_updates.batch = None
+
+
+class UserBoundQuerySet(models.QuerySet):
     def for_user(self, user):
         return self.filter(user=user)
 
+    def delete(self):
+        with batched_recipe_updates(self.db):
+            return super().delete()
+
+
+class UserBoundManager(models.Manager.from_queryset(UserBoundQuerySet)):
+    pass
+
+
+class RecipeQuerySet(UserBoundQuerySet):
+    def with_price(self):
+        # The division is left to `Recipe.price`, so that it's done with the
+        # same fixed-point arithmetic as the pure Python calculation.
+        return self.annotate(
+            percentage_total=percentage_total_annotation('recipepart'),
+            **price_total_annotations('price_total_', 'recipepart'))
+
+    def with_ingredient_usage(self, ingredient):
+        """Keeps the recipes that use an ingredient, annotated with its part.
+
+        The ingredient's totals are summed along with the whole recipe's ones
+        in the same grouped query, so they can be compared with each other.
+        """
+        # All of the ingredient's parts are in its own unit, so they're
+        # summed at once and converted by `IngredientUsage`.
+        return self.filter(pk__in=RecipePart.objects.filter(
+            ingredient=ingredient).values('recipe')).with_price().annotate(
+            ingredient_percentage=percentage_total_annotation(
+                'recipepart', recipepart__ingredient=ingredient),
+            ingredient_price_total=scaled_sum(
+                scaled_cost('recipepart'), recipepart__ingredient=ingredient),
+        )
+
+    def compute_costs(self):
+        # The cost engine is built on these models, so it's only imported
+        # once they're all defined.
+        from recipes.costing import CostMatrix
+
+        # Costs are summed with arbitrary precision integers whenever 64
+        # bits could overflow, so any valid price and percentage is exact.
+        prices = CostMatrix.for_recipes(
+            self.model.objects.filter(pk__in=self.values('pk'))).prices()
+        return {pk: quantize_cost(price) for pk, price in prices.items()}
+
+    def set_costs(self, costs):
+        # A new cost is a visible change, so conditional GETs must see it.
+        now = timezone.now()
+        bulk_update(self.model.objects.all(), [
+            self.model(pk=pk, cost_per_kg=cost, updated=now)
+            for pk, cost in costs.items()
+        ], ['cost_per_kg', 'updated'])
+
+    def update_costs(self):
+        costs = self.compute_costs()
+        self.set_costs(costs)
+        return costs
+
+    def clone(self):
+        recipes = list(self)
+        parts = defaultdict(list)
+        for part in RecipePart.objects.using(self.db).filter(
+                recipe__in=[recipe.pk for recipe in recipes]):
+            parts[part.recipe_id].append(part)
+        recipe_parts = [(recipe, parts[recipe.pk]) for recipe in recipes]
+
+        with transaction.atomic(using=self.db):
+            for recipe in recipes:
+                recipe._detach_as_copy()
+            if connections[self.db].features.can_return_ids_from_bulk_insert:
+                self.model.objects.using(self.db).bulk_create(recipes)
+            else:
+                for recipe in recipes:
+                    recipe.save(using=self.db)
+
+            RecipePart.objects.using(self.db).bulk_create(
+                part.copy_to(recipe)
+                for recipe, parts in recipe_parts
+                for part in parts
+            )
+            for user_id in {recipe.user_id for recipe in recipes}:
+                bump_user_cache_version(user_id)
+
+        return recipes
+
 
 class DateBoundModel(models.Model):
     created = models.DateTimeField(_('Created at'), auto_now_add=True)
@@ -68,6 +407,12 @@ class UserBoundModel(DateBoundModel):
     def __str__(self):
         return self.name
 
+    def delete(self, using=None, keep_parents=False):
+        # The parts deleted along would otherwise update their recipe one by
+        # one, even when it's the recipe being deleted.
+        with batched_recipe_updates(using):
+            return super().delete(using, keep_parents)
+
     def get_absolute_url(self):
         return reverse('{}-detail'.format(self.path_prefix),
                        kwargs={'pk': self.pk})
@@ -85,24 +430,80 @@ class Ingredient(UserBoundModel):
         verbose_name = _('Ingredient')
         verbose_name_plural = _('Ingredients')
         ordering = ['name']
+        index_together = [
+            ('user', 'name', 'id'),
+            ('user', 'price', 'id'),
+            ('user', 'kind', 'id'),
+            ('user', 'created', 'id'),
+            ('user', 'updated', 'id'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        loaded = dict(zip(field_names, values))
+        instance._stored_cost = (
+            loaded.get('price'), loaded.get('weight_unit'))
+        return instance
 
     @property
     def kind_string(self):
         return str(self.kind)
 
+    @property
+    def cost_changed(self):
+        return (
+            getattr(self, '_stored_cost', None) !=
+            (self.price, self.weight_unit)
+        )
+
 
 class Recipe(UserBoundModel):
     ingredients = models.ManyToManyField(
         Ingredient, through='RecipePart', verbose_name=_('Ingredients'))
     description = models.TextField(_('Description'), blank=True, null=True)
     image = ImageField(_('Image'), blank=True, null=True)
+    image_width = models.PositiveIntegerField(
+        _('Image width'), blank=True, null=True, editable=False)
+    image_height = models.PositiveIntegerField(
+        _('Image height'), blank=True, null=True, editable=False)
+    cost_per_kg = models.DecimalField(
+        _('Cost per Kg'), max_digits=20, decimal_places=6, default=ZERO,
+        editable=False)
 
     path_prefix = 'recipe'
     path_prefix_plural = 'recipes'
 
+    objects = UserBoundManager.from_queryset(RecipeQuerySet)()
+
     class Meta:
         verbose_name = _('Recipe')
         verbose_name_plural = _('Recipes')
+        index_together = [
+            ('user', 'name', 'id'),
+            ('user', 'cost_per_kg', 'id'),
+            ('user', 'created', 'id'),
+            ('user', 'updated', 'id'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        loaded = dict(zip(field_names, values))
+        instance._stored_image = loaded.get('image') or None
+        instance._stored_image_width = loaded.get('image_width')
+        return instance
+
+    @property
+    def image_changed(self):
+        stored_image = getattr(self, '_stored_image', None)
+        return stored_image != (self.image.name or None)
+
+    @property
+    def image_variants(self):
+        # Images stored before uploads were normalized have no variants.
+        if self.image and self.image_width:
+            return ImageVariants(self.image.name, self.image_width)
 
     def add_part(self, ingredient, percentage):
         RecipePart.objects.create(
@@ -111,40 +512,63 @@ class Recipe(UserBoundModel):
             percentage=percentage,
         )
 
+    def save_parts(self, new=(), changed=(), deleted=()):
+        """Writes many part changes at once, updating the cost only once."""
+        if not (new or changed or deleted):
+            return
+
+        with batched_recipe_updates() as batch:
+            if deleted:
+                RecipePart.objects.filter(
+                    pk__in=[part.pk for part in deleted],
+                    recipe=self,
+                ).delete()
+            if changed:
+                now = timezone.now()
+                for part in changed:
+                    part.updated = now
+                bulk_update(
+                    RecipePart.objects.filter(recipe=self), changed,
+                    ['ingredient', 'percentage', 'updated'])
+            for part in new:
+                part.recipe = self
+            RecipePart.objects.bulk_create(new)
+            # The cost is kept on this instance too, so it isn't left to the
+            # batch.
+            batch.discard(self.pk)
+            self.update_cost()
+            bump_user_cache_version(self.user_id)
+
     @property
     def parts(self):
         return RecipePart.objects.filter(recipe=self)
 
     @property
     def price(self):
-        price = ZERO
-        final_percentage = ZERO
-
-        for part in self.parts:
-            i = part.ingredient
-            price += (
-                i.price * part.percentage
-                * REFERENCE_WEIGHT_UNIT.weighted_in(i.weight_unit)
-            )
-            final_percentage += part.percentage
+        if hasattr(self, 'percentage_total'):
+            return sql_weighted_price(
+                fixed_price_total(vars(self), 'price_total_'),
+                self.percentage_total)
 
-        if final_percentage == ZERO:
-            return ZERO
+        return fixed_price(self.parts.select_related('ingredient'))
 
-        return price / final_percentage
+    def update_cost(self):
+        costs = Recipe.objects.filter(pk=self.pk).update_costs()
+        self.cost_per_kg = costs.get(self.pk, ZERO)
 
-    def clone(self):
-        parts = self.parts
+    def _detach_as_copy(self):
         self.name = '{} (Copy of {})'.format(self.name, self.pk)
         self.pk = None
         self.id = None
-        self.save()
 
-        for part in parts:
-            part.pk = None
-            part.id = None
-            part.recipe = self
-            part.save()
+    def clone(self):
+        with transaction.atomic():
+            parts = list(self.parts)
+            self._detach_as_copy()
+            self.save()
+            RecipePart.objects.bulk_create(
+                part.copy_to(self) for part in parts)
+            bump_user_cache_version(self.user_id)
 
         return self
 
@@ -158,13 +582,200 @@ class RecipePart(DateBoundModel):
         _('Percentage'), max_digits=10, decimal_places=4)
 
     @property
-    def relative_price(self):
+    def fixed_weighted_cost(self):
+        """`weighted_cost` as an integer, with WEIGHTED_COST_PLACES decimal
+        places.
+        """
         return (
-            self.ingredient.price * self.percentage *
-            REFERENCE_WEIGHT_UNIT.weighted_in(self.ingredient.weight_unit)
-            / PERCENT
+            fixedpoint.to_micros(self.ingredient.price) *
+            fixedpoint.to_percentage_units(self.percentage) *
+            REFERENCE_FACTORS[self.ingredient.weight_unit]
         )
 
+    @property
+    def weighted_cost(self):
+        return fixedpoint.from_fixed(
+            self.fixed_weighted_cost, WEIGHTED_COST_PLACES)
+
+    @property
+    def relative_price(self):
+        return fixedpoint.from_fixed(
+            self.fixed_weighted_cost,
+            WEIGHTED_COST_PLACES + fixedpoint.PERCENT_PLACES)
+
+    def copy_to(self, recipe):
+        self.pk = None
+        self.id = None
+        self.recipe = recipe
+        return self
+
     class Meta:
         verbose_name = _('Recipe part')
         verbose_name_plural = _('Recipe parts')
+        # Finds the recipes that use an ingredient without touching the
+        # part rows themselves.
+        index_together = [
+            ('ingredient', 'recipe'),
+        ]
+
+
+PartCost = namedtuple('PartCost', ['part', 'relative_price', 'cost_share'])
+FixedPartCost = namedtuple('FixedPartCost', ['part', 'fixed_weighted_cost'])
+
+
+class RecipeCostBreakdown:
+    """Per-part costs of a recipe, loaded in one query when first used."""
+    def __init__(self, recipe):
+        self.recipe = recipe
+
+    @cached_property
+    def price(self):
+        return fixedpoint.weighted_price(
+            sum(cost.fixed_weighted_cost for cost in self._fixed_costs),
+            sum(
+                fixedpoint.to_percentage_units(cost.part.percentage)
+                for cost in self._fixed_costs
+            ),
+            WEIGHTED_COST_PLACES,
+        )
+
+    @cached_property
+    def _fixed_costs(self):
+        return [
+            FixedPartCost(part, part.fixed_weighted_cost)
+            for part in self.recipe.parts.select_related('ingredient')
+        ]
+
+    @cached_property
+    def parts(self):
+        cost_total = sum(
+            cost.fixed_weighted_cost for cost in self._fixed_costs)
+
+        return [
+            PartCost(
+                part=part,
+                relative_price=fixedpoint.from_fixed(
+                    fixed_weighted_cost,
+                    WEIGHTED_COST_PLACES + fixedpoint.PERCENT_PLACES),
+                cost_share=fixedpoint.cost_share(
+                    fixed_weighted_cost, cost_total),
+            )
+            for part, fixed_weighted_cost in self._fixed_costs
+        ]
+
+    def __iter__(self):
+        return iter(self.parts)
+
+    def __len__(self):
+        return len(self.parts)
+
+    @property
+    def cheapest(self):
+        if self.parts:
+            return min(self.parts, key=lambda cost: cost.relative_price)
+
+    @property
+    def most_expensive(self):
+        if self.parts:
+            return max(self.parts, key=lambda cost: cost.relative_price)
+
+
+class IngredientUsage:
+    """What an ingredient amounts to in a recipe, and its cost without it.
+
+    The recipe must come from `RecipeQuerySet.with_ingredient_usage`, for
+    the same `ingredient`.
+    """
+    def __init__(self, recipe, ingredient):
+        price_total = fixed_price_total(vars(recipe), 'price_total_')
+        ingredient_price_total = (
+            summed_integer(recipe.ingredient_price_total) *
+            REFERENCE_FACTORS[ingredient.weight_unit])
+        percentage_total = summed_integer(recipe.percentage_total)
+        ingredient_percentage = summed_integer(recipe.ingredient_percentage)
+
+        self.recipe = recipe
+        self.percentage = fixedpoint.from_fixed(
+            ingredient_percentage, PERCENTAGE_FIELD_PLACES)
+        self.cost_share = fixedpoint.cost_share(
+            ingredient_price_total, price_total)
+        self.price = recipe.price
+        self.price_without = sql_weighted_price(
+            price_total - ingredient_price_total,
+            percentage_total - ingredient_percentage)
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_recipe_costs(sender, instance, created, **kwargs):
+    if not created and instance.cost_changed:
+        Recipe.objects.filter(recipepart__ingredient=instance).update_costs()
+    instance._stored_cost = (instance.price, instance.weight_unit)
+
+
+@receiver(pre_save, sender=Recipe)
+def normalize_recipe_image(sender, instance, **kwargs):
+    if not instance.image:
+        instance.image_width = instance.image_height = None
+    elif not instance.image._committed:
+        try:
+            content, size = normalize_image(instance.image)
+        except OSError:
+            logger.exception(
+                'Could not normalize the image %s', instance.image.name)
+            instance.image_width = instance.image_height = None
+        else:
+            instance.image = content
+            instance.image_width, instance.image_height = size
+
+
+@receiver(post_save, sender=Recipe)
+def process_recipe_image(sender, instance, **kwargs):
+    if instance.image_changed:
+        stored_image = getattr(instance, '_stored_image', None)
+        stored_width = getattr(instance, '_stored_image_width', None)
+        # Clones share their original's image, and so its variants.
+        if stored_image and stored_width and not Recipe.objects.filter(
+                image=stored_image).exists():
+            queue_variant_deletion(stored_image, stored_width)
+        if instance.image:
+            if instance.image_width:
+                queue_variants(instance.image.name)
+            queue_thumbnails(instance.image.name)
+    instance._stored_image = instance.image.name or None
+    instance._stored_image_width = instance.image_width
+
+
+@receiver(thumbnails_generated)
+def invalidate_thumbnail_fragments(sender, name, **kwargs):
+    # Pages shown while the thumbnails were queued have placeholders.
+    for user_id in set(Recipe.objects.filter(image=name).values_list(
+            'user', flat=True)):
+        bump_user_cache_version(user_id)
+
+
+@receiver(post_save, sender=RecipePart)
+@receiver(post_delete, sender=RecipePart)
+def update_part_recipe_cost(sender, instance, **kwargs):
+    batch = recipe_update_batch()
+    if batch is not None:
+        batch.add(instance.recipe_id)
+    else:
+        instance.recipe.update_cost()
+
+
+@receiver(post_delete, sender=Recipe)
+def skip_deleted_recipe_update(sender, instance, **kwargs):
+    batch = recipe_update_batch()
+    if batch is not None:
+        batch.discard(instance.pk)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_user_fragments(sender, instance, **kwargs):
+    if isinstance(instance, UserBoundModel):
+        bump_user_cache_version(instance.user_id)
+    elif isinstance(instance, RecipePart):
+        # Batched parts are invalidated along with their recipe's cost.
+        if recipe_update_batch() is None:
+            bump_user_cache_version(instance.recipe.user_id)
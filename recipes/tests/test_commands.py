@@ -0,0 +1,208 @@
+import random
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+
+from .base import RecipeTestCase
+from recipes.images import variant_name
+from recipes.models import (
+    Ingredient,
+    Recipe,
+    RecipePart,
+    RecipeQuerySet,
+    WeightUnit,
+)
+
+
+class RecomputeRecipeCostsTest(RecipeTestCase):
+    def setUp(self):
+        super().setUp()
+        ingredient = self.create_ingredient(
+            price=Decimal('2.34'), weight_unit=WeightUnit.Kg)
+        self.recipe = self.create_recipe()
+        self.recipe.add_part(ingredient, percentage=Decimal('30'))
+        self.drifted = self.create_recipe()
+        self.drifted.add_part(ingredient, percentage=Decimal('30'))
+        Recipe.objects.filter(pk=self.drifted.pk).update(
+            cost_per_kg=Decimal('1'))
+
+    def test_fixes_drifted_costs(self):
+        out = StringIO()
+
+        call_command('recompute_recipe_costs', batch_size=1, stdout=out)
+
+        self.assertIn('1 of 2 recipe costs updated', out.getvalue())
+        self.assertEqual(
+            Recipe.objects.get(pk=self.drifted.pk).cost_per_kg,
+            Decimal('2.34'))
+
+    def test_checks_for_drifted_costs(self):
+        out = StringIO()
+
+        with self.assertRaises(CommandError):
+            call_command('recompute_recipe_costs', check=True, stdout=out)
+
+        self.assertIn('Recipe {}: 1.000000 -> 2.340000'.format(
+            self.drifted.pk), out.getvalue())
+        self.assertEqual(
+            Recipe.objects.get(pk=self.drifted.pk).cost_per_kg, Decimal('1'))
+
+    def test_passes_check_without_drift(self):
+        out = StringIO()
+        Recipe.objects.update_costs()
+
+        call_command('recompute_recipe_costs', check=True, stdout=out)
+
+        self.assertIn('2 recipe costs checked, none drifted', out.getvalue())
+
+    def test_passes_check_with_extreme_prices(self):
+        rng = random.Random(2)
+        ingredients = [
+            self.create_ingredient(
+                price=Decimal(rng.randint(1, 10 ** 10 - 1)).scaleb(-2),
+                weight_unit=rng.choice(list(WeightUnit)))
+            for i in range(20)
+        ]
+        for i in range(40):
+            recipe = self.create_recipe()
+            for ingredient in rng.sample(ingredients, rng.randint(1, 8)):
+                percentage = Decimal(rng.randint(1, 10 ** 10 - 1)).scaleb(-4)
+                recipe.add_part(ingredient, percentage=percentage)
+        recipe = self.create_recipe()
+        Recipe.objects.update_costs()
+        out = StringIO()
+
+        call_command('recompute_recipe_costs', check=True, stdout=out)
+
+        self.assertIn('43 recipe costs checked, none drifted', out.getvalue())
+
+    def test_checks_costs_independently_of_computed_costs(self):
+        computed = {self.recipe.pk: Decimal('2.5')}
+
+        with patch.object(
+                RecipeQuerySet, 'compute_costs', return_value=computed):
+            Recipe.objects.filter(pk=self.recipe.pk).update_costs()
+            with self.assertRaisesMessage(
+                    CommandError, '2 of 2 recipe costs have drifted'):
+                call_command(
+                    'recompute_recipe_costs', check=True, stdout=StringIO())
+
+
+class GenerateDatasetTest(RecipeTestCase):
+    OPTIONS = {
+        'users': 3,
+        'ingredients_per_user': 40,
+        'recipes_per_user': 5,
+        'parts_per_recipe': 4,
+        'seed': 1,
+        'username_prefix': 'load',
+        'chunk_size': 7,
+    }
+
+    def generate(self, **options):
+        out = StringIO()
+        call_command(
+            'generate_dataset', stdout=out, **dict(self.OPTIONS, **options))
+        return out.getvalue()
+
+    def library(self, username):
+        return [
+            (recipe.name, recipe.cost_per_kg, sorted(
+                (part.ingredient.name, part.ingredient.price,
+                 part.percentage)
+                for part in recipe.recipepart_set.all()
+            ))
+            for recipe in Recipe.objects.filter(
+                user__username=username).order_by('pk').prefetch_related(
+                    'recipepart_set__ingredient')
+        ]
+
+    def test_generates_users_with_libraries(self):
+        out = self.generate()
+
+        self.assertIn('3 of 3 users generated', out)
+        self.assertIn(
+            '3 users, 120 ingredients, 15 recipes and 60 parts generated',
+            out)
+        user = User.objects.get(username='load2')
+        self.assertTrue(user.check_password('glaze'))
+        self.assertEqual(user.profile.currency, 'USD')
+        self.assertEqual(Ingredient.objects.for_user(user).count(), 40)
+        self.assertEqual(Recipe.objects.for_user(user).count(), 5)
+        self.assertEqual(
+            RecipePart.objects.filter(recipe__user=user).count(), 20)
+        self.assertFalse(RecipePart.objects.filter(
+            recipe__user=user).exclude(ingredient__user=user).exists())
+
+    def test_stores_the_cost_of_every_recipe(self):
+        self.generate()
+
+        recipes = Recipe.objects.filter(user__username__startswith='load')
+        self.assertEqual(recipes.compute_costs(), dict(
+            recipes.values_list('pk', 'cost_per_kg')))
+
+    def test_repeats_datasets_with_a_seed(self):
+        self.generate(username_prefix='first')
+        self.generate(username_prefix='second')
+
+        self.assertEqual(self.library('first1'), self.library('second1'))
+        self.assertNotEqual(self.library('first1'), self.library('first2'))
+
+    def test_refuses_existing_users(self):
+        self.generate()
+
+        with self.assertRaisesMessage(CommandError, 'load1 already exists'):
+            self.generate()
+
+    def test_refuses_any_existing_user_before_writing(self):
+        User.objects.create_user('load3')
+
+        with self.assertRaisesMessage(CommandError, 'load3 already exists'):
+            self.generate()
+
+        self.assertFalse(User.objects.filter(username='load1').exists())
+
+    def test_refuses_more_parts_than_ingredients(self):
+        with self.assertRaises(CommandError):
+            self.generate(ingredients_per_user=2)
+
+    def test_gives_recipes_images(self):
+        self.generate(users=1, images=True)
+
+        recipe = Recipe.objects.filter(user__username='load1').first()
+        self.assertTrue(recipe.image.name.startswith('dataset/'))
+        self.assertTrue(default_storage.exists(recipe.image.name))
+        self.assertTrue(default_storage.exists(variant_name(
+            recipe.image.name, recipe.image_width, 'jpg')))
+
+
+@patch('recipes.models.queue_thumbnails')
+class WarmThumbnailsTest(RecipeTestCase):
+    def test_warms_every_image(self, queue):
+        with self.fixture('django.gif'):
+            self.create_recipe(image='fixtures/django.gif')
+            self.create_recipe(image='fixtures/django.gif')
+        self.create_recipe(image=None)
+        out = StringIO()
+
+        with patch('recipes.thumbnails.get_thumbnail') as get_thumbnail:
+            call_command('warm_thumbnails', workers=0, stdout=out)
+
+        self.assertEqual(get_thumbnail.call_count, 2)
+        self.assertIn('1 of 1 images processed', out.getvalue())
+        self.assertIn('1 images warmed', out.getvalue())
+
+    def test_reports_failed_images(self, queue):
+        self.create_recipe(image='fixtures/missing.gif')
+        out = StringIO()
+        err = StringIO()
+
+        with self.assertRaisesMessage(CommandError, '1 of 1 images failed'):
+            call_command(
+                'warm_thumbnails', workers=0, stdout=out, stderr=err)
+
+        self.assertIn('Failed fixtures/missing.gif', err.getvalue())
@@ -0,0 +1,144 @@
+from decimal import Decimal
+from random import Random
+
+from .base import RecipeTestCase
+from recipes.costing import CostMatrix, recipe_prices, simulate_repricing
+from recipes.models import Ingredient, Recipe, WeightUnit, quantize_cost
+
+
+class RecipePricesTest(RecipeTestCase):
+    def test_prices_recipes_like_recipe_price(self):
+        random = Random(42)
+        ingredients = [
+            self.create_ingredient(
+                price=Decimal(random.randint(0, 10 ** 6)) / 100,
+                weight_unit=random.choice(list(WeightUnit)))
+            for i in range(10)
+        ]
+        for i in range(20):
+            recipe = self.create_recipe()
+            for ingredient in random.sample(
+                    ingredients, random.randint(1, 6)):
+                recipe.add_part(
+                    ingredient,
+                    Decimal(random.randint(0, 10 ** 6)) / 10 ** 4)
+
+        prices = recipe_prices(Recipe.objects.all())
+
+        self.assertEqual(len(prices), 20)
+        for recipe in Recipe.objects.all():
+            self.assertEqual(prices[recipe.pk], recipe.price)
+
+    def test_prices_recipe_without_parts_as_zero(self):
+        recipe = self.create_recipe()
+
+        self.assertEqual(
+            recipe_prices(Recipe.objects.all()), {recipe.pk: Decimal('0')})
+
+    def test_loads_recipes_in_one_query(self):
+        for i in range(3):
+            self.create_recipe().add_part(
+                self.create_ingredient(), Decimal('10'))
+
+        with self.assertNumQueries(1):
+            prices = recipe_prices(Recipe.objects.for_user(self.user))
+
+        self.assertEqual(len(prices), 3)
+
+    def test_prices_only_given_recipes(self):
+        ingredient = self.create_ingredient(
+            price=Decimal('2.34'), weight_unit=WeightUnit.Kg)
+        recipe = self.create_recipe()
+        recipe.add_part(ingredient, Decimal('30'))
+        self.create_recipe(user=self.another_user).add_part(
+            ingredient, Decimal('30'))
+
+        prices = recipe_prices(Recipe.objects.for_user(self.user))
+
+        self.assertEqual(prices, {recipe.pk: Decimal('2.34')})
+
+    def test_keeps_huge_totals_exact(self):
+        price = Decimal('99999999.99')
+        percentage = Decimal('999999.9999')
+        matrix = CostMatrix.from_parts([1], [
+            (1, ingredient, percentage, price, WeightUnit.g)
+            for ingredient in range(3)
+        ])
+
+        self.assertEqual(
+            matrix.prices(),
+            {1: (price * percentage * 1000 * 3) / (percentage * 3)})
+
+
+class SimulateRepricingTest(RecipeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.sand = self.create_ingredient(
+            price=Decimal('1.23'), weight_unit=WeightUnit.g)
+        self.water = self.create_ingredient(
+            price=Decimal('2.34'), weight_unit=WeightUnit.Kg)
+        self.salt = self.create_ingredient(
+            price=Decimal('3.45'), weight_unit=WeightUnit.Kg)
+        self.celadon = self.create_recipe(name='Celadon')
+        self.celadon.add_part(self.sand, Decimal('20'))
+        self.celadon.add_part(self.water, Decimal('30'))
+        self.tenmoku = self.create_recipe(name='Tenmoku')
+        self.tenmoku.add_part(self.water, Decimal('50'))
+        self.shino = self.create_recipe(name='Shino')
+        self.shino.add_part(self.salt, Decimal('50'))
+
+    def test_reprices_only_affected_recipes(self):
+        repricings = simulate_repricing(
+            Recipe.objects.for_user(self.user),
+            {self.water.pk: Decimal('4.68')})
+
+        self.assertEqual(
+            [repricing.name for repricing in repricings],
+            ['Tenmoku', 'Celadon'])
+        tenmoku = repricings[0]
+        self.assertEqual(tenmoku.old_cost, Decimal('2.34'))
+        self.assertEqual(tenmoku.new_cost, Decimal('4.68'))
+        self.assertEqual(tenmoku.delta, Decimal('2.34'))
+
+    def test_matches_costs_after_repricing(self):
+        prices = {self.sand.pk: Decimal('0.99'), self.salt.pk: Decimal('0')}
+
+        repricings = simulate_repricing(
+            Recipe.objects.for_user(self.user), prices)
+        Ingredient.objects.filter(pk=self.sand.pk).update(price=prices[
+            self.sand.pk])
+        Ingredient.objects.filter(pk=self.salt.pk).update(price=prices[
+            self.salt.pk])
+
+        self.assertEqual(len(repricings), 2)
+        for repricing in repricings:
+            recipe = Recipe.objects.get(pk=repricing.recipe_id)
+            self.assertEqual(repricing.new_cost, quantize_cost(recipe.price))
+
+    def test_starts_from_the_stored_costs(self):
+        Recipe.objects.filter(pk=self.tenmoku.pk).update(
+            cost_per_kg=Decimal('3'))
+
+        repricings = simulate_repricing(
+            Recipe.objects.for_user(self.user),
+            {self.water.pk: Decimal('4.68')})
+
+        tenmoku = repricings[0]
+        self.assertEqual(tenmoku.old_cost, Decimal('3'))
+        self.assertEqual(tenmoku.new_cost, Decimal('5.34'))
+
+    def test_doesnt_reprice_other_users_recipes(self):
+        self.create_recipe(user=self.another_user).add_part(
+            self.water, Decimal('10'))
+
+        repricings = simulate_repricing(
+            Recipe.objects.for_user(self.user),
+            {self.water.pk: Decimal('1')})
+
+        self.assertEqual(len(repricings), 2)
+
+    def test_loads_affected_recipes_in_three_queries(self):
+        with self.assertNumQueries(3):
+            simulate_repricing(
+                Recipe.objects.for_user(self.user),
+                {self.water.pk: Decimal('1'), self.sand.pk: Decimal('1')})
@@ -0,0 +1,141 @@
+from decimal import Decimal, localcontext
+
+from django.test import SimpleTestCase
+from hypothesis import given, strategies as st
+
+from recipes import fixedpoint
+from recipes.costing import CostMatrix
+from recipes.models import (
+    REFERENCE_WEIGHT_UNIT,
+    WEIGHTED_COST_PLACES,
+    Ingredient,
+    RecipePart,
+    WeightUnit,
+)
+
+# The Decimal arithmetic the fixed-point core replaces.
+PERCENT = Decimal('100')
+
+
+def exactly(operation, *args):
+    # Products and sums with many digits go past the default context
+    # precision, where the integers are still exact.
+    with localcontext() as context:
+        context.prec = 80
+        return operation(*args)
+
+
+def decimal_weighted_cost(price, percentage, weight_unit):
+    return exactly(
+        lambda: price * percentage *
+        REFERENCE_WEIGHT_UNIT.weighted_in(weight_unit))
+
+
+def decimal_sum(values):
+    return exactly(sum, values, Decimal('0'))
+
+
+def decimal_weighted_price(price_total, percentage_total):
+    if not percentage_total:
+        return Decimal('0')
+    return price_total / percentage_total
+
+
+def decimal_cost_share(weighted_cost, cost_total):
+    if not cost_total:
+        return Decimal('0')
+    return weighted_cost / cost_total * PERCENT
+
+
+prices = st.decimals(
+    min_value=0, max_value=Decimal('99999999.99'), places=2)
+percentages = st.decimals(
+    min_value=0, max_value=Decimal('999999.9999'), places=4)
+parts = st.lists(
+    st.tuples(prices, percentages, st.sampled_from(WeightUnit)),
+    max_size=20)
+
+
+def make_part(price, percentage, weight_unit):
+    return RecipePart(
+        ingredient=Ingredient(price=price, weight_unit=weight_unit),
+        percentage=percentage)
+
+
+class FixedPointTest(SimpleTestCase):
+    def test_converts_to_and_from_fixed_point(self):
+        self.assertEqual(fixedpoint.to_micros(Decimal('1.23')), 1230000)
+        self.assertEqual(
+            fixedpoint.to_percentage_units(Decimal('12.5')), 12500000)
+        self.assertEqual(fixedpoint.from_fixed(1230000, 6), Decimal('1.23'))
+
+    def test_refuses_values_with_more_places_than_the_scale(self):
+        with self.assertRaises(ValueError):
+            fixedpoint.to_micros(Decimal('0.0000001'))
+
+    def test_scales_factor_tables_by_their_finest_factor(self):
+        table, places = fixedpoint.factor_table({
+            'a': Decimal('1000'), 'b': Decimal('0.001')})
+
+        self.assertEqual(places, 3)
+        self.assertEqual(table, {'a': 1000000, 'b': 1})
+
+    @given(prices, percentages, st.sampled_from(WeightUnit))
+    def test_weights_part_costs_like_decimals(
+            self, price, percentage, weight_unit):
+        part = make_part(price, percentage, weight_unit)
+        expected = decimal_weighted_cost(price, percentage, weight_unit)
+
+        self.assertEqual(part.weighted_cost, expected)
+        self.assertEqual(
+            part.relative_price, exactly(lambda: expected / PERCENT))
+
+    @given(parts)
+    def test_prices_recipes_like_decimals(self, parts):
+        recipe_parts = [make_part(*part) for part in parts]
+        weighted_costs = [decimal_weighted_cost(*part) for part in parts]
+        expected = decimal_weighted_price(
+            decimal_sum(weighted_costs),
+            decimal_sum(percentage for _, percentage, _ in parts))
+
+        price = fixedpoint.weighted_price(
+            sum(part.fixed_weighted_cost for part in recipe_parts),
+            sum(
+                fixedpoint.to_percentage_units(part.percentage)
+                for part in recipe_parts
+            ),
+            WEIGHTED_COST_PLACES,
+        )
+
+        self.assertEqual(price, expected)
+
+    @given(parts)
+    def test_shares_recipe_costs_like_decimals(self, parts):
+        recipe_parts = [make_part(*part) for part in parts]
+        weighted_costs = [decimal_weighted_cost(*part) for part in parts]
+        cost_total = decimal_sum(weighted_costs)
+        fixed_cost_total = sum(
+            part.fixed_weighted_cost for part in recipe_parts)
+
+        for part, weighted_cost in zip(recipe_parts, weighted_costs):
+            self.assertEqual(
+                fixedpoint.cost_share(
+                    part.fixed_weighted_cost, fixed_cost_total),
+                decimal_cost_share(weighted_cost, cost_total))
+
+    @given(st.lists(parts, max_size=10))
+    def test_prices_cost_matrices_like_decimals(self, recipes):
+        rows = [
+            (recipe_id, (recipe_id, index), percentage, price, weight_unit)
+            for recipe_id, parts in enumerate(recipes)
+            for index, (price, percentage, weight_unit) in enumerate(parts)
+        ]
+        matrix = CostMatrix.from_parts(list(range(len(recipes))), rows)
+
+        self.assertEqual(matrix.prices(), {
+            recipe_id: decimal_weighted_price(
+                decimal_sum(decimal_weighted_cost(*part) for part in parts),
+                decimal_sum(percentage for _, percentage, _ in parts),
+            )
+            for recipe_id, parts in enumerate(recipes)
+        })
@@ -0,0 +1,177 @@
+import struct
+from io import BytesIO
+from unittest.mock import patch
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import override_settings
+from PIL import Image
+
+from .base import RecipeTestCase
+from recipes.images import (
+    ImageVariants,
+    create_variants,
+    delete_variants,
+    normalize_image,
+    supported_variant_formats,
+    variant_name,
+)
+from recipes.models import Recipe
+from recipes.thumbnails import queue_variants
+
+
+def exif_orientation(orientation):
+    ifd = struct.pack('>HHHIHH', 1, 0x0112, 3, 1, orientation, 0)
+    return b'Exif\x00\x00MM\x00*\x00\x00\x00\x08' + ifd + b'\x00\x00\x00\x00'
+
+
+def make_image(size, mode='RGB', image_format='JPEG', **params):
+    output = BytesIO()
+    Image.new(mode, size, 'red').save(output, image_format, **params)
+    return ContentFile(output.getvalue(), name='photo.{}'.format(
+        image_format.lower()))
+
+
+class NormalizeImageTest(RecipeTestCase):
+    def open(self, content):
+        return Image.open(BytesIO(content.read()))
+
+    def test_rotates_image_upright(self):
+        content, size = normalize_image(make_image(
+            (40, 20), exif=exif_orientation(6)))
+
+        image = self.open(content)
+        self.assertEqual(size, (20, 40))
+        self.assertEqual(image.size, (20, 40))
+        self.assertNotIn('exif', image.info)
+
+    @override_settings(RECIPE_IMAGE_MAX_SIZE=100)
+    def test_limits_longest_side(self):
+        content, size = normalize_image(make_image((300, 150)))
+
+        self.assertEqual(size, (100, 50))
+        self.assertEqual(self.open(content).size, (100, 50))
+
+    def test_recompresses_as_jpeg(self):
+        content, size = normalize_image(
+            make_image((30, 30), mode='RGBA', image_format='PNG'))
+
+        image = self.open(content)
+        self.assertEqual(content.name, 'photo.jpg')
+        self.assertEqual(image.format, 'JPEG')
+        self.assertEqual(image.mode, 'RGB')
+
+
+@override_settings(RECIPE_IMAGE_WIDTHS=[10, 20, 100])
+@patch('recipes.models.queue_thumbnails')
+class RecipeImageVariantsTest(RecipeTestCase):
+    LOGIN = True
+
+    def setUp(self):
+        super().setUp()
+        # Variants are handled once the transaction commits, which never
+        # happens in these tests.
+        for name, function in [('queue_variants', create_variants),
+                               ('queue_variant_deletion', delete_variants)]:
+            patcher = patch('recipes.models.{}'.format(name),
+                            side_effect=function)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def create_recipe_with_image(self, size=(60, 30)):
+        return Recipe.objects.create(
+            user=self.user, name='Celadon', image=make_image(size))
+
+    def variants_exist(self, name, width):
+        return [
+            default_storage.exists(variant_name(name, width, extension))
+            for extension, image_format, mime_type in (
+                supported_variant_formats())
+        ]
+
+    @patch('recipes.thumbnails.executor')
+    @patch('recipes.thumbnails.transaction.on_commit',
+           side_effect=lambda func: func())
+    def test_queues_variants_after_commit(self, on_commit, executor, queue):
+        queue_variants('photo.jpg')
+
+        self.assertEqual(on_commit.call_count, 1)
+        self.assertEqual(
+            executor.submit.call_args[0][1:], (create_variants, 'photo.jpg'))
+
+    def test_deletes_variants_of_replaced_image(self, queue):
+        recipe = self.create_recipe_with_image()
+        old_name = recipe.image.name
+
+        recipe.image = make_image((40, 20))
+        recipe.save()
+
+        self.queue_variant_deletion.assert_called_once_with(old_name, 60)
+        for width in (10, 20, 60):
+            self.assertFalse(any(self.variants_exist(old_name, width)))
+        self.assertTrue(all(self.variants_exist(recipe.image.name, 40)))
+
+    def test_keeps_variants_shared_with_clones(self, queue):
+        recipe = self.create_recipe_with_image()
+        old_name = recipe.image.name
+        Recipe.objects.filter(pk=recipe.pk).clone()
+
+        recipe.image = None
+        recipe.save()
+
+        self.assertFalse(self.queue_variant_deletion.called)
+        self.assertTrue(all(self.variants_exist(old_name, 60)))
+
+    def test_normalizes_uploaded_image(self, queue):
+        recipe = self.create_recipe_with_image()
+
+        recipe = Recipe.objects.get(pk=recipe.pk)
+        self.assertTrue(recipe.image.name.endswith('.jpg'))
+        self.assertEqual((recipe.image_width, recipe.image_height), (60, 30))
+        queue.assert_called_once_with(recipe.image.name)
+
+    def test_creates_variants_narrower_than_image(self, queue):
+        recipe = self.create_recipe_with_image()
+
+        for extension, image_format, mime_type in (
+                supported_variant_formats()):
+            for width in (10, 20, 60):
+                name = variant_name(recipe.image.name, width, extension)
+                with default_storage.open(name) as f:
+                    self.assertEqual(Image.open(f).size[0], width)
+            self.assertFalse(default_storage.exists(
+                variant_name(recipe.image.name, 100, extension)))
+
+    def test_lists_variants_in_srcset(self, queue):
+        variants = ImageVariants('photo.jpg', 60)
+
+        self.assertEqual(
+            variants.fallback_srcset,
+            '/uploads/variants/photo-10w.jpg 10w, '
+            '/uploads/variants/photo-20w.jpg 20w, '
+            '/uploads/variants/photo-60w.jpg 60w')
+        self.assertEqual(
+            variants.fallback_url, '/uploads/variants/photo-10w.jpg')
+
+    def test_shows_variants_in_recipe_detail(self, queue):
+        recipe = self.create_recipe_with_image()
+
+        response = self.client.get(recipe.get_absolute_url())
+
+        self.assertContains(response, 'srcset="{}"'.format(
+            recipe.image_variants.fallback_srcset))
+        self.assertContains(response, 'sizes="')
+
+    def test_doesnt_list_variants_for_old_images(self, queue):
+        recipe = self.create_recipe(image='fixtures/django.gif')
+
+        self.assertIsNone(recipe.image_variants)
+
+    def test_clears_size_with_image(self, queue):
+        recipe = self.create_recipe_with_image()
+
+        recipe.image = None
+        recipe.save()
+
+        self.assertIsNone(recipe.image_width)
+        self.assertIsNone(recipe.image_variants)
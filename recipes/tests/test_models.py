@@ -1,13 +1,25 @@
+import random
 from datetime import datetime
 from decimal import Decimal
+from unittest.mock import Mock, patch
 
 from django.contrib.auth.models import User
 from django.core.files.images import ImageFile
-from django.db import IntegrityError
+from django.db import DatabaseError, IntegrityError
+from django.db.models.signals import post_delete
 from model_mommy import mommy
 
 from .base import RecipeTestCase
-from recipes.models import Kind, Ingredient, Recipe, WeightUnit
+from recipes.models import (
+    Kind,
+    Ingredient,
+    IngredientUsage,
+    Recipe,
+    RecipeCostBreakdown,
+    RecipePart,
+    WeightUnit,
+    quantize_cost,
+)
 
 
 class IngredientTest(RecipeTestCase):
@@ -100,7 +112,7 @@ class RecipeTest(RecipeTestCase):
         recipe = Recipe.objects.get(pk=1)
 
         self.assertIn('django', recipe.image.name)
-        self.assertIn('gif', recipe.image.name)
+        self.assertIn('jpg', recipe.image.name)
 
     def test_can_load_image(self):
         with self.fixture('django.gif') as f:
@@ -183,6 +195,60 @@ class RecipeTest(RecipeTestCase):
 
         self.assertEqual(recipe.price, Decimal('0'))
 
+    def test_calculates_price_in_the_database(self):
+        ingredient1 = self.create_ingredient(
+            price=Decimal('1.23'), weight_unit=WeightUnit.g)
+        ingredient2 = self.create_ingredient(
+            price=Decimal('2.34'), weight_unit=WeightUnit.Kg)
+        ingredient3 = self.create_ingredient(
+            price=Decimal('0.07'), weight_unit=WeightUnit.g)
+        recipe1 = self.create_recipe(name='Interesting Yellow')
+        recipe1.add_part(ingredient1, percentage=Decimal('20'))
+        recipe1.add_part(ingredient2, percentage=Decimal('30'))
+        recipe2 = self.create_recipe(name='Odd Blue')
+        recipe2.add_part(ingredient2, percentage=Decimal('33.3333'))
+        recipe2.add_part(ingredient3, percentage=Decimal('0.0001'))
+        recipe2.add_part(ingredient1, percentage=Decimal('7'))
+
+        recipes = Recipe.objects.with_price().in_bulk()
+
+        self.assertEqual(recipes[recipe1.pk].price, recipe1.price)
+        self.assertEqual(recipes[recipe2.pk].price, recipe2.price)
+
+    def test_calculates_price_in_the_database_without_percentages(self):
+        ingredient = self.create_ingredient(
+            price=Decimal('1.23'), weight_unit=WeightUnit.g)
+        recipe1 = self.create_recipe(name='Null Recipe')
+        recipe2 = self.create_recipe(name='Zeroed Recipe')
+        recipe2.add_part(ingredient, percentage=Decimal('0'))
+
+        recipes = Recipe.objects.with_price().in_bulk()
+
+        self.assertEqual(recipes[recipe1.pk].price, Decimal('0'))
+        self.assertEqual(recipes[recipe2.pk].price, Decimal('0'))
+
+    def test_calculates_prices_in_a_single_query(self):
+        ingredient = self.create_ingredient(
+            price=Decimal('1.23'), weight_unit=WeightUnit.g)
+        for i in range(3):
+            recipe = self.create_recipe(name='Recipe {}'.format(i))
+            recipe.add_part(ingredient, percentage=Decimal('20'))
+
+        with self.assertNumQueries(1):
+            prices = [
+                recipe.price
+                for recipe in Recipe.objects.for_user(self.user).with_price()
+            ]
+
+        self.assertEqual(prices, [Decimal('1230')] * 3)
+
+    def test_sums_prices_once_per_weight_unit(self):
+        # The unit factors can't be applied inside a single sum without
+        # overflowing 64-bit integers, so each unit is summed on its own.
+        sql = str(Recipe.objects.with_price().query)
+
+        self.assertEqual(sql.count('SUM('), len(WeightUnit) + 1)
+
     def test_copies_a_recipe(self):
         ingredient1 = self.create_ingredient(
             price=Decimal('1.23'), weight_unit=WeightUnit.g)
@@ -206,6 +272,352 @@ class RecipeTest(RecipeTestCase):
         self.assertEqual(recipe2.price, recipe1.price)
         self.assertEqual(recipe2.name, '{} (Copy of {})'.format(name1, id1))
 
+    def test_copies_recipe_parts_in_bulk(self):
+        recipe = self.create_recipe()
+        for i in range(5):
+            recipe.add_part(self.create_ingredient(), percentage=Decimal('20'))
+
+        with self.assertNumQueries(5):
+            recipe.clone()
+
+        self.assertEqual(recipe.parts.count(), 5)
+
+    def test_doesnt_leave_partial_copy_if_cloning_fails(self):
+        recipe = self.create_recipe(name='Yellow')
+        recipe.add_part(self.create_ingredient(), percentage=Decimal('20'))
+
+        with patch.object(RecipePart, 'copy_to', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                recipe.clone()
+
+        self.assertEqual(Recipe.objects.count(), 1)
+        self.assertEqual(RecipePart.objects.count(), 1)
+
+    def test_copies_many_recipes(self):
+        ingredient1 = self.create_ingredient(
+            price=Decimal('1.23'), weight_unit=WeightUnit.g)
+        ingredient2 = self.create_ingredient(
+            price=Decimal('2.34'), weight_unit=WeightUnit.Kg)
+        recipe1 = self.create_recipe(name='Yellow')
+        recipe1.add_part(ingredient1, percentage=Decimal('20'))
+        recipe1.add_part(ingredient2, percentage=Decimal('30'))
+        recipe2 = self.create_recipe(name='Blue')
+        recipe2.add_part(ingredient2, percentage=Decimal('10'))
+        recipe3 = self.create_recipe(name='Red')
+
+        copies = Recipe.objects.order_by('pk').clone()
+
+        self.assertEqual([copy.name for copy in copies], [
+            'Yellow (Copy of {})'.format(recipe1.pk),
+            'Blue (Copy of {})'.format(recipe2.pk),
+            'Red (Copy of {})'.format(recipe3.pk),
+        ])
+        self.assertEqual(Recipe.objects.count(), 6)
+        for original, copy in zip([recipe1, recipe2, recipe3], copies):
+            copy = Recipe.objects.get(pk=copy.pk)
+            self.assertEqual(copy.price, original.price)
+            self.assertEqual(copy.cost_per_kg, original.cost_per_kg)
+            self.assertEqual(
+                list(copy.parts.values_list('ingredient', 'percentage')),
+                list(original.parts.values_list('ingredient', 'percentage')))
+
+    def test_doesnt_leave_partial_copies_if_cloning_many_fails(self):
+        recipe = self.create_recipe(name='Yellow')
+        recipe.add_part(self.create_ingredient(), percentage=Decimal('20'))
+        self.create_recipe(name='Blue')
+
+        with patch.object(RecipePart, 'copy_to', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                Recipe.objects.clone()
+
+        self.assertEqual(Recipe.objects.count(), 2)
+        self.assertEqual(RecipePart.objects.count(), 1)
+
+
+class RecipeCostTest(RecipeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.sand = self.create_ingredient(
+            price=Decimal('1.23'), weight_unit=WeightUnit.g)
+        self.water = self.create_ingredient(
+            price=Decimal('2.34'), weight_unit=WeightUnit.Kg)
+        self.recipe = self.create_recipe()
+
+    def stored_cost(self, recipe):
+        return Recipe.objects.get(pk=recipe.pk).cost_per_kg
+
+    def test_starts_without_cost(self):
+        self.assertEqual(self.stored_cost(self.recipe), Decimal('0'))
+
+    def test_updates_cost_when_parts_are_added(self):
+        self.recipe.add_part(self.sand, percentage=Decimal('20'))
+        self.recipe.add_part(self.water, percentage=Decimal('30'))
+
+        self.assertEqual(
+            self.stored_cost(self.recipe), quantize_cost(self.recipe.price))
+        self.assertEqual(self.recipe.cost_per_kg, Decimal('493.404'))
+
+    def test_updates_cost_when_parts_are_changed(self):
+        self.recipe.add_part(self.sand, percentage=Decimal('20'))
+        self.recipe.add_part(self.water, percentage=Decimal('30'))
+
+        part = self.recipe.parts.get(ingredient=self.water)
+        part.percentage = Decimal('80')
+        part.save()
+
+        self.assertEqual(
+            self.stored_cost(self.recipe), quantize_cost(self.recipe.price))
+
+    def test_updates_cost_when_parts_are_deleted(self):
+        self.recipe.add_part(self.sand, percentage=Decimal('20'))
+        self.recipe.add_part(self.water, percentage=Decimal('30'))
+
+        self.recipe.parts.get(ingredient=self.sand).delete()
+
+        self.assertEqual(self.stored_cost(self.recipe), Decimal('2.34'))
+
+    def test_updates_cost_when_ingredient_price_changes(self):
+        self.recipe.add_part(self.sand, percentage=Decimal('20'))
+        self.recipe.add_part(self.water, percentage=Decimal('30'))
+
+        water = Ingredient.objects.get(pk=self.water.pk)
+        water.price = Decimal('4.56')
+        water.save()
+
+        self.assertEqual(
+            self.stored_cost(self.recipe), quantize_cost(self.recipe.price))
+
+    def test_updates_cost_when_ingredient_weight_unit_changes(self):
+        self.recipe.add_part(self.water, percentage=Decimal('30'))
+
+        water = Ingredient.objects.get(pk=self.water.pk)
+        water.weight_unit = WeightUnit.g
+        water.save()
+
+        self.assertEqual(self.stored_cost(self.recipe), Decimal('2340'))
+
+    def test_only_updates_recipes_using_the_ingredient(self):
+        self.recipe.add_part(self.water, percentage=Decimal('30'))
+        other_recipe = self.create_recipe()
+        other_recipe.add_part(self.sand, percentage=Decimal('30'))
+        Recipe.objects.filter(pk=other_recipe.pk).update(
+            cost_per_kg=Decimal('1'))
+
+        water = Ingredient.objects.get(pk=self.water.pk)
+        water.price = Decimal('4.56')
+        water.save()
+
+        self.assertEqual(self.stored_cost(self.recipe), Decimal('4.56'))
+        self.assertEqual(self.stored_cost(other_recipe), Decimal('1'))
+
+    def test_updates_costs_once_when_ingredient_is_deleted(self):
+        recipes = [self.create_recipe() for i in range(40)]
+        RecipePart.objects.bulk_create(
+            RecipePart(recipe=recipe, ingredient=ingredient,
+                       percentage=Decimal('30'))
+            for recipe in recipes
+            for ingredient in [self.sand, self.water]
+        )
+
+        with self.assertNumQueries(10):
+            self.sand.delete()
+
+        for recipe in recipes:
+            self.assertEqual(self.stored_cost(recipe), Decimal('2.34'))
+
+    def test_updates_costs_once_when_ingredients_are_deleted(self):
+        recipes = [self.create_recipe() for i in range(40)]
+        RecipePart.objects.bulk_create(
+            RecipePart(recipe=recipe, ingredient=self.sand,
+                       percentage=Decimal('30'))
+            for recipe in recipes
+        )
+
+        with self.assertNumQueries(11):
+            Ingredient.objects.filter(pk=self.sand.pk).delete()
+
+        for recipe in recipes:
+            self.assertEqual(self.stored_cost(recipe), Decimal('0'))
+
+    def test_doesnt_update_cost_of_deleted_recipe(self):
+        ingredients = [self.create_ingredient() for i in range(40)]
+        RecipePart.objects.bulk_create(
+            RecipePart(recipe=self.recipe, ingredient=ingredient,
+                       percentage=Decimal('2'))
+            for ingredient in ingredients
+        )
+
+        with self.assertNumQueries(5):
+            self.recipe.delete()
+
+        self.assertFalse(RecipePart.objects.exists())
+
+    def test_deletes_parts_in_bulk_with_signals(self):
+        self.recipe.add_part(self.sand, percentage=Decimal('20'))
+        self.recipe.add_part(self.water, percentage=Decimal('30'))
+        part = self.recipe.parts.get(ingredient=self.sand)
+        deleted = Mock()
+        post_delete.connect(deleted, sender=RecipePart)
+        self.addCleanup(post_delete.disconnect, deleted, sender=RecipePart)
+
+        self.recipe.save_parts(deleted=[part])
+
+        self.assertEqual(deleted.call_count, 1)
+        self.assertEqual(self.recipe.cost_per_kg, Decimal('2.34'))
+        self.assertEqual(self.stored_cost(self.recipe), Decimal('2.34'))
+
+    def test_doesnt_update_costs_if_ingredient_cost_is_unchanged(self):
+        self.recipe.add_part(self.water, percentage=Decimal('30'))
+
+        water = Ingredient.objects.get(pk=self.water.pk)
+        water.name = 'Fresh water'
+        with self.assertNumQueries(1):
+            water.save()
+
+    def test_keeps_cost_when_cloning(self):
+        self.recipe.add_part(self.sand, percentage=Decimal('20'))
+        self.recipe.add_part(self.water, percentage=Decimal('30'))
+
+        clone = Recipe.objects.get(pk=self.recipe.pk).clone()
+
+        self.assertEqual(
+            self.stored_cost(clone), quantize_cost(self.recipe.price))
+
+    def test_updates_costs_in_bulk(self):
+        self.recipe.add_part(self.sand, percentage=Decimal('20'))
+        other_recipe = self.create_recipe()
+        other_recipe.add_part(self.water, percentage=Decimal('30'))
+        Recipe.objects.update(cost_per_kg=Decimal('1'))
+
+        costs = Recipe.objects.update_costs()
+
+        self.assertEqual(costs, {
+            self.recipe.pk: Decimal('1230'),
+            other_recipe.pk: Decimal('2.34'),
+        })
+        self.assertEqual(self.stored_cost(self.recipe), Decimal('1230'))
+        self.assertEqual(self.stored_cost(other_recipe), Decimal('2.34'))
+
+
+class RecipeCostBreakdownTest(RecipeTestCase):
+    def test_breaks_down_recipe_cost(self):
+        sand = self.create_ingredient(
+            price=Decimal('1.23'), weight_unit=WeightUnit.g)
+        water = self.create_ingredient(
+            price=Decimal('2.34'), weight_unit=WeightUnit.Kg)
+        recipe = self.create_recipe()
+        recipe.add_part(sand, percentage=Decimal('20'))
+        recipe.add_part(water, percentage=Decimal('30'))
+
+        with self.assertNumQueries(0):
+            breakdown = RecipeCostBreakdown(recipe)
+        with self.assertNumQueries(1):
+            price = breakdown.price
+            len(breakdown)
+
+        self.assertEqual(price, recipe.price)
+        self.assertEqual(len(breakdown), 2)
+        sand_cost, water_cost = breakdown
+        self.assertEqual(sand_cost.part.ingredient, sand)
+        self.assertEqual(sand_cost.relative_price, Decimal('246'))
+        self.assertEqual(water_cost.relative_price, Decimal('0.702'))
+        self.assertEqual(
+            sand_cost.cost_share + water_cost.cost_share, Decimal('100'))
+        self.assertEqual(breakdown.cheapest, water_cost)
+        self.assertEqual(breakdown.most_expensive, sand_cost)
+
+    def test_breaks_down_recipe_without_parts(self):
+        breakdown = RecipeCostBreakdown(self.create_recipe())
+
+        self.assertEqual(breakdown.price, Decimal('0'))
+        self.assertEqual(len(breakdown), 0)
+        self.assertIsNone(breakdown.cheapest)
+        self.assertIsNone(breakdown.most_expensive)
+
+    def test_breaks_down_recipe_without_cost(self):
+        water = self.create_ingredient(
+            price=Decimal('0'), weight_unit=WeightUnit.Kg)
+        recipe = self.create_recipe()
+        recipe.add_part(water, percentage=Decimal('30'))
+
+        cost, = RecipeCostBreakdown(recipe)
+
+        self.assertEqual(cost.relative_price, Decimal('0'))
+        self.assertEqual(cost.cost_share, Decimal('0'))
+
+
+class IngredientUsageTest(RecipeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.sand = self.create_ingredient(
+            price=Decimal('1.23'), weight_unit=WeightUnit.g)
+        self.water = self.create_ingredient(
+            price=Decimal('2.34'), weight_unit=WeightUnit.Kg)
+
+    def usages(self, ingredient):
+        return {
+            recipe.pk: IngredientUsage(recipe, ingredient)
+            for recipe in Recipe.objects.with_ingredient_usage(ingredient)
+        }
+
+    def test_matches_the_cost_breakdown(self):
+        recipe = self.create_recipe()
+        recipe.add_part(self.sand, percentage=Decimal('20'))
+        recipe.add_part(self.water, percentage=Decimal('30'))
+        sand_cost, water_cost = RecipeCostBreakdown(recipe)
+
+        usage = self.usages(self.sand)[recipe.pk]
+
+        self.assertEqual(usage.recipe, recipe)
+        self.assertEqual(usage.percentage, Decimal('20'))
+        self.assertEqual(usage.cost_share, sand_cost.cost_share)
+        self.assertEqual(usage.price, recipe.price)
+
+    def test_prices_recipe_without_the_ingredient(self):
+        recipe = self.create_recipe()
+        recipe.add_part(self.sand, percentage=Decimal('20'))
+        recipe.add_part(self.water, percentage=Decimal('30'))
+
+        usage = self.usages(self.sand)[recipe.pk]
+
+        self.assertEqual(usage.price_without, Decimal('2.34'))
+
+    def test_adds_up_repeated_parts(self):
+        recipe = self.create_recipe()
+        recipe.add_part(self.sand, percentage=Decimal('20'))
+        recipe.add_part(self.sand, percentage=Decimal('5'))
+
+        usage = self.usages(self.sand)[recipe.pk]
+
+        self.assertEqual(usage.percentage, Decimal('25'))
+        self.assertEqual(usage.cost_share, Decimal('100'))
+        self.assertEqual(usage.price_without, Decimal('0'))
+
+    def test_only_keeps_recipes_using_the_ingredient(self):
+        recipe = self.create_recipe()
+        recipe.add_part(self.sand, percentage=Decimal('20'))
+        other_recipe = self.create_recipe()
+        other_recipe.add_part(self.water, percentage=Decimal('20'))
+        self.create_recipe()
+
+        self.assertEqual(list(self.usages(self.sand)), [recipe.pk])
+
+    def test_loads_usages_in_a_single_query(self):
+        for _ in range(3):
+            recipe = self.create_recipe()
+            recipe.add_part(self.sand, percentage=Decimal('20'))
+            recipe.add_part(self.water, percentage=Decimal('30'))
+
+        with self.assertNumQueries(1):
+            usages = self.usages(self.sand)
+
+        self.assertEqual(len(usages), 3)
+
+    def test_sums_the_ingredient_once(self):
+        sql = str(Recipe.objects.with_ingredient_usage(self.sand).query)
+
+        self.assertEqual(sql.count('SUM('), len(WeightUnit) + 3)
+
 
 class KindTest(RecipeTestCase):
     def test_converts_to_pretty_name(self):
@@ -227,3 +639,58 @@ class WeightUnitTest(RecipeTestCase):
     def test_gets_g_weighted_in_kg(self):
         self.assertEqual(
             WeightUnit.g.weighted_in(WeightUnit.Kg), Decimal('0.001'))
+
+    def test_gets_lb_weighted_in_oz(self):
+        self.assertEqual(
+            WeightUnit.lb.weighted_in(WeightUnit.oz), Decimal('16'))
+
+    def test_gets_bag_weighted_in_kg(self):
+        self.assertEqual(
+            WeightUnit.bag.weighted_in(WeightUnit.Kg), Decimal('25'))
+
+    def test_rounds_endless_conversions(self):
+        self.assertEqual(
+            WeightUnit.Kg.weighted_in(WeightUnit.lb), Decimal('2.204622622'))
+
+    def test_keeps_stored_values(self):
+        self.assertEqual(WeightUnit(0), WeightUnit.g)
+        self.assertEqual(WeightUnit(1), WeightUnit.Kg)
+
+    def test_labels_units(self):
+        self.assertEqual(str(WeightUnit.lb), 'lb')
+        self.assertEqual(str(WeightUnit.bag), '25 Kg bag')
+
+    def test_prices_every_unit_alike_in_python_and_sql(self):
+        recipe = self.create_recipe()
+        for unit in WeightUnit:
+            recipe.add_part(
+                self.create_ingredient(
+                    price=Decimal('12.34'), weight_unit=unit),
+                percentage=Decimal('10'))
+
+        recipe = Recipe.objects.with_price().get(pk=recipe.pk)
+
+        self.assertEqual(recipe.price, Recipe.objects.get(pk=recipe.pk).price)
+
+    def test_prices_random_recipes_exactly_in_python_and_sql(self):
+        rng = random.Random(1)
+        ingredients = [
+            self.create_ingredient(
+                price=Decimal(rng.randint(1, 50000)).scaleb(-2),
+                weight_unit=rng.choice(list(WeightUnit)))
+            for index in range(40)
+        ]
+        recipes = [self.create_recipe() for index in range(150)]
+        RecipePart.objects.bulk_create(
+            RecipePart(
+                recipe=recipe, ingredient=ingredient,
+                percentage=Decimal(rng.randint(1, 500000)).scaleb(-4))
+            for recipe in recipes
+            for ingredient in rng.sample(ingredients, rng.randint(1, 8))
+        )
+
+        annotated = Recipe.objects.with_price().in_bulk()
+
+        for recipe in recipes:
+            with self.subTest(recipe=recipe.pk):
+                self.assertEqual(annotated[recipe.pk].price, recipe.price)
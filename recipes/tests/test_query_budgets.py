@@ -0,0 +1,287 @@
+import json
+import os
+import tempfile
+from shutil import rmtree
+
+from allauth.account.models import EmailAddress
+from allauth.socialaccount.models import SocialAccount, SocialApp, SocialToken
+from django.contrib import admin
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.core.urlresolvers import RegexURLPattern, reverse
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from model_mommy import mommy
+
+from glaze import urls as glaze_urls
+from recipes import urls as recipes_urls
+from recipes.models import Ingredient, Recipe, RecipePart, WeightUnit
+from recipes.tests.base import RecipeTestCase
+
+PARTS_PER_RECIPE = 3
+# Recipes cloned at once, on top of the library, so that budgets cover the
+# cost of each clone.
+CLONED_RECIPES = 3
+PROFILE_NAME = '20170101T000000-{}'.format('0' * 32)
+
+# Queries allowed per URL, whatever the size of the library. Lower them when
+# a view gets cheaper; raising them needs a good reason.
+BUDGETS = {
+    'ingredients': 5,
+    'ingredients-json': 4,
+    'ingredients-reprice': 7,
+    'ingredients-reprice-json': 6,
+    'ingredient-detail': 7,
+    'ingredient-add': 2,
+    'ingredient-update': 3,
+    'ingredient-update:post': 9,
+    'ingredient-delete': 6,
+    'ingredient-delete:post': 13,
+    'recipes': 5,
+    'recipe-detail': 6,
+    'recipe-clone': 8,
+    'recipes-clone': 8,
+    'recipes-clone:several': 10,
+    'recipe-add': 3,
+    'recipe-update': 5,
+    'recipe-update:post': 21,
+    'recipe-delete': 3,
+    'recipe-delete:post': 8,
+    'profile': 3,
+    'profile-update': 3,
+    'metrics': 2,
+    'request-profiles': 2,
+    'request-profile-download': 2,
+    'admin:account_emailaddress_changelist': 5,
+    'admin:auth_group_changelist': 5,
+    'admin:auth_user_changelist': 6,
+    'admin:glaze_profile_changelist': 5,
+    'admin:recipes_ingredient_changelist': 5,
+    'admin:recipes_recipe_changelist': 5,
+    'admin:sites_site_changelist': 5,
+    'admin:socialaccount_socialaccount_changelist': 5,
+    'admin:socialaccount_socialapp_changelist': 5,
+    'admin:socialaccount_socialtoken_changelist': 6,
+}
+
+
+def admin_changelist_names():
+    """Returns the URL names of the changelists of every registered admin."""
+    return [
+        'admin:{}_{}_changelist'.format(
+            model._meta.app_label, model._meta.model_name)
+        for model in admin.site._registry
+    ]
+
+
+def url_names(urlconf):
+    return [
+        pattern.name for pattern in urlconf.urlpatterns
+        if isinstance(pattern, RegexURLPattern) and pattern.name
+    ]
+
+
+class QueryBudgets:
+    """Runs every view against a library of `SIZE` recipes and ingredients.
+
+    The budgets are the same for every size, so a view whose queries grow
+    with the data fails at the larger ones. Names with a suffix, like
+    `recipe-update:post`, budget other requests to the same URL.
+    """
+    SIZE = None
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.owner = User.objects.create_superuser(
+            'owner', 'owner@example.com', 'test123!')
+        ingredients = mommy.make(
+            Ingredient, user=cls.owner, weight_unit=WeightUnit.Kg,
+            _quantity=cls.SIZE)
+        recipes = mommy.make(Recipe, user=cls.owner, _quantity=cls.SIZE)
+        RecipePart.objects.bulk_create(
+            mommy.prepare(
+                RecipePart, recipe=recipe,
+                ingredient=ingredients[(index + offset) % cls.SIZE])
+            for index, recipe in enumerate(recipes)
+            for offset in range(min(PARTS_PER_RECIPE, cls.SIZE))
+        )
+        cls.ingredient = ingredients[0]
+        cls.recipe = recipes[0]
+        # Ingredients no recipe uses yet, so the recipe updated in the
+        # budgets changes, deletes and adds a part at every size.
+        cls.spare_ingredients = mommy.make(
+            Ingredient, user=cls.owner, weight_unit=WeightUnit.Kg,
+            _quantity=3)
+        RecipePart.objects.bulk_create(
+            mommy.prepare(RecipePart, recipe=cls.recipe, ingredient=ingredient)
+            for ingredient in cls.spare_ingredients[:2]
+        )
+        cls.cloned_recipes = mommy.make(
+            Recipe, user=cls.owner, _quantity=CLONED_RECIPES)
+        RecipePart.objects.bulk_create(
+            mommy.prepare(
+                RecipePart, recipe=recipe,
+                ingredient=ingredients[index % cls.SIZE])
+            for index, recipe in enumerate(cls.cloned_recipes)
+        )
+        Recipe.objects.for_user(cls.owner).update_costs()
+        # Rows for the changelists of the other admins.
+        users = mommy.make(User, _quantity=cls.SIZE)
+        Group.objects.bulk_create(
+            Group(name='group-{}'.format(index)) for index in range(cls.SIZE))
+        EmailAddress.objects.bulk_create(
+            EmailAddress(user=user, email='{}@example.com'.format(user.pk))
+            for user in users)
+        SocialAccount.objects.bulk_create(
+            SocialAccount(user=user, provider='google', uid=str(user.pk))
+            for user in users)
+        app = SocialApp.objects.create(provider='google', name='Google')
+        SocialToken.objects.bulk_create(
+            SocialToken(app=app, account=account, token='token')
+            for account in SocialAccount.objects.all())
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.owner)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(rmtree, directory)
+        settings = override_settings(PROFILING_DIR=directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        with open(os.path.join(directory, PROFILE_NAME + '.prof'), 'w'):
+            pass
+
+    def ingredient_form_data(self):
+        return {
+            'name': self.ingredient.name,
+            'kind': self.ingredient.kind.value,
+            'weight_unit': self.ingredient.weight_unit.value,
+            'price': '12.34',
+        }
+
+    def recipe_form_data(self):
+        """Changes a part of the recipe, deletes another and adds one."""
+        changed, deleted, added = self.spare_ingredients
+        parts = list(self.recipe.parts.order_by('pk'))
+        data = {
+            'name': self.recipe.name,
+            'description': '',
+            'recipepart_set-TOTAL_FORMS': len(parts) + 1,
+            'recipepart_set-INITIAL_FORMS': len(parts),
+            'recipepart_set-MIN_NUM_FORMS': 0,
+            'recipepart_set-MAX_NUM_FORMS': 1000,
+        }
+        forms = [
+            (part.pk, part.ingredient_id,
+             '12.5' if part.ingredient_id == changed.pk else part.percentage)
+            for part in parts
+        ] + [('', added.pk, '7.5')]
+        for index, (pk, ingredient, percentage) in enumerate(forms):
+            prefix = 'recipepart_set-{}-'.format(index)
+            data[prefix + 'id'] = pk
+            data[prefix + 'ingredient'] = ingredient
+            data[prefix + 'percentage'] = percentage
+            if ingredient == deleted.pk:
+                data[prefix + 'DELETE'] = 'on'
+        return data
+
+    def requests(self):
+        """Returns how each URL name is requested, as `(method, path,
+        data)`.
+        """
+        ingredient = {'pk': self.ingredient.pk}
+        recipe = {'pk': self.recipe.pk}
+        repricing = {
+            'form-TOTAL_FORMS': 1,
+            'form-INITIAL_FORMS': 0,
+            'form-0-ingredient': self.ingredient.pk,
+            'form-0-price': '12.34',
+        }
+        requests = {
+            'ingredients': ('get', reverse('ingredients'), None),
+            'ingredients-json': ('get', reverse('ingredients-json'), None),
+            'ingredients-reprice': (
+                'post', reverse('ingredients-reprice'), repricing),
+            'ingredients-reprice-json': (
+                'post', reverse('ingredients-reprice-json'), json.dumps({
+                    'prices': {str(self.ingredient.pk): '12.34'},
+                })),
+            'recipes': ('get', reverse('recipes'), None),
+            # Backends that can't return the ids of bulk inserts, like
+            # SQLite, save clones one by one, so each clone is budgeted.
+            'recipes-clone': (
+                'post', reverse('recipes-clone'), {'pk': self.recipe.pk}),
+            'recipes-clone:several': (
+                'post', reverse('recipes-clone'),
+                {'pk': [recipe.pk for recipe in self.cloned_recipes]}),
+            'ingredient-update:post': (
+                'post', reverse('ingredient-update', kwargs=ingredient),
+                self.ingredient_form_data()),
+            'ingredient-delete:post': (
+                'post', reverse('ingredient-delete', kwargs=ingredient), {}),
+            'recipe-update:post': (
+                'post', reverse('recipe-update', kwargs=recipe),
+                self.recipe_form_data()),
+            'recipe-delete:post': (
+                'post', reverse('recipe-delete', kwargs=recipe), {}),
+        }
+        for name in ['ingredient-detail', 'ingredient-update',
+                     'ingredient-delete']:
+            requests[name] = ('get', reverse(name, kwargs=ingredient), None)
+        for name in ['recipe-detail', 'recipe-clone', 'recipe-update',
+                     'recipe-delete']:
+            requests[name] = ('get', reverse(name, kwargs=recipe), None)
+        for name in ['ingredient-add', 'recipe-add', 'profile',
+                     'profile-update', 'metrics', 'request-profiles']:
+            requests[name] = ('get', reverse(name), None)
+        requests['request-profile-download'] = (
+            'get', reverse('request-profile-download', kwargs={
+                'name': PROFILE_NAME, 'extension': 'prof'}), None)
+        for name in admin_changelist_names():
+            requests[name] = ('get', reverse(name), None)
+        return requests
+
+    def count_queries(self, method, path, data):
+        kwargs = {}
+        if isinstance(data, str):
+            kwargs['content_type'] = 'application/json'
+        # Every request starts from the same data and a cold cache.
+        cache.clear()
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as queries:
+                response = getattr(self.client, method)(
+                    path, data, **kwargs)
+            transaction.set_rollback(True)
+        self.assertLess(response.status_code, 400, path)
+        return len(queries)
+
+    def test_budgets_every_named_url(self):
+        names = url_names(recipes_urls) + url_names(glaze_urls)
+
+        self.assertEqual(
+            set(names) - set(BUDGETS), set(),
+            'Every named URL needs a query budget')
+        self.assertEqual(
+            set(admin_changelist_names()) - set(BUDGETS), set(),
+            'Every registered admin needs a query budget')
+        self.assertEqual(set(BUDGETS), set(self.requests()))
+
+    def test_stays_within_budgets(self):
+        for name, (method, path, data) in sorted(self.requests().items()):
+            with self.subTest(url_name=name):
+                self.assertEqual(
+                    self.count_queries(method, path, data), BUDGETS[name])
+
+
+class OneRecipeQueryBudgetTest(QueryBudgets, RecipeTestCase):
+    SIZE = 1
+
+
+class TenRecipesQueryBudgetTest(QueryBudgets, RecipeTestCase):
+    SIZE = 10
+
+
+class ThousandRecipesQueryBudgetTest(QueryBudgets, RecipeTestCase):
+    SIZE = 1000
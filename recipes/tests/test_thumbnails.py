@@ -0,0 +1,199 @@
+import tempfile
+from shutil import rmtree
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.files.images import ImageFile
+from django.test import override_settings
+from sorl.thumbnail import get_thumbnail
+
+from .base import RecipeTestCase
+from glaze.cache import user_cache_version
+from glaze.metrics import render_metrics
+from recipes.models import Recipe
+from recipes.thumbnails import (
+    LIST_THUMBNAIL,
+    THUMBNAIL_GEOMETRIES,
+    PendingThumbnail,
+    generate_thumbnails,
+    queue_thumbnails,
+    resolve_thumbnails,
+    thumbnail_file,
+    thumbnails_generated,
+)
+
+
+class ThumbnailsTest(RecipeTestCase):
+    def create_recipe_with_image(self):
+        with self.fixture('django.gif') as f:
+            return Recipe.objects.create(
+                user=self.user,
+                name='Interesting Yellow',
+                image=ImageFile(f, 'fixtures/django.gif'),
+            )
+
+    def test_generates_every_template_geometry(self):
+        with patch('recipes.models.queue_thumbnails'):
+            recipe = self.create_recipe_with_image()
+
+        thumbnails = generate_thumbnails(recipe.image.name)
+
+        self.assertEqual(
+            [(thumbnail.width, thumbnail.height) for thumbnail in thumbnails],
+            [(50, 50), (320, 320)])
+        self.assertEqual(len(thumbnails), len(THUMBNAIL_GEOMETRIES))
+        self.assertTrue(all(thumbnail.exists() for thumbnail in thumbnails))
+
+    @override_settings(THUMBNAIL_FORCE_OVERWRITE=True)
+    def test_records_generation_times(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(rmtree, directory)
+        with patch('recipes.models.queue_thumbnails'):
+            recipe = self.create_recipe_with_image()
+
+        with override_settings(METRICS_DIR=directory):
+            generate_thumbnails(recipe.image.name)
+
+        content = render_metrics(directory)
+        for geometry, options in THUMBNAIL_GEOMETRIES:
+            self.assertIn(
+                'glaze_thumbnail_generation_seconds_count{{geometry="{}"}} '
+                '1.0\n'.format(geometry), content)
+
+    @patch('recipes.thumbnails.executor')
+    @patch('recipes.thumbnails.transaction.on_commit',
+           side_effect=lambda func: func())
+    def test_queues_generation_after_commit(self, on_commit, executor):
+        queue_thumbnails('fixtures/django.gif')
+
+        self.assertEqual(on_commit.call_count, 1)
+        self.assertEqual(executor.submit.call_count, 1)
+        self.assertEqual(
+            executor.submit.call_args[0][1], 'fixtures/django.gif')
+
+    @patch('recipes.models.queue_thumbnails')
+    def test_invalidates_fragments_of_owners_once_generated(self, queue):
+        self.create_recipe(image='fixtures/django.gif')
+        version = user_cache_version(self.user.pk)
+        other_version = user_cache_version(self.another_user.pk)
+
+        thumbnails_generated.send(sender=None, name='fixtures/django.gif')
+
+        self.assertGreater(user_cache_version(self.user.pk), version)
+        self.assertEqual(
+            user_cache_version(self.another_user.pk), other_version)
+
+    @patch('recipes.thumbnails._queued', set())
+    @patch('recipes.thumbnails.executor')
+    @patch('recipes.thumbnails.transaction.on_commit',
+           side_effect=lambda func: func())
+    def test_doesnt_queue_image_twice(self, on_commit, executor):
+        queue_thumbnails('fixtures/django.gif')
+        queue_thumbnails('fixtures/django.gif')
+
+        self.assertEqual(executor.submit.call_count, 1)
+
+    @patch('recipes.models.queue_thumbnails')
+    def test_queues_thumbnails_when_image_is_uploaded(self, queue):
+        recipe = self.create_recipe_with_image()
+
+        queue.assert_called_once_with(recipe.image.name)
+
+    @patch('recipes.models.queue_thumbnails')
+    def test_doesnt_queue_thumbnails_for_unchanged_image(self, queue):
+        recipe = self.create_recipe_with_image()
+        queue.reset_mock()
+
+        recipe = Recipe.objects.get(pk=recipe.pk)
+        recipe.name = 'Boring Yellow'
+        recipe.save()
+        recipe.clone()
+
+        self.assertFalse(queue.called)
+
+    @patch('recipes.models.queue_thumbnails')
+    def test_doesnt_queue_thumbnails_without_image(self, queue):
+        self.create_recipe(image=None)
+
+        self.assertFalse(queue.called)
+
+
+@patch('recipes.models.queue_thumbnails')
+class ResolveThumbnailsTest(RecipeTestCase):
+    LOGIN = True
+
+    def setUp(self):
+        super().setUp()
+        with self.fixture('django.gif'):
+            pass
+        self.name = 'fixtures/django.gif'
+        self.geometry, self.options = LIST_THUMBNAIL
+
+    def test_names_thumbnails_like_sorl(self, queue):
+        thumbnail = get_thumbnail(self.name, self.geometry, **self.options)
+
+        self.assertEqual(
+            thumbnail_file(self.name, self.geometry, self.options).name,
+            thumbnail.name)
+
+    @patch('recipes.thumbnails.queue_thumbnails')
+    def test_queues_missing_thumbnails(self, queue_missing, queue):
+        with patch('recipes.thumbnails.get_thumbnail') as generate:
+            thumbnails = resolve_thumbnails(
+                [self.name, '', None], self.geometry, **self.options)
+
+        self.assertFalse(generate.called)
+        self.assertEqual(list(thumbnails), [self.name])
+        self.assertIsInstance(thumbnails[self.name], PendingThumbnail)
+        self.assertEqual(
+            (thumbnails[self.name].width, thumbnails[self.name].height),
+            (50, 50))
+        queue_missing.assert_called_once_with(self.name)
+
+    def test_reads_stored_thumbnails_in_one_lookup(self, queue):
+        generate_thumbnails(self.name)
+
+        with patch('recipes.thumbnails.get_thumbnail') as generate, \
+                patch.object(cache, 'get_many',
+                             wraps=cache.get_many) as get_many, \
+                self.assertNumQueries(0):
+            thumbnails = resolve_thumbnails(
+                [self.name, self.name], self.geometry, **self.options)
+
+        self.assertFalse(generate.called)
+        self.assertEqual(get_many.call_count, 1)
+        self.assertEqual(thumbnails[self.name].width, 50)
+
+    def test_falls_back_to_stored_keys_in_one_query(self, queue):
+        generate_thumbnails(self.name)
+        cache.clear()
+
+        with patch('recipes.thumbnails.get_thumbnail') as generate, \
+                self.assertNumQueries(1):
+            thumbnails = resolve_thumbnails(
+                [self.name], self.geometry, **self.options)
+
+        self.assertFalse(generate.called)
+        self.assertEqual(thumbnails[self.name].height, 50)
+
+    def test_shows_resolved_thumbnails_in_recipe_list(self, queue):
+        generate_thumbnails(self.name)
+        self.create_recipe(image=self.name)
+        self.create_recipe(image=None, name='Plain')
+
+        response = self.client.get('/recipes/recipes/')
+
+        thumbnail = thumbnail_file(self.name, self.geometry, self.options)
+        self.assertContains(response, thumbnail.url)
+        self.assertContains(response, 'width="50" height="50"')
+
+    @patch('recipes.thumbnails.queue_thumbnails')
+    def test_shows_pending_thumbnails_in_recipe_list(self, queue_missing,
+                                                     queue):
+        self.create_recipe(image=self.name)
+
+        response = self.client.get('/recipes/recipes/')
+
+        self.assertContains(response, 'thumbnail-pending')
+        self.assertContains(response, 'width: 50px; height: 50px;')
+        queue_missing.assert_called_once_with(self.name)
@@ -1,9 +1,23 @@
+import json
+import time
 from decimal import Decimal
+from unittest.mock import patch
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils.http import http_date
 
 from .base import RecipeTestCase
-from recipes.models import Kind, Ingredient, WeightUnit
+from glaze.models import Profile
+from recipes.models import (
+    Kind,
+    Ingredient,
+    Recipe,
+    WeightUnit,
+    quantize_cost,
+)
+from recipes.views import IngredientDetail, IngredientList, RecipeList
 
 
 class IngredientListTest(RecipeTestCase):
@@ -24,6 +38,106 @@ class IngredientListTest(RecipeTestCase):
         self.assertNotContains(response, ingredient.name)
 
 
+class IngredientListPaginationTest(RecipeTestCase):
+    LOGIN = True
+
+    def names(self, response):
+        return [i.name for i in response.context['object_list']]
+
+    def follow(self, response, direction):
+        page = response.context['page_obj']
+        return self.client.get('/recipes/ingredients/?{}'.format(
+            getattr(page, '{}_query'.format(direction))))
+
+    def test_sorts_by_name_by_default(self):
+        self.create_ingredient(name='Water')
+        self.create_ingredient(name='Sand')
+
+        response = self.client.get('/recipes/ingredients/')
+
+        self.assertEqual(self.names(response), ['Sand', 'Water'])
+        self.assertFalse(response.context['is_paginated'])
+
+    def test_sorts_by_price_descending(self):
+        self.create_ingredient(name='Water', price=Decimal('1.00'))
+        self.create_ingredient(name='Sand', price=Decimal('3.00'))
+        self.create_ingredient(name='Salt', price=Decimal('2.00'))
+
+        response = self.client.get('/recipes/ingredients/?sort=-price')
+
+        self.assertEqual(self.names(response), ['Sand', 'Salt', 'Water'])
+
+    def test_filters_by_kind_and_weight_unit(self):
+        self.create_ingredient(
+            name='Water', kind=Kind.Base, weight_unit=WeightUnit.Kg)
+        self.create_ingredient(
+            name='Sand', kind=Kind.Addition, weight_unit=WeightUnit.Kg)
+        self.create_ingredient(
+            name='Salt', kind=Kind.Addition, weight_unit=WeightUnit.g)
+
+        response = self.client.get(
+            '/recipes/ingredients/?kind={}&weight_unit={}'.format(
+                Kind.Addition.value, WeightUnit.Kg.value))
+
+        self.assertEqual(self.names(response), ['Sand'])
+
+    def test_ignores_invalid_options(self):
+        self.create_ingredient(name='Water')
+
+        response = self.client.get(
+            '/recipes/ingredients/?kind=99&sort=password')
+
+        self.assertEqual(self.names(response), ['Water'])
+
+    @patch.object(IngredientList, 'paginate_by', 2)
+    def test_seeks_pages_with_ties(self):
+        for name in 'ABCDE':
+            self.create_ingredient(name=name, price=Decimal('1.00'))
+
+        page1 = self.client.get('/recipes/ingredients/?sort=price')
+        page2 = self.follow(page1, 'next')
+        page3 = self.follow(page2, 'next')
+        back = self.follow(page3, 'previous')
+
+        self.assertEqual(self.names(page1), ['A', 'B'])
+        self.assertEqual(self.names(page2), ['C', 'D'])
+        self.assertEqual(self.names(page3), ['E'])
+        self.assertEqual(self.names(back), ['C', 'D'])
+        self.assertFalse(page1.context['page_obj'].has_previous())
+        self.assertTrue(back.context['page_obj'].has_previous())
+        self.assertFalse(page3.context['page_obj'].has_next())
+        self.assertContains(page2, 'sort=price')
+
+    @patch.object(IngredientList, 'paginate_by', 2)
+    def test_seeks_pages_by_date(self):
+        for name in 'ABC':
+            self.create_ingredient(name=name)
+
+        page1 = self.client.get('/recipes/ingredients/?sort=-created')
+        page2 = self.follow(page1, 'next')
+
+        self.assertEqual(self.names(page1), ['C', 'B'])
+        self.assertEqual(self.names(page2), ['A'])
+
+    @patch.object(IngredientList, 'paginate_by', 2)
+    def test_loads_pages_in_fixed_number_of_queries(self):
+        for name in 'ABCDEFGH':
+            self.create_ingredient(name=name)
+
+        with self.assertNumQueries(5):
+            page = self.client.get('/recipes/ingredients/')
+        for i in range(3):
+            with self.assertNumQueries(5):
+                page = self.follow(page, 'next')
+
+        self.assertEqual(self.names(page), ['G', 'H'])
+
+    def test_doesnt_load_invalid_page(self):
+        response = self.client.get('/recipes/ingredients/?after=garbage')
+
+        self.assertEqual(response.status_code, 404)
+
+
 class IngredientDetailTest(RecipeTestCase):
     LOGIN = True
 
@@ -35,6 +149,82 @@ class IngredientDetailTest(RecipeTestCase):
         self.assertContains(response, ingredient.name)
 
 
+class IngredientUsageViewsTest(RecipeTestCase):
+    LOGIN = True
+
+    def setUp(self):
+        super().setUp()
+        self.sand = self.create_ingredient(
+            name='Sand', price=Decimal('1.00'), weight_unit=WeightUnit.Kg)
+        self.water = self.create_ingredient(
+            name='Water', price=Decimal('3.00'), weight_unit=WeightUnit.Kg)
+
+    def create_recipes(self, count, start=0):
+        for index in range(start, start + count):
+            recipe = self.create_recipe(name='Recipe {:02}'.format(index))
+            recipe.add_part(self.sand, percentage=Decimal('50'))
+            recipe.add_part(self.water, percentage=Decimal('50'))
+
+    def test_shows_recipes_using_the_ingredient(self):
+        self.create_recipes(2)
+        unrelated = self.create_recipe(name='Unrelated')
+        unrelated.add_part(self.water, percentage=Decimal('10'))
+
+        response = self.client.get(
+            reverse('ingredient-detail', kwargs={'pk': self.sand.pk}))
+
+        names = [recipe.name for recipe in response.context['usage_page']]
+        self.assertEqual(names, ['Recipe 00', 'Recipe 01'])
+        self.assertContains(response, '50%')
+        self.assertContains(response, '25.00%')
+
+    def test_paginates_recipes_using_the_ingredient(self):
+        self.create_recipes(3)
+        url = reverse('ingredient-detail', kwargs={'pk': self.sand.pk})
+
+        with patch.object(IngredientDetail, 'paginate_by', 2):
+            response = self.client.get(url)
+            page = response.context['usage_page']
+            response = self.client.get('{}?{}'.format(url, page.next_query))
+
+        names = [recipe.name for recipe in response.context['usage_page']]
+        self.assertEqual(names, ['Recipe 02'])
+
+    def test_shows_usage_with_a_fixed_number_of_queries(self):
+        url = reverse('ingredient-detail', kwargs={'pk': self.sand.pk})
+        self.create_recipes(1)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+
+        self.create_recipes(10, start=1)
+        with self.assertNumQueries(len(queries)):
+            self.client.get(url)
+
+    def test_shows_that_it_isnt_used(self):
+        response = self.client.get(
+            reverse('ingredient-detail', kwargs={'pk': self.sand.pk}))
+
+        self.assertContains(response, 'Not used in any recipe.')
+
+    def test_shows_delete_impact(self):
+        self.create_recipes(2)
+
+        response = self.client.get(
+            reverse('ingredient-delete', kwargs={'pk': self.sand.pk}))
+
+        self.assertEqual(
+            response.context['impact'], {'parts': 2, 'recipes': 2})
+        self.assertContains(response, 'This also deletes 2 recipe parts.')
+        self.assertContains(response, '2.00/Kg')
+        self.assertContains(response, '3.00/Kg')
+
+    def test_doesnt_show_delete_impact_if_unused(self):
+        response = self.client.get(
+            reverse('ingredient-delete', kwargs={'pk': self.sand.pk}))
+
+        self.assertNotContains(response, 'This also deletes')
+
+
 class IngredientCreateTest(RecipeTestCase):
     LOGIN = True
 
@@ -133,6 +323,61 @@ class RecipeViewsTest(RecipeTestCase):
 
         self.assertNotContains(response, recipe.name)
 
+    @patch.object(RecipeList, 'paginate_by', 1)
+    def test_seeks_recipes_by_price(self):
+        water = self.create_ingredient(
+            price=Decimal('1.00'), weight_unit=WeightUnit.Kg)
+        sand = self.create_ingredient(
+            price=Decimal('2.00'), weight_unit=WeightUnit.Kg)
+        self.create_recipe(name='Yellow').add_part(water, Decimal('10'))
+        self.create_recipe(name='Blue').add_part(sand, Decimal('10'))
+
+        page1 = self.client.get('/recipes/recipes/?sort=-price')
+        page2 = self.client.get('/recipes/recipes/?{}'.format(
+            page1.context['page_obj'].next_query))
+
+        self.assertEqual(
+            [recipe.name for recipe in page1.context['object_list']],
+            ['Blue'])
+        self.assertEqual(
+            [recipe.name for recipe in page2.context['object_list']],
+            ['Yellow'])
+
+    def test_loads_recipe_detail_with_cost_breakdown(self):
+        sand = self.create_ingredient(
+            name='Sand', price=Decimal('1.23'), weight_unit=WeightUnit.g)
+        water = self.create_ingredient(
+            name='Water', price=Decimal('2.34'), weight_unit=WeightUnit.Kg)
+        recipe = self.create_recipe()
+        recipe.add_part(sand, percentage=Decimal('20'))
+        recipe.add_part(water, percentage=Decimal('30'))
+
+        response = self.client.get(
+            '/recipes/recipes/{}/'.format(recipe.pk))
+
+        self.assertContains(response, 'Sand')
+        self.assertContains(response, 'Water')
+        self.assertContains(response, '493.40/Kg')
+        self.assertContains(response, '246.00')
+        self.assertContains(response, '99.72%')
+        self.assertEqual(
+            response.context['cost_breakdown'].most_expensive.part.ingredient,
+            sand)
+
+    def test_loads_recipe_detail_in_fixed_number_of_queries(self):
+        def count_queries(parts):
+            recipe = self.create_recipe()
+            for i in range(parts):
+                recipe.add_part(
+                    self.create_ingredient(), percentage=Decimal('10'))
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(
+                    '/recipes/recipes/{}/'.format(recipe.pk))
+            self.assertEqual(response.status_code, 200)
+            return len(context)
+
+        self.assertEqual(count_queries(1), count_queries(10))
+
     def test_clones_recipe_and_redirects_to_the_copy(self):
         recipe = self.create_recipe()
 
@@ -145,13 +390,588 @@ class RecipeViewsTest(RecipeTestCase):
                              'pk': recipe.pk + 1,
                          }))
 
+    def test_clones_selected_recipes(self):
+        recipe1 = self.create_recipe(name='Yellow')
+        self.create_recipe(name='Blue')
+        recipe3 = self.create_recipe(name='Red')
+
+        response = self.client.post('/recipes/recipes/clone/', {
+            'pk': [recipe1.pk, recipe3.pk],
+        })
+
+        self.assertRedirects(response, reverse('recipes'))
+        self.assertEqual(
+            sorted(Recipe.objects.values_list('name', flat=True)), [
+                'Blue',
+                'Red',
+                'Red (Copy of {})'.format(recipe3.pk),
+                'Yellow',
+                'Yellow (Copy of {})'.format(recipe1.pk),
+            ])
+
+    def test_clones_all_recipes(self):
+        self.create_recipe(name='Yellow')
+        self.create_recipe(name='Blue')
+        self.create_recipe(name='Red', user=self.another_user)
+
+        self.client.post('/recipes/recipes/clone/', {'all': '1'})
+
+        self.assertEqual(Recipe.objects.for_user(self.user).count(), 4)
+        self.assertEqual(Recipe.objects.for_user(self.another_user).count(), 1)
+
+    def test_doesnt_clone_recipes_from_another_user(self):
+        recipe = self.create_recipe(user=self.another_user)
+
+        self.client.post('/recipes/recipes/clone/', {'pk': [recipe.pk]})
+
+        self.assertEqual(Recipe.objects.count(), 1)
+
+    def test_doesnt_clone_recipes_on_get(self):
+        self.create_recipe()
+
+        response = self.client.get('/recipes/recipes/clone/')
+
+        self.assertEqual(response.status_code, 405)
+        self.assertEqual(Recipe.objects.count(), 1)
+
+    def recipe_form_data(self, name, parts=(), new_parts=()):
+        data = {
+            'name': name,
+            'description': '',
+            'recipepart_set-TOTAL_FORMS': len(parts) + len(new_parts),
+            'recipepart_set-INITIAL_FORMS': len(parts),
+            'recipepart_set-MIN_NUM_FORMS': 0,
+            'recipepart_set-MAX_NUM_FORMS': 1000,
+        }
+        forms = [
+            (part.pk, part.ingredient_id, percentage, delete)
+            for part, percentage, delete in parts
+        ] + [
+            ('', ingredient.pk, percentage, False)
+            for ingredient, percentage in new_parts
+        ]
+        for i, (pk, ingredient, percentage, delete) in enumerate(forms):
+            prefix = 'recipepart_set-{}-'.format(i)
+            data[prefix + 'id'] = pk
+            data[prefix + 'ingredient'] = ingredient
+            data[prefix + 'percentage'] = percentage
+            if delete:
+                data[prefix + 'DELETE'] = 'on'
+        return data
+
+    def test_adds_recipe_with_parts(self):
+        sand = self.create_ingredient(
+            price=Decimal('1.23'), weight_unit=WeightUnit.g)
+        water = self.create_ingredient(
+            price=Decimal('2.34'), weight_unit=WeightUnit.Kg)
+
+        response = self.client.post('/recipes/recipe/add/', (
+            self.recipe_form_data('Yellow', new_parts=[
+                (sand, '20'),
+                (water, '30'),
+            ])))
+
+        self.assertRedirects(response, reverse('recipes'))
+        recipe = Recipe.objects.get(name='Yellow')
+        self.assertEqual(recipe.user, self.user)
+        self.assertEqual(
+            list(recipe.parts.values_list('ingredient', 'percentage')),
+            [(sand.pk, Decimal('20')), (water.pk, Decimal('30'))])
+        self.assertEqual(recipe.cost_per_kg, Decimal('493.404'))
+
+    def test_updates_recipe_parts(self):
+        sand = self.create_ingredient(
+            price=Decimal('1.23'), weight_unit=WeightUnit.g)
+        water = self.create_ingredient(
+            price=Decimal('2.34'), weight_unit=WeightUnit.Kg)
+        salt = self.create_ingredient(
+            price=Decimal('3.45'), weight_unit=WeightUnit.Kg)
+        recipe = self.create_recipe(name='Yellow')
+        recipe.add_part(sand, percentage=Decimal('20'))
+        recipe.add_part(water, percentage=Decimal('30'))
+        sand_part, water_part = recipe.parts.order_by('pk')
+
+        response = self.client.post(
+            '/recipes/recipe/{}/'.format(recipe.pk),
+            self.recipe_form_data(
+                'Yellow',
+                parts=[(sand_part, '20', True), (water_part, '40', False)],
+                new_parts=[(salt, '60')]))
+
+        self.assertRedirects(response, reverse('recipes'))
+        self.assertEqual(
+            list(recipe.parts.order_by('pk').values_list(
+                'ingredient', 'percentage')),
+            [(water.pk, Decimal('40')), (salt.pk, Decimal('60'))])
+        self.assertEqual(
+            Recipe.objects.get(pk=recipe.pk).cost_per_kg,
+            quantize_cost(recipe.price))
+
+    def test_saves_recipe_parts_in_fixed_number_of_statements(self):
+        def count_writes(size):
+            recipe = self.create_recipe()
+            for i in range(size):
+                recipe.add_part(
+                    self.create_ingredient(), percentage=Decimal('10'))
+            parts = recipe.parts.order_by('pk')
+            data = self.recipe_form_data(
+                recipe.name,
+                parts=[
+                    (part, '20', i == 0) for i, part in enumerate(parts)
+                ],
+                new_parts=[
+                    (self.create_ingredient(), '5') for i in range(size)
+                ])
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.post(
+                    '/recipes/recipe/{}/'.format(recipe.pk), data)
+            writes = [
+                query for query in context.captured_queries
+                if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))
+            ]
+            self.assertRedirects(response, reverse('recipes'))
+            self.assertEqual(recipe.parts.count(), 2 * size - 1)
+            return len(writes)
+
+        self.assertEqual(count_writes(2), count_writes(20))
+
+    def test_loads_recipe_form_in_fixed_number_of_queries(self):
+        def count_queries(size):
+            recipe = self.create_recipe()
+            for i in range(size):
+                recipe.add_part(
+                    self.create_ingredient(), percentage=Decimal('10'))
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(
+                    '/recipes/recipe/{}/'.format(recipe.pk))
+            self.assertEqual(response.status_code, 200)
+            return len(context)
+
+        self.assertEqual(count_queries(1), count_queries(100))
+
+    def test_validates_recipe_parts_in_fixed_number_of_queries(self):
+        def count_queries(size):
+            recipe = self.create_recipe()
+            for i in range(size):
+                recipe.add_part(
+                    self.create_ingredient(), percentage=Decimal('10'))
+            data = self.recipe_form_data(
+                recipe.name,
+                parts=[(part, '20', False) for part in recipe.parts],
+                new_parts=[(self.create_ingredient(), '5')])
+            with CaptureQueriesContext(connection) as context:
+                self.client.post(
+                    '/recipes/recipe/{}/'.format(recipe.pk), data)
+            return len(context)
+
+        self.assertEqual(count_queries(1), count_queries(100))
+
+    def test_doesnt_accept_parts_from_another_recipe(self):
+        recipe = self.create_recipe(name='Yellow')
+        other_recipe = self.create_recipe(name='Blue')
+        other_recipe.add_part(self.create_ingredient(), Decimal('10'))
+        other_part = other_recipe.parts.get()
+
+        response = self.client.post(
+            '/recipes/recipe/{}/'.format(recipe.pk),
+            self.recipe_form_data(
+                'Yellow', parts=[(other_part, '20', False)]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context['recipe_part_form'].is_valid())
+        self.assertEqual(other_recipe.parts.get().percentage, Decimal('10'))
+
+    def test_doesnt_save_recipe_with_invalid_parts(self):
+        recipe = self.create_recipe(name='Yellow')
+        ingredient = self.create_ingredient(user=self.another_user)
+
+        response = self.client.post(
+            '/recipes/recipe/{}/'.format(recipe.pk),
+            self.recipe_form_data('Blue', new_parts=[(ingredient, '20')]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context['recipe_part_form'].is_valid())
+        self.assertEqual(Recipe.objects.get(pk=recipe.pk).name, 'Yellow')
+        self.assertEqual(recipe.parts.count(), 0)
+
     def test_doesnt_show_another_users_ingredient_for_editing_recipe(self):
-        self.create_ingredient(name='Water')
-        self.create_ingredient(name='Sand')
+        water = self.create_ingredient(name='Water')
+        sand = self.create_ingredient(name='Sand')
         self.create_ingredient(name='Pepper', user=self.another_user)
 
         response = self.client.get('/recipes/recipe/add/')
+        catalog = self.client.get('/recipes/ingredients.json')
 
-        self.assertContains(response, 'Water')
-        self.assertContains(response, 'Sand')
+        self.assertContains(response, reverse('ingredients-json'))
         self.assertNotContains(response, 'Pepper')
+        self.assertEqual(catalog.json(), [
+            {'id': sand.pk, 'name': 'Sand'},
+            {'id': water.pk, 'name': 'Water'},
+        ])
+
+    def test_shows_only_selected_ingredients_for_editing_recipe(self):
+        water = self.create_ingredient(name='Water')
+        self.create_ingredient(name='Sand')
+        recipe = self.create_recipe()
+        recipe.add_part(water, Decimal('10'))
+
+        response = self.client.get('/recipes/recipe/{}/'.format(recipe.pk))
+
+        self.assertContains(response, 'value="Water"', count=1)
+        self.assertContains(
+            response, 'name="recipepart_set-0-ingredient" '
+            'type="hidden" value="{}"'.format(water.pk), count=1)
+        self.assertNotContains(response, 'Sand')
+
+
+class IngredientCatalogTest(RecipeTestCase):
+    LOGIN = True
+
+    def test_returns_not_modified_for_unchanged_catalog(self):
+        self.create_ingredient(name='Water')
+        response = self.client.get('/recipes/ingredients.json')
+
+        cached = self.client.get(
+            '/recipes/ingredients.json',
+            HTTP_IF_NONE_MATCH=response['ETag'])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b'')
+
+    def test_changes_etag_when_catalog_changes(self):
+        ingredient = self.create_ingredient(name='Water')
+        etag = self.client.get('/recipes/ingredients.json')['ETag']
+
+        ingredient.name = 'Fresh water'
+        ingredient.save()
+        response = self.client.get(
+            '/recipes/ingredients.json', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()[0]['name'], 'Fresh water')
+
+    def test_changes_etag_when_ingredient_is_deleted(self):
+        self.create_ingredient(name='Water')
+        ingredient = self.create_ingredient(name='Sand')
+        etag = self.client.get('/recipes/ingredients.json')['ETag']
+
+        ingredient.delete()
+        response = self.client.get('/recipes/ingredients.json')
+
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_doesnt_load_catalog_from_another_user(self):
+        self.create_ingredient(name='Pepper', user=self.another_user)
+
+        response = self.client.get('/recipes/ingredients.json')
+
+        self.assertEqual(response.json(), [])
+
+
+class FragmentCacheTest(RecipeTestCase):
+    LOGIN = True
+
+    def assertQueriesMention(self, url, column, mentioned=True):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        sql = ' '.join(query['sql'] for query in context.captured_queries)
+        if mentioned:
+            self.assertIn(column, sql)
+        else:
+            self.assertNotIn(column, sql)
+        return response
+
+    def test_skips_queries_for_warm_recipe_list(self):
+        self.create_recipe(name='Celadon')
+
+        self.assertQueriesMention(
+            '/recipes/recipes/', '"recipes_recipe"."name"')
+        response = self.assertQueriesMention(
+            '/recipes/recipes/', '"recipes_recipe"."name"', mentioned=False)
+
+        self.assertContains(response, 'Celadon')
+
+    def test_refreshes_recipe_list_when_recipe_changes(self):
+        recipe = self.create_recipe(name='Celadon')
+        self.client.get('/recipes/recipes/')
+
+        recipe.name = 'Tenmoku'
+        recipe.save()
+        response = self.client.get('/recipes/recipes/')
+
+        self.assertContains(response, 'Tenmoku')
+
+    def test_refreshes_recipe_list_when_recipes_are_cloned(self):
+        recipe = self.create_recipe(name='Celadon')
+        self.client.get('/recipes/recipes/')
+
+        Recipe.objects.filter(pk=recipe.pk).clone()
+        response = self.client.get('/recipes/recipes/')
+
+        self.assertContains(response, 'Copy of {}'.format(recipe.pk))
+
+    def test_keeps_pages_and_options_apart(self):
+        self.create_ingredient(name='Sand', price=Decimal('1.00'))
+        self.create_ingredient(name='Water', price=Decimal('2.00'))
+
+        self.client.get('/recipes/ingredients/')
+        response = self.client.get('/recipes/ingredients/?sort=-price')
+
+        self.assertEqual(
+            [ingredient.name for ingredient in response.context[
+                'object_list']],
+            ['Water', 'Sand'])
+
+    def test_refreshes_ingredient_list_when_ingredient_is_deleted(self):
+        ingredient = self.create_ingredient(name='Sand')
+        self.client.get('/recipes/ingredients/')
+
+        ingredient.delete()
+        response = self.assertQueriesMention(
+            '/recipes/ingredients/', '"recipes_ingredient"."name"')
+
+        self.assertNotContains(response, 'Sand')
+
+    def test_doesnt_refresh_for_another_users_changes(self):
+        self.create_ingredient(name='Sand')
+        self.client.get('/recipes/ingredients/')
+
+        self.create_ingredient(user=self.another_user, name='Water')
+
+        self.assertQueriesMention(
+            '/recipes/ingredients/', '"recipes_ingredient"."name"',
+            mentioned=False)
+
+    def test_skips_parts_query_for_warm_recipe_detail(self):
+        recipe = self.create_recipe()
+        recipe.add_part(self.create_ingredient(name='Sand'), Decimal('10'))
+        url = '/recipes/recipes/{}/'.format(recipe.pk)
+
+        self.assertQueriesMention(url, '"recipes_recipepart"."percentage"')
+        response = self.assertQueriesMention(
+            url, '"recipes_recipepart"."percentage"', mentioned=False)
+
+        self.assertContains(response, 'Sand')
+
+    def test_refreshes_recipe_detail_when_parts_change(self):
+        recipe = self.create_recipe()
+        recipe.add_part(self.create_ingredient(name='Sand'), Decimal('10'))
+        url = '/recipes/recipes/{}/'.format(recipe.pk)
+        self.client.get(url)
+
+        recipe.add_part(self.create_ingredient(name='Water'), Decimal('10'))
+        response = self.client.get(url)
+
+        self.assertContains(response, 'Water')
+
+    def test_refreshes_recipe_detail_when_ingredient_changes(self):
+        recipe = self.create_recipe()
+        ingredient = self.create_ingredient(name='Sand')
+        recipe.add_part(ingredient, Decimal('10'))
+        url = '/recipes/recipes/{}/'.format(recipe.pk)
+        self.client.get(url)
+
+        ingredient.name = 'Silica'
+        ingredient.save()
+        response = self.client.get(url)
+
+        self.assertContains(response, 'Silica')
+
+    def test_refreshes_recipe_detail_when_parts_are_saved_in_bulk(self):
+        recipe = self.create_recipe()
+        ingredient = self.create_ingredient(name='Sand')
+        recipe.add_part(ingredient, Decimal('10'))
+        part = recipe.parts.get()
+        url = '/recipes/recipes/{}/'.format(recipe.pk)
+        self.client.get(url)
+
+        recipe.save_parts(deleted=[part])
+        response = self.client.get(url)
+
+        self.assertNotContains(response, 'Sand')
+
+
+class ConditionalGetTest(RecipeTestCase):
+    LOGIN = True
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_answers_unchanged_ingredient_list_with_304(self):
+        self.create_ingredient()
+        response = self.client.get('/recipes/ingredients/')
+
+        with self.assertTemplateNotUsed('recipes/ingredient_list.html'):
+            cached = self.revalidate('/recipes/ingredients/', response)
+
+        self.assertEqual(cached.status_code, 304)
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_revalidates_ingredient_list_after_deletion(self):
+        ingredient = self.create_ingredient()
+        self.create_ingredient()
+        response = self.client.get('/recipes/ingredients/')
+
+        ingredient.delete()
+
+        self.assertEqual(
+            self.revalidate('/recipes/ingredients/', response).status_code,
+            200)
+
+    def test_revalidates_recipe_list_when_ingredient_price_changes(self):
+        ingredient = self.create_ingredient(price=Decimal('1.00'))
+        self.create_recipe().add_part(ingredient, Decimal('10'))
+        response = self.client.get('/recipes/recipes/')
+
+        ingredient.price = Decimal('2.00')
+        ingredient.save()
+
+        self.assertEqual(
+            self.revalidate('/recipes/recipes/', response).status_code, 200)
+
+    def test_keeps_etags_per_user(self):
+        self.client.force_login(self.another_user)
+        response = self.client.get('/recipes/ingredients/')
+
+        self.client.force_login(self.user)
+
+        self.assertEqual(
+            self.revalidate('/recipes/ingredients/', response).status_code,
+            200)
+
+    def test_answers_unchanged_ingredient_detail_with_304(self):
+        ingredient = self.create_ingredient()
+        url = '/recipes/ingredients/{}/'.format(ingredient.pk)
+        response = self.client.get(url)
+
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+    def test_doesnt_validate_by_date(self):
+        ingredient = self.create_ingredient()
+        url = '/recipes/ingredients/{}/'.format(ingredient.pk)
+        response = self.client.get(url)
+        Profile.objects.filter(user=self.user).update(currency='EUR')
+
+        cached = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+
+        self.assertNotIn('Last-Modified', response)
+        self.assertEqual(cached.status_code, 200)
+
+    def test_doesnt_validate_missing_ingredient(self):
+        ingredient = self.create_ingredient(user=self.another_user)
+
+        response = self.client.get(
+            '/recipes/ingredients/{}/'.format(ingredient.pk))
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_answers_unchanged_recipe_detail_in_one_query(self):
+        recipe = self.create_recipe()
+        recipe.add_part(self.create_ingredient(), Decimal('10'))
+        url = '/recipes/recipes/{}/'.format(recipe.pk)
+        response = self.client.get(url)
+
+        with CaptureQueriesContext(connection) as context:
+            cached = self.revalidate(url, response)
+
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(len([
+            query for query in context.captured_queries
+            if 'recipes_' in query['sql']
+        ]), 1)
+
+    def test_revalidates_recipe_detail_when_part_changes(self):
+        recipe = self.create_recipe()
+        recipe.add_part(self.create_ingredient(), Decimal('10'))
+        url = '/recipes/recipes/{}/'.format(recipe.pk)
+        response = self.client.get(url)
+
+        recipe.parts.get().delete()
+
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_revalidates_recipe_detail_when_ingredient_changes(self):
+        recipe = self.create_recipe()
+        ingredient = self.create_ingredient(name='Sand')
+        recipe.add_part(ingredient, Decimal('10'))
+        url = '/recipes/recipes/{}/'.format(recipe.pk)
+        response = self.client.get(url)
+
+        ingredient.name = 'Silica'
+        ingredient.save()
+
+        self.assertContains(self.revalidate(url, response), 'Silica')
+
+    def test_revalidates_when_currency_changes(self):
+        recipe = self.create_recipe()
+        url = '/recipes/recipes/{}/'.format(recipe.pk)
+        response = self.client.get(url)
+
+        self.user.profile.currency = 'BRL'
+        self.user.profile.save()
+
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+
+class RepricingViewsTest(RecipeTestCase):
+    LOGIN = True
+
+    def setUp(self):
+        super().setUp()
+        self.water = self.create_ingredient(
+            price=Decimal('2.34'), weight_unit=WeightUnit.Kg)
+        self.recipe = self.create_recipe(name='Tenmoku')
+        self.recipe.add_part(self.water, Decimal('50'))
+
+    def post_json(self, data):
+        return self.client.post(
+            reverse('ingredients-reprice-json'), json.dumps(data),
+            content_type='application/json')
+
+    def test_loads_repricing_form(self):
+        response = self.client.get(reverse('ingredients-reprice'))
+
+        self.assertContains(response, 'ingredient-catalog')
+
+    def test_shows_affected_recipes(self):
+        response = self.client.post(reverse('ingredients-reprice'), {
+            'form-TOTAL_FORMS': 1,
+            'form-INITIAL_FORMS': 0,
+            'form-0-ingredient': self.water.pk,
+            'form-0-price': '4.68',
+        })
+
+        self.assertContains(response, 'Tenmoku')
+        self.assertEqual(
+            response.context['repricings'][0].new_cost, Decimal('4.68'))
+
+    def test_reprices_through_api(self):
+        response = self.post_json({'prices': {str(self.water.pk): '1.17'}})
+
+        self.assertEqual(response.json(), {'recipes': [{
+            'id': self.recipe.pk,
+            'name': 'Tenmoku',
+            'old_cost': '2.340000',
+            'new_cost': '1.170000',
+            'delta': '-1.170000',
+        }]})
+
+    def test_doesnt_reprice_another_users_ingredient(self):
+        ingredient = self.create_ingredient(user=self.another_user)
+
+        response = self.post_json({'prices': {str(ingredient.pk): '1'}})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('errors', response.json())
+
+    def test_rejects_malformed_requests(self):
+        response = self.client.post(
+            reverse('ingredients-reprice-json'), 'nope',
+            content_type='application/json')
+
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,178 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.dispatch import Signal
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE
+from sorl.thumbnail.models import KVStore as KVStoreModel
+from sorl.thumbnail.parsers import parse_geometry
+
+from glaze.metrics import THUMBNAIL_DURATION
+from recipes.images import create_variants, delete_variants
+
+logger = logging.getLogger(__name__)
+
+# Every thumbnail the recipe templates render, as (geometry, options).
+LIST_THUMBNAIL = ('50x50', {'crop': 'center'})
+DETAIL_THUMBNAIL = ('320x320', {'crop': 'center'})
+THUMBNAIL_GEOMETRIES = [LIST_THUMBNAIL, DETAIL_THUMBNAIL]
+
+executor = ThreadPoolExecutor(max_workers=settings.THUMBNAIL_WORKERS)
+# Images whose thumbnails are queued or being generated, so that pages
+# shown meanwhile don't queue them again.
+_queued = set()
+_queued_lock = threading.Lock()
+
+# Sent from the worker thread once the thumbnails of an image are stored.
+thumbnails_generated = Signal(providing_args=['name'])
+
+
+class TimedThumbnailBackend(ThumbnailBackend):
+    """Records how long each thumbnail that isn't stored yet takes."""
+    def _create_thumbnail(self, source_image, geometry_string, options,
+                          thumbnail):
+        start = perf_counter()
+        super()._create_thumbnail(
+            source_image, geometry_string, options, thumbnail)
+        THUMBNAIL_DURATION.observe(
+            perf_counter() - start, geometry=geometry_string)
+
+
+def generate_thumbnails(name):
+    thumbnails = []
+    for geometry, options in THUMBNAIL_GEOMETRIES:
+        thumbnail = get_thumbnail(name, geometry, **options)
+        # sorl only logs unreadable sources, handing back a missing file.
+        if not thumbnail.exists():
+            raise IOError('Could not generate the {} thumbnail of {}'.format(
+                geometry, name))
+        thumbnails.append(thumbnail)
+    return thumbnails
+
+
+def _generate_in_background(name):
+    try:
+        generate_thumbnails(name)
+        thumbnails_generated.send(sender=None, name=name)
+    except Exception:
+        logger.exception('Could not generate thumbnails for %s', name)
+    finally:
+        with _queued_lock:
+            _queued.discard(name)
+        # Worker threads keep their own connection to the key-value store.
+        connection.close()
+
+
+def _submit(name):
+    with _queued_lock:
+        if name in _queued:
+            return
+        _queued.add(name)
+    executor.submit(_generate_in_background, name)
+
+
+def queue_thumbnails(name):
+    """Generates the thumbnails of an image after the current transaction.
+
+    The work runs in a background thread, so the request that uploaded the
+    image doesn't wait for it. Images already queued aren't queued again.
+    """
+    transaction.on_commit(lambda: _submit(name))
+
+
+def _process_in_background(function, name, *args):
+    try:
+        function(name, *args)
+    except Exception:
+        logger.exception('Could not process the image %s', name)
+    finally:
+        connection.close()
+
+
+def queue_variants(name):
+    """Creates the variants of an image after the current transaction, in
+    the background along with its thumbnails."""
+    transaction.on_commit(lambda: executor.submit(
+        _process_in_background, create_variants, name))
+
+
+def queue_variant_deletion(name, width):
+    """Deletes the variants of a replaced image after the current
+    transaction, in the background."""
+    transaction.on_commit(lambda: executor.submit(
+        _process_in_background, delete_variants, name, width))
+
+
+class PendingThumbnail:
+    """Stands in for a thumbnail that's queued, with the size it may take."""
+    url = None
+
+    def __init__(self, geometry):
+        self.width, self.height = parse_geometry(geometry)
+
+
+def thumbnail_file(name, geometry, options):
+    """Returns the file sorl stores the thumbnail of an image in.
+
+    This mirrors the option defaults of `ThumbnailBackend.get_thumbnail`, so
+    the names and keys match the ones the `thumbnail` tag uses. sorl has no
+    public API for them, so this relies on the backend's `_get_format` and
+    `_get_thumbnail_filename`, which is why requirements.txt pins sorl to an
+    exact version; check them again when upgrading it.
+    """
+    backend = default.backend
+    source = ImageFile(name)
+    options = dict(options)
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    return ImageFile(
+        backend._get_thumbnail_filename(source, geometry, options),
+        default.storage)
+
+
+def resolve_thumbnails(names, geometry, **options):
+    """Returns the thumbnails of many images, keyed by image name.
+
+    Stored thumbnails are read with one cache `get_many`, and cache misses
+    with one key-value store query. The rest map to a `PendingThumbnail`
+    and are queued, so the page doesn't wait for them to be generated.
+    """
+    keys = {
+        add_prefix(thumbnail_file(name, geometry, options).key): name
+        for name in set(filter(None, names))
+    }
+    thumbnails = {}
+
+    cache = default.kvstore.cache
+    values = cache.get_many(list(keys))
+    missing = [key for key in keys if key not in values]
+    if missing:
+        stored = dict(KVStoreModel.objects.filter(
+            key__in=missing).values_list('key', 'value'))
+        cache.set_many(stored, sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+        values.update(stored)
+
+    for key, name in keys.items():
+        value = values.get(key)
+        if value is not None and value != EMPTY_VALUE:
+            thumbnails[name] = deserialize_image_file(value)
+        else:
+            thumbnails[name] = PendingThumbnail(geometry)
+            queue_thumbnails(name)
+
+    return thumbnails
@@ -5,6 +5,12 @@ from recipes import views
 
 urlpatterns = [
     url(r'^ingredients/$', views.IngredientList.as_view(), name='ingredients'),
+    url(r'^ingredients\.json$',
+        views.ingredient_catalog, name='ingredients-json'),
+    url(r'^ingredients/reprice/$',
+        views.reprice_ingredients, name='ingredients-reprice'),
+    url(r'^ingredients/reprice\.json$',
+        views.reprice_ingredients_json, name='ingredients-reprice-json'),
     url(r'^ingredients/(?P<pk>[0-9]+)/$',
         views.IngredientDetail.as_view(), name='ingredient-detail'),
     url(r'ingredient/add/$',
@@ -19,6 +25,7 @@ urlpatterns = [
         views.RecipeDetail.as_view(), name='recipe-detail'),
     url(r'^recipes/clone/(?P<pk>[0-9]+)/$',
         views.clone_recipe, name='recipe-clone'),
+    url(r'^recipes/clone/$', views.clone_recipes, name='recipes-clone'),
     url(r'recipe/add/$',
         views.RecipeCreate.as_view(), name='recipe-add'),
     url(r'recipe/(?P<pk>[0-9]+)/$',
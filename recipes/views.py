@@ -1,7 +1,20 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from hashlib import md5
+
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.shortcuts import redirect
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Count, Max, Q
+from django.http import Http404, JsonResponse
+from django.shortcuts import redirect, render
 from django.urls import reverse_lazy
 from django.utils.decorators import method_decorator
+from django.utils.functional import SimpleLazyObject, cached_property
+from django.utils.translation import get_language
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_POST
 from django.views.generic import (
     DetailView,
     ListView,
@@ -12,8 +25,24 @@ from django.views.generic.edit import (
     UpdateView,
 )
 
-from recipes.forms import IngredientForm, RecipeForm, RecipePartFormset
-from recipes.models import Ingredient, Recipe
+from glaze.cache import fragment_cache_namespace, user_cache_version
+from recipes.costing import simulate_repricing
+from recipes.forms import (
+    IngredientForm,
+    IngredientListOptionsForm,
+    RecipeForm,
+    RecipeListOptionsForm,
+    RecipePartFormset,
+    RepricingFormset,
+)
+from recipes.models import (
+    Ingredient,
+    IngredientUsage,
+    Recipe,
+    RecipeCostBreakdown,
+    RecipePart,
+)
+from recipes.thumbnails import LIST_THUMBNAIL, resolve_thumbnails
 
 
 class UserBound:
@@ -42,51 +71,285 @@ class UserBound:
         return reverse_lazy(self.model.path_prefix_plural)
 
 
+class ConditionalGet:
+    """Answers unchanged pages with a 304, before rendering anything.
+
+    Pages are only validated by ETag. A modification time can't account for
+    the rest of what the page depends on, like the currency, the language or
+    the cache version, so it would keep stale pages.
+    """
+    def get_validators(self):
+        """Returns the values that change whenever the page does, or `None`
+        to render the page without validating it, which is the default.
+        """
+        return None
+
+    def get_etag(self, values):
+        user = self.request.user
+        # The cache version changes along with the cached fragments, even
+        # for changes the validators don't see, like generated thumbnails.
+        key = [
+            user.pk, user.is_staff, user.profile.currency, get_language(),
+            self.request.META.get('CSRF_COOKIE'), user_cache_version(user.pk),
+        ] + list(values)
+        return md5(repr(key).encode()).hexdigest()
+
+    def get(self, request, *args, **kwargs):
+        values = self.get_validators()
+        if values is None:
+            return super().get(request, *args, **kwargs)
+
+        view = cache_control(private=True, no_cache=True)(condition(
+            etag_func=lambda request, *args, **kwargs: self.get_etag(values),
+        )(super().get))
+        return view(request, *args, **kwargs)
+
+
+class KeysetPage:
+    """A page of rows, fetched only when it's first used.
+
+    Pages rendered from the fragment cache never touch the database.
+    """
+    def __init__(self, load):
+        self._load = load
+
+    @cached_property
+    def _window(self):
+        return self._load()
+
+    @property
+    def object_list(self):
+        return self._window[0]
+
+    @property
+    def next_query(self):
+        return self._window[1]
+
+    @property
+    def previous_query(self):
+        return self._window[2]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_query is not None
+
+    def has_previous(self):
+        return self.previous_query is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class FragmentCached:
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['fragment_cache_namespace'] = fragment_cache_namespace(
+            self.request.user)
+        context['fragment_cache_timeout'] = settings.FRAGMENT_CACHE_TIMEOUT
+        return context
+
+
+class KeysetPagination:
+    """Paginates by seeking from the last row seen.
+
+    Pages are fetched with `WHERE (field, pk) > (value, last_pk)` instead of
+    an OFFSET, so every page costs the same no matter how deep it is.
+    """
+    paginate_by = 50
+
+    def encode_cursor(self, obj, field):
+        value = field.get_prep_value(getattr(obj, field.attname))
+        if not isinstance(value, (int, str)):
+            value = value.isoformat() if hasattr(value, 'isoformat') else str(
+                value)
+        return urlsafe_b64encode(
+            json.dumps([value, obj.pk]).encode()).decode()
+
+    def decode_cursor(self, cursor, field):
+        try:
+            value, pk = json.loads(urlsafe_b64decode(cursor.encode()).decode())
+            return field.to_python(value), int(pk)
+        except (TypeError, ValueError, ValidationError):
+            raise Http404('Invalid page')
+
+    def seek(self, field_name, value, pk, descending):
+        lookup = 'lt' if descending else 'gt'
+        return (
+            Q(**{'{}__{}'.format(field_name, lookup): value}) |
+            Q(**{field_name: value, 'pk__{}'.format(lookup): pk})
+        )
+
+    def page_query(self, **cursor):
+        query = self.request.GET.copy()
+        query.pop('after', None)
+        query.pop('before', None)
+        query.update(cursor)
+        return query.urlencode()
+
+    def prepare_page(self, object_list):
+        """Attaches extra data to the rows of a page, once they're loaded."""
+
+    def keyset_page(self, queryset, page_size, field_name, descending):
+        """Returns the page of `queryset` the request's cursor points to.
+
+        The queryset must already be ordered by `field_name` and pk.
+        """
+        field = queryset.model._meta.get_field(field_name)
+        after = self.request.GET.get('after')
+        before = self.request.GET.get('before')
+
+        if after:
+            value, pk = self.decode_cursor(after, field)
+            queryset = queryset.filter(
+                self.seek(field_name, value, pk, descending))
+        elif before:
+            value, pk = self.decode_cursor(before, field)
+            queryset = queryset.filter(
+                self.seek(field_name, value, pk, not descending)).reverse()
+
+        def load():
+            object_list = list(queryset[:page_size + 1])
+            has_more = len(object_list) > page_size
+            object_list = object_list[:page_size]
+            if before:
+                object_list.reverse()
+            self.prepare_page(object_list)
+
+            has_next = bool(before) or has_more
+            has_previous = bool(after) or (bool(before) and has_more)
+            next_query = previous_query = None
+            if has_next and object_list:
+                next_query = self.page_query(
+                    after=self.encode_cursor(object_list[-1], field))
+            if has_previous and object_list:
+                previous_query = self.page_query(
+                    before=self.encode_cursor(object_list[0], field))
+            return object_list, next_query, previous_query
+
+        return KeysetPage(load)
+
+
+class KeysetPaginated(KeysetPagination):
+    """Sorts, filters and paginates a list with its list options form."""
+    list_options_form_class = None
+
+    def get_list_options(self):
+        if not hasattr(self, 'list_options'):
+            self.list_options = self.list_options_form_class(self.request.GET)
+        return self.list_options
+
+    def get_queryset(self):
+        options = self.get_list_options()
+        field_name, descending = options.sort
+        order = ['-' + field_name, '-pk'] if descending else [field_name, 'pk']
+        return super().get_queryset().filter(**options.filters).order_by(
+            *order)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['list_options'] = self.get_list_options()
+        return context
+
+    def paginate_queryset(self, queryset, page_size):
+        field_name, descending = self.get_list_options().sort
+        page = self.keyset_page(queryset, page_size, field_name, descending)
+        return None, page, page, SimpleLazyObject(page.has_other_pages)
+
+
 class IngredientBound(UserBound):
     model = Ingredient
     form_class = IngredientForm
 
 
+class IngredientUsagePaginated(KeysetPagination):
+    """Pages through the recipes that use the ingredient being shown."""
+    def get_usage_queryset(self):
+        return Recipe.objects.for_user(
+            self.request.user).with_ingredient_usage(self.object).order_by(
+            'name', 'pk')
+
+    def prepare_page(self, object_list):
+        for recipe in object_list:
+            recipe.usage = IngredientUsage(recipe, self.object)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['usage_page'] = self.keyset_page(
+            self.get_usage_queryset(), self.paginate_by, 'name', False)
+        return context
+
+
 class RecipeBound(UserBound):
     model = Recipe
     form_class = RecipeForm
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        instance = getattr(self, 'object', None)
-        form_kwargs = {
-            'user': self.request.user,
-        }
 
-        if self.request.POST:
-            context['recipe_part_form'] = RecipePartFormset(
-                self.request.POST, instance=instance, form_kwargs=form_kwargs)
-        else:
-            context['recipe_part_form'] = RecipePartFormset(
-                instance=instance, form_kwargs=form_kwargs)
+class RecipeFormBound(RecipeBound):
+    def get_recipe_part_form(self):
+        if not hasattr(self, 'recipe_part_form'):
+            instance = getattr(self, 'object', None)
+            form_kwargs = {
+                'user': self.request.user,
+            }
+
+            if self.request.POST:
+                self.recipe_part_form = RecipePartFormset(
+                    self.request.POST, instance=instance,
+                    form_kwargs=form_kwargs)
+            else:
+                self.recipe_part_form = RecipePartFormset(
+                    instance=instance, form_kwargs=form_kwargs)
 
+        return self.recipe_part_form
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['recipe_part_form'] = self.get_recipe_part_form()
         return context
 
     def form_valid(self, form):
-        context = self.get_context_data()
-        recipe_part_form = context['recipe_part_form']
-        if recipe_part_form.is_valid():
+        recipe_part_form = self.get_recipe_part_form()
+        if not recipe_part_form.is_valid():
+            return self.form_invalid(form=form)
+
+        with transaction.atomic():
             self.object = form.save()
             recipe_part_form.instance = self.object
             recipe_part_form.save()
-            return super().form_valid(form=form)
-        else:
-            return super().form_invalid(form=form)
+
+        return redirect(self.get_success_url())
 
 
 @method_decorator(login_required, name='dispatch')
-class IngredientList(IngredientBound, ListView):
-    pass
+class IngredientList(ConditionalGet, FragmentCached, KeysetPaginated,
+                     IngredientBound, ListView):
+    list_options_form_class = IngredientListOptionsForm
+
+    def get_validators(self):
+        # Without a deletion timestamp, only the count reveals deletions.
+        stats = Ingredient.objects.for_user(self.request.user).aggregate(
+            count=Count('pk'), updated=Max('updated'))
+        return stats['count'], stats['updated']
 
 
 @method_decorator(login_required, name='dispatch')
-class IngredientDetail(IngredientBound, DetailView):
-    pass
+class IngredientDetail(ConditionalGet, IngredientUsagePaginated,
+                       IngredientBound, DetailView):
+    def get_validators(self):
+        updated = self.get_queryset().filter(
+            pk=self.kwargs['pk']).values_list('updated', flat=True).first()
+        if updated is None:
+            return None
+        # Recipe costs are stored with their own `updated` bump, so any
+        # change in the usage section shows up in this aggregate.
+        stats = Recipe.objects.for_user(self.request.user).aggregate(
+            count=Count('pk'), updated=Max('updated'))
+        return updated, stats['count'], stats['updated']
 
 
 @method_decorator(login_required, name='dispatch')
@@ -100,27 +363,65 @@ class IngredientUpdate(IngredientBound, UpdateView):
 
 
 @method_decorator(login_required, name='dispatch')
-class IngredientDelete(IngredientBound, DeleteView):
-    pass
+class IngredientDelete(IngredientUsagePaginated, IngredientBound, DeleteView):
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['impact'] = RecipePart.objects.filter(
+            ingredient=self.object).aggregate(
+            parts=Count('pk'), recipes=Count('recipe', distinct=True))
+        return context
 
 
 @method_decorator(login_required, name='dispatch')
-class RecipeList(RecipeBound, ListView):
-    pass
+class RecipeList(ConditionalGet, FragmentCached, KeysetPaginated,
+                 RecipeBound, ListView):
+    list_options_form_class = RecipeListOptionsForm
+
+    def prepare_page(self, object_list):
+        geometry, options = LIST_THUMBNAIL
+        thumbnails = resolve_thumbnails(
+            [recipe.image.name for recipe in object_list], geometry,
+            **options)
+        for recipe in object_list:
+            recipe.thumbnail = thumbnails.get(recipe.image.name)
+
+    def get_validators(self):
+        # Recipe costs are stored with their own `updated` bump, so ingredient
+        # price changes already show up in this aggregate.
+        stats = Recipe.objects.for_user(self.request.user).aggregate(
+            count=Count('pk'), updated=Max('updated'))
+        return stats['count'], stats['updated']
 
 
 @method_decorator(login_required, name='dispatch')
-class RecipeDetail(RecipeBound, DetailView):
-    pass
+class RecipeDetail(ConditionalGet, FragmentCached, RecipeBound, DetailView):
+    def get_validators(self):
+        stats = self.get_queryset().filter(pk=self.kwargs['pk']).aggregate(
+            updated=Max('updated'),
+            parts=Count('recipepart'),
+            parts_updated=Max('recipepart__updated'),
+            ingredients_updated=Max('recipepart__ingredient__updated'),
+        )
+        if stats['updated'] is None:
+            return None
+        return (
+            stats['parts'], stats['updated'], stats['parts_updated'],
+            stats['ingredients_updated'],
+        )
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['cost_breakdown'] = RecipeCostBreakdown(self.object)
+        return context
 
 
 @method_decorator(login_required, name='dispatch')
-class RecipeCreate(RecipeBound, CreateView):
+class RecipeCreate(RecipeFormBound, CreateView):
     pass
 
 
 @method_decorator(login_required, name='dispatch')
-class RecipeUpdate(RecipeBound, UpdateView):
+class RecipeUpdate(RecipeFormBound, UpdateView):
     pass
 
 
@@ -133,3 +434,87 @@ class RecipeDelete(RecipeBound, DeleteView):
 def clone_recipe(request, pk):
     recipe = Recipe.objects.for_user(request.user).get(pk=pk).clone()
     return redirect('recipe-update', pk=recipe.pk)
+
+
+@login_required
+@require_POST
+def clone_recipes(request):
+    recipes = Recipe.objects.for_user(request.user)
+    if not request.POST.get('all'):
+        recipes = recipes.filter(pk__in=[
+            pk for pk in request.POST.getlist('pk') if pk.isdigit()])
+    recipes.order_by('pk').clone()
+    return redirect('recipes')
+
+
+def ingredient_catalog_etag(request):
+    stats = Ingredient.objects.for_user(request.user).aggregate(
+        count=Count('pk'), updated=Max('updated'))
+    return '{}-{}-{}'.format(
+        request.user.pk, stats['count'],
+        stats['updated'].timestamp() if stats['updated'] else 0)
+
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=ingredient_catalog_etag)
+def ingredient_catalog(request):
+    ingredients = Ingredient.objects.for_user(request.user).values(
+        'id', 'name')
+    return JsonResponse(list(ingredients), safe=False)
+
+
+def repricing_formset(user, data=None):
+    return RepricingFormset(data, form_kwargs={'user': user})
+
+
+@login_required
+def reprice_ingredients(request):
+    repricings = None
+    if request.method == 'POST':
+        formset = repricing_formset(request.user, request.POST)
+        if formset.is_valid():
+            repricings = simulate_repricing(
+                Recipe.objects.for_user(request.user), formset.prices)
+    else:
+        formset = repricing_formset(request.user)
+
+    return render(request, 'recipes/ingredient_reprice.html', {
+        'formset': formset,
+        'repricings': repricings,
+    })
+
+
+@login_required
+@require_POST
+def reprice_ingredients_json(request):
+    """Simulates new prices sent as `{"prices": {"<pk>": "<price>"}}`."""
+    try:
+        prices = json.loads(request.body.decode())['prices']
+        prices = list(prices.items())
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+
+    data = {
+        'form-TOTAL_FORMS': len(prices),
+        'form-INITIAL_FORMS': 0,
+    }
+    for index, (ingredient, price) in enumerate(prices):
+        data['form-{}-ingredient'.format(index)] = ingredient
+        data['form-{}-price'.format(index)] = price
+    formset = repricing_formset(request.user, data)
+    if not formset.is_valid():
+        return JsonResponse({'errors': formset.errors}, status=400)
+
+    repricings = simulate_repricing(
+        Recipe.objects.for_user(request.user), formset.prices)
+    return JsonResponse({'recipes': [
+        {
+            'id': repricing.recipe_id,
+            'name': repricing.name,
+            'old_cost': str(repricing.old_cost),
+            'new_cost': str(repricing.new_cost),
+            'delta': str(repricing.delta),
+        }
+        for repricing in repricings
+    ]})